@@ -3,6 +3,7 @@ from .data import *
 from .models import *
 from .trainer import *
 from .pipeline import *
+from .population import *
 from .protocol import *
 from .inference import *
 from .configs import Configs
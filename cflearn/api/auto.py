@@ -29,6 +29,7 @@ from .hpo import OptunaPresetParams
 from .production import Pack
 from .production import Predictor
 from ..types import data_type
+from ..pipeline import Pipeline
 from ..types import general_config_type
 from ..configs import _parse_config
 from ..protocol import DataProtocol
@@ -137,6 +138,8 @@ class Auto:
         num_final_repeat: int = 20,
         extra_config: general_config_type = None,
         cuda: Optional[Union[str, int]] = None,
+        fidelity_config: Optional[Dict[str, Any]] = None,
+        reuse_top_k: int = 0,
     ) -> "Auto":
         self.best_params = {}
         self.optuna_results = {}
@@ -169,6 +172,8 @@ class Auto:
                 temp_folder=optuna_folder,
                 extra_config=extra_config,
                 cuda=cuda,
+                fidelity_config=fidelity_config,
+                save_pipelines=reuse_top_k > 0,
             )
             tuner = optuna_result.tuner
             best_param = optuna_result.best_param
@@ -191,7 +196,33 @@ class Auto:
         }
         assert tuner is not None
         x, y, x_cv, y_cv = tuner.make_data()
-        self.repeat_result = repeat_with(x, y, x_cv, y_cv, **repeat_config)
+        if reuse_top_k <= 0:
+            self.repeat_result = repeat_with(x, y, x_cv, y_cv, **repeat_config)
+        else:
+            # pipelines trained by the top trials are reused, and only the
+            # missing ones will be trained with the best params
+            pipelines: Dict[str, List[Pipeline]] = {}
+            for model in self.models:
+                optuna_result = self.optuna_results[model]
+                reused = optuna_result.load_pipelines(reuse_top_k)[:num_final_repeat]
+                num_missing = num_final_repeat - len(reused)
+                if num_missing > 0:
+                    local_config = shallow_copy_dict(repeat_config)
+                    local_config["models"] = model
+                    local_config["num_repeat"] = num_missing
+                    local_temp_folder = os.path.join(repeat_temp_folder, model)
+                    local_config["temp_folder"] = local_temp_folder
+                    result = repeat_with(x, y, x_cv, y_cv, **local_config)
+                    assert result.pipelines is not None
+                    reused.extend(result.pipelines[model])
+                pipelines[model] = reused
+            predict_config = predict_config or {}
+            model_patterns = {
+                model: [m.to_pattern(**predict_config) for m in model_pipelines]
+                for model, model_pipelines in pipelines.items()
+            }
+            data = model_patterns[self.models[0]][0].model.data
+            self.repeat_result = RepeatResult(data, None, pipelines, model_patterns)
         self.pipelines = self.repeat_result.pipelines
         self.patterns = self.repeat_result.patterns
         self.data = self.repeat_result.data
@@ -1,9 +1,14 @@
 import os
+import sys
+import json
+import zipfile
+import multiprocessing
 
 import numpy as np
 
 from typing import *
 from tqdm.autonotebook import tqdm
+from concurrent.futures import ProcessPoolExecutor
 from cftool.misc import update_dict
 from cftool.misc import shallow_copy_dict
 from cftool.misc import lock_manager
@@ -19,8 +24,11 @@ from cfdata.tabular import parse_task_type
 from cfdata.tabular import TaskTypes
 
 from ..dist import Task
+from ..dist import WorkerPool
 from ..dist import Experiment
 from ..dist import ExperimentResults
+from ..dist import ResultCache
+from ..dist import fingerprint_data
 from ..types import data_type
 from ..types import general_config_type
 from ..configs import _parse_config
@@ -29,6 +37,7 @@ from ..trainer import TrainerCallback
 from ..trainer import IntermediateResults
 from ..pipeline import Pipeline
 from ..pipeline import ExternalPipelineProtocol
+from ..population import fit_population
 from ..protocol import DataProtocol
 from ..misc._api import _to_saving_path
 from ..misc._api import _make_saving_path
@@ -397,13 +406,162 @@ def task_loader(saving_folder: str, compress: bool = True) -> Pipeline:
     return list(load(saving_folder=saving_folder, compress=compress).values())[0][0]
 
 
-def load_experiment_results(results: ExperimentResults) -> Dict[str, List[Pipeline]]:
-    pipelines_dict: Dict[str, Dict[int, Pipeline]] = {}
+class PipelineHandle:
+    """
+    A lazy handle of the pipeline saved (by `cflearn.save`) in `saving_folder`
+
+    * the pipeline will be loaded on first use (e.g. `handle.predict(x)`), and
+    every attribute of the loaded pipeline can be accessed from the handle
+    * `final_results` & `final_score` are read without loading the pipeline
+
+    """
+
+    def __init__(self, saving_folder: str, *, compress: bool = True):
+        self.saving_folder = saving_folder
+        self.compress = compress
+        self._pipeline: Optional[Pipeline] = None
+        self._final_results: Optional[IntermediateResults] = None
+
+    def __getattr__(self, item: str) -> Any:
+        if item.startswith("__") or "_pipeline" not in self.__dict__:
+            raise AttributeError(item)
+        return getattr(self.pipeline, item)
+
+    def __str__(self) -> str:
+        status = "loaded" if self.is_loaded else "lazy"
+        return f"PipelineHandle({self.saving_folder}, {status})"
+
+    __repr__ = __str__
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._pipeline is not None
+
+    @property
+    def pipeline(self) -> Pipeline:
+        if self._pipeline is None:
+            self._pipeline = task_loader(self.saving_folder, self.compress)
+        return self._pipeline
+
+    @pipeline.setter
+    def pipeline(self, value: Pipeline) -> None:
+        self._pipeline = value
+
+    @property
+    def final_results(self) -> IntermediateResults:
+        if self._pipeline is not None:
+            final_results = self._pipeline.trainer.final_results
+            if final_results is None:
+                raise ValueError(f"training of `Pipeline` ({self}) is corrupted")
+            return final_results
+        if self._final_results is None:
+            paths = _fetch_saving_paths(saving_folder=self.saving_folder)
+            if not paths:
+                raise ValueError(f"nothing is saved in '{self.saving_folder}'")
+            export_path = list(paths.values())[0][0]
+            file = Pipeline.final_results_file
+            if not self.compress:
+                with open(os.path.join(export_path, file), "r") as f:
+                    fields = json.load(f)
+            else:
+                with zipfile.ZipFile(f"{export_path}.zip", "r") as zip_file:
+                    fields = json.loads(zip_file.read(file))
+            self._final_results = IntermediateResults(*fields)
+        return self._final_results
+
+    @property
+    def final_score(self) -> float:
+        return self.final_results.final_score
+
+
+def load_pipelines(
+    saving_folders: List[str],
+    *,
+    compress: bool = True,
+    num_jobs: int = 1,
+) -> List[Pipeline]:
+    """
+    Loads pipelines saved in `saving_folders`
+
+    * if `num_jobs` > 1, pipelines will be built in a pool of `num_jobs` processes
+    and then sent back, which is faster when there are many (large) pipelines.
+    This requires python 3.7+, otherwise pipelines will be loaded one by one
+
+    """
+
+    num_jobs = min(num_jobs, len(saving_folders))
+    # `mp_context` of `ProcessPoolExecutor` requires python 3.7+
+    if num_jobs <= 1 or sys.version_info < (3, 7):
+        return [task_loader(folder, compress) for folder in saving_folders]
+    # `spawn` is used because forking a process with torch threads is unsafe
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(num_jobs, mp_context=ctx) as executor:
+        compress_list = [compress] * len(saving_folders)
+        return list(executor.map(task_loader, saving_folders, compress_list))
+
+
+def preload_pipelines(handles: List[PipelineHandle], *, num_jobs: int = 1) -> None:
+    """loads the lazy handles (which are not loaded yet) at once"""
+    handles = [handle for handle in handles if not handle.is_loaded]
+    for compress in [True, False]:
+        local_handles = [handle for handle in handles if handle.compress == compress]
+        folders = [handle.saving_folder for handle in local_handles]
+        pipelines = load_pipelines(folders, compress=compress, num_jobs=num_jobs)
+        for handle, pipeline in zip(local_handles, pipelines):
+            handle.pipeline = pipeline
+
+
+def _experiment_handles(results: ExperimentResults) -> Dict[str, List[PipelineHandle]]:
+    handles_dict: Dict[str, Dict[int, PipelineHandle]] = {}
     for workplace, workplace_key in zip(results.workplaces, results.workplace_keys):
-        pipeline = task_loader(workplace)
         model, str_i = workplace_key
-        pipelines_dict.setdefault(model, {})[int(str_i)] = pipeline
-    return {k: [v[i] for i in sorted(v)] for k, v in pipelines_dict.items()}
+        handles_dict.setdefault(model, {})[int(str_i)] = PipelineHandle(workplace)
+    return {k: [v[i] for i in sorted(v)] for k, v in handles_dict.items()}
+
+
+def _load_handles(
+    handles: Dict[str, List[PipelineHandle]],
+    num_jobs: int,
+) -> Dict[str, List[Pipeline]]:
+    flattened = [
+        handle for model_handles in handles.values() for handle in model_handles
+    ]
+    preload_pipelines(flattened, num_jobs=num_jobs)
+    return {k: [handle.pipeline for handle in v] for k, v in handles.items()}
+
+
+def load_experiment_results(
+    results: ExperimentResults,
+    *,
+    lazy: bool = False,
+    num_jobs: int = 1,
+) -> Union[Dict[str, List[Pipeline]], Dict[str, List[PipelineHandle]]]:
+    """
+    Loads pipelines of an experiment, grouped by model
+
+    * if `lazy` is True, `PipelineHandle`s will be returned instead
+    * if `num_jobs` > 1, pipelines will be loaded in parallel (see `load_pipelines`)
+
+    """
+
+    handles = _experiment_handles(results)
+    if lazy:
+        return handles
+    return _load_handles(handles, num_jobs)
+
+
+def _cache_pipeline(
+    cache: ResultCache,
+    cache_key: str,
+    m: Pipeline,
+    model: str,
+    compress: bool,
+) -> None:
+    saving_folder = m.logging_folder
+    save(m, saving_folder=saving_folder, compress=compress)
+    scores_path = os.path.join(m.trainer.checkpoint_folder, ResultCache.scores_file)
+    meta = {"model": model, "compress": compress}
+    cache.put(cache_key, saving_folder, scores_path=scores_path, meta=meta)
 
 
 class RepeatResult(NamedTuple):
@@ -411,6 +569,7 @@ class RepeatResult(NamedTuple):
     experiment: Optional[Experiment]
     pipelines: Optional[Dict[str, List[Pipeline]]]
     patterns: Optional[Dict[str, List[ModelPattern]]]
+    handles: Optional[Dict[str, List[PipelineHandle]]] = None
 
     @property
     def trainers(self) -> Optional[Dict[str, List[Trainer]]]:
@@ -420,6 +579,9 @@ class RepeatResult(NamedTuple):
 
     @property
     def final_results(self) -> Optional[Dict[str, List[IntermediateResults]]]:
+        # scores of lazy handles are read without loading the pipelines
+        if self.pipelines is None and self.handles is not None:
+            return {k: [h.final_results for h in v] for k, v in self.handles.items()}
         trainers = self.trainers
         if trainers is None:
             return None
@@ -435,6 +597,13 @@ class RepeatResult(NamedTuple):
 
 
 # If `x_cv` is not provided, then `KRandom` split will be performed
+# `trial` & `repeat_callback` only take effect when `sequential` is True
+# If `cache_folder` is provided, pipelines trained before (with identical data,
+#  model, config & repeat index) will be loaded from the `ResultCache`
+# If `resume` is True, tasks finished in a previous (interrupted) call with the same
+#  `temp_folder` will be skipped, which only takes effect when `sequential` is False
+# If `return_patterns` is False (which only takes effect when `sequential` is False),
+#  `pipelines` will be None, and lazy `handles` (`PipelineHandle`) will be returned
 def repeat_with(
     x: data_type,
     y: data_type = None,
@@ -451,6 +620,14 @@ def repeat_with(
     return_patterns: bool = True,
     compress: bool = True,
     use_tqdm: bool = True,
+    thread_config: Optional[Dict[str, Any]] = None,
+    executor: str = "process",
+    trial: Optional[Any] = None,
+    repeat_callback: Optional[Callable[[str, int, Pipeline], None]] = None,
+    cache_folder: Optional[str] = None,
+    scheduler_config: Optional[Dict[str, Any]] = None,
+    resume: bool = False,
+    population: bool = False,
     **kwargs: Any,
 ) -> RepeatResult:
     if isinstance(models, str):
@@ -474,6 +651,7 @@ def repeat_with(
         return shallow_copy_dict(fetched)
 
     pipelines_dict: Optional[Dict[str, List[Pipeline]]] = None
+    handles_dict: Optional[Dict[str, List[PipelineHandle]]] = None
     if sequential:
         experiment = None
         kwargs["tqdm_position"] = 2
@@ -484,13 +662,25 @@ def repeat_with(
                 "will always be generated"
             )
             return_patterns = True
+        if population and trial is not None:
+            print(
+                f"{LoggingMixin.warning_prefix}`population` is not supported "
+                "when `trial` is provided, repeats will be trained one by one"
+            )
+            population = False
         pipelines_dict = {}
+        num_cached = 0
+        cache = data_fingerprint = None
+        if cache_folder is not None:
+            cache = ResultCache(cache_folder)
+            data_fingerprint = fingerprint_data(x, y, x_cv, y_cv)
         if not use_tqdm:
             iterator = models
         else:
             iterator = tqdm(models, total=len(models), position=0)
         for model in iterator:
             local_pipelines = []
+            members: List[Tuple[Pipeline, Optional[str]]] = []
             sub_iterator = range(num_repeat)
             if use_tqdm:
                 sub_iterator = tqdm(
@@ -503,15 +693,56 @@ def repeat_with(
                 local_config = fetch_config(i, model)
                 logging_folder = os.path.join(temp_folder, model, str(i))
                 local_config.setdefault("logging_folder", logging_folder)
-                m = make(model, **shallow_copy_dict(local_config))
-                local_pipelines.append(m.fit(x, y, x_cv, y_cv))
+                cache_key = entry = None
+                if cache is not None:
+                    assert data_fingerprint is not None
+                    args = data_fingerprint, model, local_config, i
+                    cache_key = ResultCache.make_key(*args)
+                    entry = cache.get(cache_key)
+                if entry is not None:
+                    m = task_loader(entry.folder, entry.compress)
+                    num_cached += 1
+                else:
+                    m = make(model, **shallow_copy_dict(local_config))
+                    if trial is not None:
+                        m.trial = trial
+                    if population:
+                        members.append((m, cache_key))
+                    else:
+                        m.fit(x, y, x_cv, y_cv)
+                        if cache is not None:
+                            assert cache_key is not None
+                            _cache_pipeline(cache, cache_key, m, model, compress)
+                local_pipelines.append(m)
+                if repeat_callback is not None and not population:
+                    repeat_callback(model, i, m)
+            # repeats which are not cached are trained as a (vectorized) population
+            if members:
+                fit_population([m for m, _ in members], x, y, x_cv, y_cv)
+                if cache is not None:
+                    for m, cache_key in members:
+                        assert cache_key is not None
+                        _cache_pipeline(cache, cache_key, m, model, compress)
+            if repeat_callback is not None and population:
+                for i, m in enumerate(local_pipelines):
+                    repeat_callback(model, i, m)
             pipelines_dict[model] = local_pipelines
+        if num_cached > 0:
+            print(
+                f"{LoggingMixin.info_prefix}{num_cached} / {len(models) * num_repeat} "
+                "pipelines are loaded from cache"
+            )
     else:
         if num_jobs <= 1:
             print(
                 f"{LoggingMixin.warning_prefix}we suggest setting `sequential` "
                 f"to True when `num_jobs` is {num_jobs}"
             )
+        if population:
+            print(
+                f"{LoggingMixin.warning_prefix}`population` is only available "
+                "when `sequential` is True, so it will take no effect"
+            )
         # data
         data_folder = Experiment.dump_data_bundle(
             x,
@@ -521,7 +752,13 @@ def repeat_with(
             workplace=temp_folder,
         )
         # experiment
-        experiment = Experiment(num_jobs=num_jobs)
+        experiment = Experiment(
+            num_jobs=num_jobs,
+            thread_config=thread_config,
+            executor=executor,
+            cache_folder=cache_folder,
+            scheduler_config=scheduler_config,
+        )
         for model in models:
             for i in range(num_repeat):
                 local_config = fetch_config(i, model)
@@ -533,9 +770,12 @@ def repeat_with(
                     data_folder=data_folder,
                 )
         # finalize
-        results = experiment.run_tasks(use_tqdm=use_tqdm)
+        results = experiment.run_tasks(use_tqdm=use_tqdm, resume=resume)
         if return_patterns:
-            pipelines_dict = load_experiment_results(results)
+            pipelines_dict = _load_handles(_experiment_handles(results), num_jobs)
+        else:
+            # pipelines will only be loaded on demand
+            handles_dict = _experiment_handles(results)
 
     patterns = None
     if return_patterns:
@@ -551,7 +791,7 @@ def repeat_with(
     if patterns is not None:
         data = patterns[models[0]][0].model.data
 
-    return RepeatResult(data, experiment, pipelines_dict, patterns)
+    return RepeatResult(data, experiment, pipelines_dict, patterns, handles_dict)
 
 
 def make_toy_model(
@@ -621,12 +861,16 @@ __all__ = [
     "load",
     "evaluate",
     "task_loader",
+    "PipelineHandle",
+    "load_pipelines",
+    "preload_pipelines",
     "load_experiment_results",
     "repeat_with",
     "make_toy_model",
     "switch_trainer_callback",
     "Task",
     "Experiment",
+    "WorkerPool",
     "ModelPattern",
     "EnsemblePattern",
     "RepeatResult",
@@ -17,6 +17,7 @@ from ..misc.toolkit import *
 from .register import register_metric
 from ..types import data_type
 from ..pipeline import Pipeline
+from ..population import fit_population
 from ..protocol import DataProtocol
 
 
@@ -85,7 +86,49 @@ class Ensemble:
         temp_folder: str = "__tmp__",
         return_patterns: bool = True,
         use_tqdm: bool = True,
+        bootstrap: bool = False,
+        seeds: Optional[List[int]] = None,
     ) -> EnsembleResults:
+        """
+        Trains `k` models for bagging
+
+        * if `bootstrap` is True, the data will be read & processed only once, and
+        each model will be trained on its own bootstrap sample, which is an index
+        view over the shared training set (so it replaces the imbalance sampling
+        of the training loader). All models are trained in current process (see
+        `fit_population`), so `num_jobs` > 1, `sequential=False` and
+        `return_patterns=False` are not supported
+        * otherwise, `k` models will be trained on the full data by `repeat_with`
+        * `seeds` are only used when `bootstrap` is True, see `fit_population`
+
+        """
+
+        if bootstrap:
+            if num_jobs > 1 or sequential is False or not return_patterns:
+                raise ValueError(
+                    "bootstrap models are trained in current process, so "
+                    "`num_jobs` > 1, `sequential=False` and `return_patterns=False` "
+                    "are not supported when `bootstrap` is True"
+                )
+            config = shallow_copy_dict(self.config)
+            update_dict(shallow_copy_dict(increment_config or {}), config)
+            config.setdefault("use_tqdm", use_tqdm)
+            config.setdefault("trigger_logging", False)
+            config.setdefault("verbose_level", 0)
+            bootstrap_pipelines = []
+            for i in range(k):
+                cfg = shallow_copy_dict(config)
+                cfg["logging_folder"] = os.path.join(temp_folder, model, str(i))
+                bootstrap_pipelines.append(make(model, **cfg))
+            fit_population(bootstrap_pipelines, x, y, seeds=seeds, bootstrap=True)
+            bootstrap_data = bootstrap_pipelines[0].data
+            return EnsembleResults(
+                bootstrap_data,
+                bootstrap_pipelines,
+                None,
+                predict_config,
+            )
+
         repeat_result = repeat_with(
             x,
             y,
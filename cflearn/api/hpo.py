@@ -22,27 +22,41 @@ from cfdata.tabular import task_type_type
 from cfdata.tabular import parse_task_type
 from cfdata.tabular import TaskTypes
 from optuna.trial import Trial
+from optuna.trial import TrialState
+from optuna.trial import FrozenTrial
 
 from .basic import *
 from ..misc.toolkit import *
 from .ensemble import Ensemble
 from ..types import data_type
+from ..configs import Elements
 from ..pipeline import Pipeline
 from ..protocol import DataProtocol
 from ..misc._api import SAVING_DELIM
+from ..dist.storage import make_storage
+from ..dist.storage import journal_prefix
+from ..dist.storage import is_journal_available
 from ..misc.toolkit import inject_mlflow_stuffs
 
 
+def _fetch_pipelines(repeat_result: RepeatResult, model: str) -> List[Pipeline]:
+    pipelines = repeat_result.pipelines
+    if pipelines is not None:
+        return pipelines[model]
+    handles = repeat_result.handles
+    if handles is None:
+        raise ValueError("`pipelines` are not yet generated")
+    # lazy handles (`return_patterns=False`) are loaded on demand
+    return [handle.pipeline for handle in handles[model]]
+
+
 class _TunerResult(NamedTuple):
     model: str
     repeat_result: RepeatResult
 
     @property
     def pipelines(self) -> List[Pipeline]:
-        pipelines = self.repeat_result.pipelines
-        if pipelines is None:
-            raise ValueError("`pipelines` are not yet generated")
-        return pipelines[self.model]
+        return _fetch_pipelines(self.repeat_result, self.model)
 
     @property
     def patterns(self) -> List[ModelPattern]:
@@ -64,6 +78,89 @@ class _TunerResult(NamedTuple):
         return weighted_metrics
 
 
+class Fidelity(NamedTuple):
+    resource: int
+    data_ratio: float
+    epoch_ratio: float
+    num_repeat: int
+
+
+def get_fidelities(num_repeat: int, fidelity_config: Dict[str, Any]) -> List[Fidelity]:
+    """
+    Generates the rungs of multi-fidelity search
+
+    * the i-th rung uses `reduction_factor ** i` resources, which aligns with
+    `optuna.pruners.HyperbandPruner(1, reduction_factor ** (num_rungs - 1))`
+    * data ratio, epoch ratio & number of repeats increase geometrically from
+    their minimum values to the full fidelity at the last rung
+
+    Parameters
+    ----------
+    fidelity_config : Dict[str, Any]
+    * num_rungs : int, number of rungs
+    * reduction_factor : int, 1 / reduction_factor trials are promoted at each rung
+    * min_data_ratio : float, subsample ratio of the training data at the first rung
+    * min_epoch_ratio : float, ratio of the epochs at the first rung
+    * min_repeat_ratio : float, ratio of `num_repeat` at the first rung
+
+    """
+
+    num_rungs = fidelity_config.setdefault("num_rungs", 3)
+    reduction_factor = fidelity_config.setdefault("reduction_factor", 3)
+    default_ratio = float(reduction_factor) ** (1 - num_rungs)
+    min_data_ratio = fidelity_config.setdefault("min_data_ratio", default_ratio)
+    min_epoch_ratio = fidelity_config.setdefault("min_epoch_ratio", default_ratio)
+    min_repeat_ratio = fidelity_config.setdefault("min_repeat_ratio", default_ratio)
+
+    def _ratio(min_ratio: float, i: int) -> float:
+        if num_rungs <= 1:
+            return 1.0
+        return min_ratio ** ((num_rungs - 1 - i) / (num_rungs - 1))
+
+    fidelities = []
+    for i in range(num_rungs):
+        repeat_ratio = _ratio(min_repeat_ratio, i)
+        fidelities.append(
+            Fidelity(
+                reduction_factor ** i,
+                _ratio(min_data_ratio, i),
+                _ratio(min_epoch_ratio, i),
+                max(1, int(round(num_repeat * repeat_ratio))),
+            )
+        )
+    return fidelities
+
+
+def _scale_epochs(config: Dict[str, Any], ratio: float) -> None:
+    if ratio >= 1.0:
+        return None
+
+    def _scale(num: int) -> int:
+        return max(1, int(round(num * ratio)))
+
+    # epochs are resolved in the same way as `Elements`, and those specified in
+    # `trainer_config` take precedence (see `Elements.to_config`)
+    epochs = Elements.resolve_epochs(
+        config.pop("min_epoch", None),
+        config.pop("num_epoch", None),
+        config.pop("max_epoch", None),
+        config.pop("fixed_epoch", None),
+    )
+    trainer_config = shallow_copy_dict(config.get("trainer_config") or {})
+    config["trainer_config"] = trainer_config
+    keys = ["min_epoch", "num_epoch", "max_epoch"]
+    min_epoch, num_epoch, max_epoch = [
+        trainer_config.get(key, epoch) for key, epoch in zip(keys, epochs)
+    ]
+    max_epoch = _scale(max_epoch)
+    num_epoch = min(_scale(num_epoch), max_epoch)
+    if min_epoch > 0:
+        min_epoch = min(_scale(min_epoch), num_epoch)
+    trainer_config["min_epoch"] = min_epoch
+    trainer_config["num_epoch"] = num_epoch
+    trainer_config["max_epoch"] = max_epoch
+
+
 class _Tuner(LoggingMixin):
     data_file = "__data__.pt"
     config_name = "__config__"
@@ -77,6 +174,9 @@ class _Tuner(LoggingMixin):
         task_type: task_type_type = "",
         **kwargs: Any,
     ):
+        # subsets are shared across trials, so the rungs of multi-fidelity search
+        # are comparable and are not sampled again and again
+        self.subset_indices: Dict[float, np.ndarray] = {}
         # `x` will be None if `load` is called
         if x is None:
             return
@@ -126,11 +226,13 @@ class _Tuner(LoggingMixin):
             if self.task_type is None:
                 raise ValueError("either `task_type` or `metrics` should be provided")
             if repeat_result is not None:
-                if repeat_result.pipelines is None:
+                # pipelines may be lazy, so metrics are read from final results
+                final_results_dict = repeat_result.final_results
+                if final_results_dict is None:
                     raise ValueError("pipelines are not provided in `repeat_result`")
-                pipeline = list(repeat_result.pipelines.values())[0][0]
+                final_results = list(final_results_dict.values())[0][0]
                 metrics = []
-                for metric in sorted(pipeline.trainer.metrics):
+                for metric in sorted(final_results.metrics):
                     if metric in Metrics.sign_dict:
                         metrics.append(metric)
                 if not metrics:
@@ -142,16 +244,36 @@ class _Tuner(LoggingMixin):
                     metrics = ["mae", "mse"]
         return list(map(Estimator, metrics))
 
-    def make_data(self) -> Tuple[data_type, data_type, data_type, data_type]:
+    def get_subset_indices(self, num_samples: int, ratio: float) -> np.ndarray:
+        indices = self.subset_indices.get(ratio)
+        if indices is None:
+            # subsets are nested because the permutation is fixed
+            permutation = np.random.RandomState(142857).permutation(num_samples)
+            num_subset = max(1, int(round(num_samples * ratio)))
+            indices = self.subset_indices[ratio] = np.sort(permutation[:num_subset])
+        return indices
+
+    def make_data(
+        self,
+        data_ratio: float = 1.0,
+    ) -> Tuple[data_type, data_type, data_type, data_type]:
         x: data_type
         y: data_type
         if isinstance(self.x, str):
+            if data_ratio < 1.0:
+                msg = f"file datasets cannot be subsampled (data_ratio={data_ratio})"
+                raise ValueError(msg)
             y = y_cv = None
             x, x_cv = self.x, self.x_cv
         else:
             assert isinstance(self.x, (list, np.ndarray))
             assert isinstance(self.y, (list, np.ndarray))
-            x, y = self.x.copy(), self.y.copy()
+            if data_ratio >= 1.0:
+                x, y = self.x.copy(), self.y.copy()
+            else:
+                indices = self.get_subset_indices(len(self.x), data_ratio)
+                x, y = map(np.asarray, [self.x, self.y])
+                x, y = x[indices], y[indices]
             if self.x_cv is None:
                 x_cv = None
             else:
@@ -175,27 +297,55 @@ class _Tuner(LoggingMixin):
         compress: bool = True,
         cuda: Optional[str] = None,
         sequential: Optional[bool] = None,
+        trial: Optional["_RepeatTrial"] = None,
+        fidelity: Optional[Fidelity] = None,
+        return_patterns: bool = True,
     ) -> _TunerResult:
         params = update_dict(params, shallow_copy_dict(self.base_params))
         params["verbose_level"] = 0
         params["use_tqdm"] = False
         params["cuda"] = cuda
-        x, y, x_cv, y_cv = self.make_data()
-        repeat_result = repeat_with(
-            x,
-            y,
-            x_cv,
-            y_cv,
-            num_repeat=num_repeat,
+        if fidelity is None:
+            data = self.make_data()
+        else:
+            num_repeat = fidelity.num_repeat
+            _scale_epochs(params, fidelity.epoch_ratio)
+            data = self.make_data(fidelity.data_ratio)
+        if sequential is None:
+            sequential = num_parallel <= 1
+        kwargs = dict(
             num_jobs=num_parallel,
             models=model,
             compress=compress,
-            temp_folder=temp_folder,
             predict_config={"contains_labels": True},
             sequential=sequential,
+            # patterns are always generated when training sequentially
+            return_patterns=return_patterns or sequential,
             **params,
         )
-        return _TunerResult(model, repeat_result)
+        if trial is None or sequential:
+            repeat_result = repeat_with(
+                *data,
+                num_repeat=num_repeat,
+                temp_folder=temp_folder,
+                trial=trial,
+                repeat_callback=None if trial is None else trial.on_repeat_end,
+                **shallow_copy_dict(kwargs),
+            )
+            return _TunerResult(model, repeat_result)
+        # parallel repeats are performed in waves, so `trial` can be pruned
+        # between two waves
+        repeat_results = []
+        for start in range(0, num_repeat, num_parallel):
+            repeat_result = repeat_with(
+                *data,
+                num_repeat=min(num_parallel, num_repeat - start),
+                temp_folder=os.path.join(temp_folder, str(start)),
+                **shallow_copy_dict(kwargs),
+            )
+            repeat_results.append(repeat_result)
+            trial.end_repeats(_fetch_pipelines(repeat_result, model))
+        return _TunerResult(model, _merge_repeat_results(repeat_results))
 
     def save(self, export_folder: str) -> "_Tuner":
         Saving.prepare_folder(self, export_folder)
@@ -222,6 +372,79 @@ class _Tuner(LoggingMixin):
         return instance
 
 
+def _merge_repeat_results(repeat_results: List[RepeatResult]) -> RepeatResult:
+    def _merge(dicts: List[Optional[Dict[str, List[Any]]]]) -> Optional[Dict]:
+        merged: Dict[str, List[Any]] = {}
+        for d in dicts:
+            if d is None:
+                return None
+            for k, v in d.items():
+                merged.setdefault(k, []).extend(v)
+        return merged
+
+    return RepeatResult(
+        repeat_results[0].data,
+        repeat_results[-1].experiment,
+        _merge([result.pipelines for result in repeat_results]),
+        _merge([result.patterns for result in repeat_results]),
+        _merge([result.handles for result in repeat_results]),
+    )
+
+
+def _get_score(
+    tuner: _Tuner,
+    result: _TunerResult,
+    metrics: Optional[Union[str, List[str]]],
+    estimator_scoring_function: Union[str, scoring_fn_type],
+) -> float:
+    final_scores = []
+    weighted_metrics = result.weighted_metrics
+    estimators = tuner.make_estimators(metrics, result.repeat_result)
+    for estimator in estimators:
+        scoring_fn = estimator.scoring_fn(estimator_scoring_function)
+        final_scores.append(scoring_fn(weighted_metrics[estimator.type]))
+    return sum(final_scores) / len(final_scores)
+
+
+class _RepeatTrial:
+    """
+    Reports intermediate values of repeated trainings to an optuna `Trial`
+
+    * scores reported by the `Trainer` of the i-th repeat are reported at step
+    `i * step_stride + step`, so the trial can be pruned within the first epochs
+    * aggregated score of all finished repeats is reported at step
+    `num_finished * step_stride - 1`, so the trial can be pruned after each repeat
+
+    """
+
+    step_stride = 1000000
+
+    def __init__(self, trial: Trial, score_fn: Callable[[List[Pipeline]], float]):
+        self.trial = trial
+        self.score_fn = score_fn
+        self.pipelines: List[Pipeline] = []
+
+    @property
+    def num_finished(self) -> int:
+        return len(self.pipelines)
+
+    def report(self, value: float, step: int) -> None:
+        self.trial.report(value, self.num_finished * self.step_stride + step)
+
+    def should_prune(self) -> bool:
+        return self.trial.should_prune()
+
+    def end_repeats(self, pipelines: List[Pipeline]) -> None:
+        self.pipelines.extend(pipelines)
+        step = self.num_finished * self.step_stride - 1
+        self.trial.report(self.score_fn(self.pipelines), step)
+        if self.trial.should_prune():
+            raise optuna.TrialPruned()
+
+    def on_repeat_end(self, model: str, i: int, pipeline: Pipeline) -> None:
+        self.end_repeats([pipeline])
+
+
 class HPOResult(NamedTuple):
     hpo: HPOBase
     extra_config: Dict[str, Any]
@@ -248,6 +471,8 @@ def _init_extra_config(
 
 
 default_scoring = "default"
+trial_pipelines_folder = "__pipelines__"
+trial_pipelines_key = "pipelines_folder"
 
 
 def tune_with(
@@ -753,6 +978,37 @@ class OptunaResult(NamedTuple):
         update_dict(optuna_param, param)
         return self.optuna_key_mapping.convert(param)
 
+    def top_trials(self, k: int) -> List[FrozenTrial]:
+        scored = [
+            (t, t.value)
+            for t in self.study.trials
+            if t.state == TrialState.COMPLETE and t.value is not None
+        ]
+        scored.sort(key=lambda pair: pair[1], reverse=True)
+        return [t for t, _ in scored[:k]]
+
+    def load_pipelines(
+        self,
+        top_k: int = 1,
+        *,
+        compress: bool = True,
+    ) -> List[Pipeline]:
+        """
+        Loads the pipelines trained by the top-k trials
+
+        * `save_pipelines` should be True when calling `optuna_tune`
+
+        """
+
+        pipelines = []
+        for trial in self.top_trials(top_k):
+            folder = trial.user_attrs.get(trial_pipelines_key)
+            if folder is None:
+                raise ValueError(f"pipelines of trial {trial.number} are not saved")
+            for pipeline_list in load(saving_folder=folder, compress=compress).values():
+                pipelines.extend(pipeline_list)
+        return pipelines
+
 
 class OptunaPresetParams:
     def __init__(
@@ -908,6 +1164,12 @@ class OptunaPresetParams:
         return shallow_copy_dict(self.base_params)
 
 
+def create_study(study_config: Dict[str, Any]) -> optuna.study.Study:
+    study_config = shallow_copy_dict(study_config)
+    study_config["storage"] = make_storage(study_config.get("storage"))
+    return optuna.create_study(**study_config)
+
+
 class OptunaArgs(NamedTuple):
     cuda: Optional[str]
     compress: bool
@@ -944,6 +1206,31 @@ def optuna_core(args: OptunaArgs) -> optuna.study.Study:
     estimator_scoring_function = config_dict["estimator_scoring_function"]
     study_config = config_dict["study_config"]
     temp_folder = config_dict["temp_folder"]
+    prune_repeats = config_dict.get("prune_repeats", False)
+    fidelity_config = config_dict.get("fidelity_config")
+    save_pipelines = config_dict.get("save_pipelines", False)
+    fidelities = None
+    if fidelity_config is not None:
+        fidelities = get_fidelities(num_repeat, shallow_copy_dict(fidelity_config))
+        if "pruner" not in study_config:
+            study_config = shallow_copy_dict(study_config)
+            study_config["pruner"] = optuna.pruners.HyperbandPruner(
+                min_resource=1,
+                max_resource=fidelities[-1].resource,
+                reduction_factor=fidelity_config.get("reduction_factor", 3),
+            )
+
+    def get_score(result: _TunerResult) -> float:
+        assert isinstance(tuner, _Tuner)
+        args = tuner, result, metrics, estimator_scoring_function
+        return _get_score(*args)
+
+    def harvest(trial: Trial, result: _TunerResult, folder: str) -> None:
+        if not save_pipelines:
+            return None
+        saving_folder = os.path.join(folder, trial_pipelines_folder, model)
+        save(result.pipelines, saving_folder=saving_folder, compress=compress)
+        trial.set_user_attr(trial_pipelines_key, os.path.abspath(saving_folder))
 
     def objective(trial: Trial) -> float:
         temp_folder_ = os.path.join(temp_folder, str(trial.number))
@@ -957,21 +1244,48 @@ def optuna_core(args: OptunaArgs) -> optuna.study.Study:
         )
         args_ = model, current_params, num_repeat, num_parallel, temp_folder_
         sequential = None if num_jobs <= 1 else True
+        if fidelities is not None:
+            score = 0.0
+            for i, fidelity in enumerate(fidelities):
+                result = tuner.train(
+                    model,
+                    shallow_copy_dict(current_params),
+                    fidelity.num_repeat,
+                    num_parallel,
+                    os.path.join(temp_folder_, f"rung_{i}"),
+                    sequential=sequential,
+                    compress=compress,
+                    cuda=cuda,
+                    fidelity=fidelity,
+                    return_patterns=False,
+                )
+                score = get_score(result)
+                trial.report(score, fidelity.resource)
+                if i < len(fidelities) - 1 and trial.should_prune():
+                    raise optuna.TrialPruned()
+            harvest(trial, result, temp_folder_)
+            return score
+        repeat_trial = None
+        if prune_repeats:
+
+            def score_fn(pipelines: List[Pipeline]) -> float:
+                repeat_result = RepeatResult(None, None, {model: pipelines}, None)
+                return get_score(_TunerResult(model, repeat_result))
+
+            repeat_trial = _RepeatTrial(trial, score_fn)
         result = tuner.train(
             *args_,
             sequential=sequential,
             compress=compress,
             cuda=cuda,
+            trial=repeat_trial,
+            return_patterns=False,
         )
-        final_scores = []
-        weighted_metrics = result.weighted_metrics
-        estimators = tuner.make_estimators(metrics, result.repeat_result)
-        for estimator in estimators:
-            scoring_fn = estimator.scoring_fn(estimator_scoring_function)
-            final_scores.append(scoring_fn(weighted_metrics[estimator.type]))
-        return sum(final_scores) / len(final_scores)
-
-    study = optuna.create_study(**study_config)
+        score = get_score(result)
+        harvest(trial, result, temp_folder_)
+        return score
+
+    study = create_study(study_config)
     study.optimize(objective, int(args.num_trial), timeout, 1)
     return study
 
@@ -999,6 +1313,11 @@ def optuna_tune(
     score_weights: Optional[Dict[str, float]] = None,
     extra_config: Optional[Dict[str, Any]] = None,
     cuda: Optional[Union[int, str]] = None,
+    thread_config: Optional[Dict[str, Any]] = None,
+    prune_repeats: bool = False,
+    fidelity_config: Optional[Dict[str, Any]] = None,
+    save_pipelines: bool = False,
+    storage_type: str = "sqlite",
 ) -> OptunaResult:
     if params is None:
         params = OptunaPresetParams().get(model)
@@ -1009,6 +1328,14 @@ def optuna_tune(
         extra_config = _init_extra_config(metrics, score_weights, extra_config)
         tuner = _Tuner(x, y, x_cv, y_cv, task_type, **extra_config)
     key_mapping = OptunaKeyMapping(tuner, params)
+    if fidelity_config is not None and isinstance(tuner.x, str):
+        # file datasets cannot be subsampled, so only epochs & repeats are scaled
+        fidelity_config = shallow_copy_dict(fidelity_config)
+        if fidelity_config.setdefault("min_data_ratio", 1.0) < 1.0:
+            raise ValueError(
+                "`min_data_ratio` of `fidelity_config` should be 1.0 "
+                "when `x` is a file"
+            )
 
     if num_jobs <= 1:
         meta_folder = None
@@ -1028,14 +1355,22 @@ def optuna_tune(
     else:
         assert isinstance(meta_folder, str)
         os.makedirs(meta_folder, exist_ok=True)
-        storage = os.path.join(meta_folder, "shared.db")
-        storage = f"sqlite:///{storage}"
+        # journal storage (opt-in) avoids the lock contention of sqlite among
+        #  workers, and sqlite will be used if it is not available
+        if storage_type == "journal" and is_journal_available():
+            storage = os.path.abspath(os.path.join(meta_folder, "shared.journal"))
+            storage = f"{journal_prefix}{storage}"
+        elif storage_type in ("journal", "sqlite"):
+            storage = os.path.join(meta_folder, "shared.db")
+            storage = f"sqlite:///{storage}"
+        else:
+            raise ValueError(f"storage_type '{storage_type}' is not recognized")
     study_config["storage"] = storage
     study_config["direction"] = "maximize"
     study_config["load_if_exists"] = True
     study_config.setdefault("study_name", f"{model}_optuna")
     if num_jobs > 1:
-        optuna.create_study(**study_config)
+        create_study(study_config)
 
     task_config = {
         "model": model,
@@ -1047,6 +1382,9 @@ def optuna_tune(
         "estimator_scoring_function": estimator_scoring_function,
         "study_config": study_config,
         "temp_folder": temp_folder,
+        "prune_repeats": prune_repeats,
+        "fidelity_config": fidelity_config,
+        "save_pipelines": save_pipelines,
     }
 
     if num_jobs <= 1:
@@ -1064,7 +1402,7 @@ def optuna_tune(
         os.makedirs(task_config_folder, exist_ok=True)
         Saving.save_dict(task_config, "config", task_config_folder)
 
-        experiment = Experiment(num_jobs=num_jobs)
+        experiment = Experiment(num_jobs=num_jobs, thread_config=thread_config)
         num_trials = [num_trial // num_jobs] * num_jobs
         num_trials[-1] = num_trial - sum(num_trials[:-1])
         for n in num_trials:
@@ -1077,12 +1415,14 @@ def optuna_tune(
                 key_mapping_folder=key_mapping_folder,
             )
         experiment.run_tasks()
-        study = optuna.create_study(**study_config)
+        study = create_study(study_config)
 
     return OptunaResult(tuner, study, key_mapping)
 
 
 __all__ = [
+    "get_fidelities",
+    "Fidelity",
     "tune_with",
     "optuna_core",
     "optuna_tune",
@@ -41,8 +41,12 @@ class Predictor:
         data: Optional[DataProtocol] = None,
         compress: bool = True,
         use_tqdm: bool = False,
+        num_threads: Optional[int] = None,
     ):
         self.device = device
+        if num_threads is not None:
+            onnx_config = shallow_copy_dict(onnx_config)
+            onnx_config["num_threads"] = num_threads
         preprocessor = PreProcessor.load(
             preprocessor_folder,
             data=data,
@@ -201,6 +205,7 @@ class Pack(LoggingMixin):
         data: Optional[DataProtocol] = None,
         compress: bool = True,
         use_tqdm: bool = False,
+        num_threads: Optional[int] = None,
     ) -> Predictor:
         instance = cls(export_folder, loading=True)
         base_folder = os.path.dirname(os.path.abspath(export_folder))
@@ -227,6 +232,7 @@ class Pack(LoggingMixin):
                     data=data,
                     compress=False,
                     use_tqdm=use_tqdm,
+                    num_threads=num_threads,
                 )
                 with open(instance.binary_config_path, "r") as f:
                     cfg = json.load(f)
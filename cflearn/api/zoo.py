@@ -24,6 +24,43 @@ from ..protocol import ModelProtocol
 registered_benchmarks: Dict[str, Dict[str, Dict[str, Any]]] = {}
 
 
+def _k_random_splits(
+    dataset: TabularDataset,
+    k: int,
+    num_test: Union[int, float],
+    random_state: np.random.RandomState,
+) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    k-random splitting (like `cfdata.tabular.KRandom`) with a local random state
+
+    * yields (train indices, test indices) for each of the `k` splits
+    * for classification tasks, labels will keep their ratios in the test split,
+    and at least one sample of each label will be held out
+
+    """
+
+    num_samples = len(dataset.y)
+    if num_test < 1.0 or (num_test == 1.0 and isinstance(num_test, float)):
+        num_test = int(round(num_samples * num_test))
+    num_test = int(num_test)
+    for _ in range(k):
+        if not dataset.is_clf:
+            permutation = random_state.permutation(num_samples)
+            yield permutation[num_test:], permutation[:num_test]
+            continue
+        test_indices_list = []
+        for label in np.unique(dataset.y):
+            label_indices = np.flatnonzero(dataset.y.ravel() == label)
+            ratio = len(label_indices) / num_samples
+            num_label_test = max(1, int(round(num_test * ratio)))
+            chosen = random_state.permutation(label_indices)[:num_label_test]
+            test_indices_list.append(chosen)
+        test_indices = np.hstack(test_indices_list)
+        mask = np.ones(num_samples, bool)
+        mask[test_indices] = False
+        yield np.flatnonzero(mask), test_indices
+
+
 class ZooSearchResult(NamedTuple):
     best_key: str
     mapping: Dict[str, str]
@@ -106,11 +143,23 @@ class Zoo(LoggingMixin, metaclass=ABCMeta):
         use_tqdm: bool = True,
         cv_split: Union[int, float] = 0.1,
         increment_config: Optional[Dict[str, Any]] = None,
+        thread_config: Optional[Dict[str, Any]] = None,
+        cache_folder: Optional[str] = None,
+        executor: str = "process",
+        scheduler_config: Optional[Dict[str, Any]] = None,
+        resume: bool = False,
     ) -> ZooSearchResult:
         if isinstance(models, str):
             models = [models]
-        num_jobs = max(1, num_jobs)
-        experiment = Experiment(num_jobs=num_jobs)
+        if executor != "scheduler":
+            num_jobs = max(1, num_jobs)
+        experiment = Experiment(
+            num_jobs=num_jobs,
+            thread_config=thread_config,
+            executor=executor,
+            cache_folder=cache_folder,
+            scheduler_config=scheduler_config,
+        )
         model_mapping: Dict[str, str] = {}
         model_configs: Dict[str, Dict[str, Any]] = {}
         data_folder = None
@@ -121,12 +170,27 @@ class Zoo(LoggingMixin, metaclass=ABCMeta):
         else:
             data_folders = []
             dataset = TabularDataset(x, y, parse_task_type(task_type))
-            k_random = KRandom(num_repeat, cv_split, dataset)
-            for i, (train_split, test_split) in enumerate(k_random):
-                train_dataset = train_split.dataset
-                test_dataset = test_split.dataset
-                x_tr, y_tr = train_dataset.xy
-                x_te, y_te = test_dataset.xy
+            splits: Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]
+            if cache_folder is None and not resume:
+                k_random = KRandom(num_repeat, cv_split, dataset)
+                splits = (
+                    (*train_split.dataset.xy, *test_split.dataset.xy)
+                    for train_split, test_split in k_random
+                )
+            else:
+                # splits should be reproducible, otherwise the cache will never be
+                #  hit and resumed tasks will be trained on different splits
+                random_state = np.random.RandomState(142857)
+                splits = (
+                    (dataset.x[tr], dataset.y[tr], dataset.x[te], dataset.y[te])
+                    for tr, te in _k_random_splits(
+                        dataset,
+                        num_repeat,
+                        cv_split,
+                        random_state,
+                    )
+                )
+            for i, (x_tr, y_tr, x_te, y_te) in enumerate(splits):
                 local_data_folder = os.path.join(workplace, "__data__", str(i))
                 os.makedirs(local_data_folder, exist_ok=True)
                 experiment.dump_data(local_data_folder, x_tr, y_tr)
@@ -153,7 +217,7 @@ class Zoo(LoggingMixin, metaclass=ABCMeta):
                         config=shallow_copy_dict(config),
                         data_folder=i_data_folder,
                     )
-        results = experiment.run_tasks(use_tqdm=use_tqdm)
+        results = experiment.run_tasks(use_tqdm=use_tqdm, resume=resume)
         model_keys: List[str] = []
         model_means: List[float] = []
         model_statistics: List[Dict[str, float]] = []
@@ -12,6 +12,7 @@ from typing import List
 from typing import Type
 from typing import Union
 from typing import Callable
+from typing import Tuple
 from typing import Optional
 from typing import NamedTuple
 from cftool.misc import timestamp
@@ -113,6 +114,7 @@ class Elements(NamedTuple):
     fixed_epoch: Optional[int] = None
     max_snapshot_file: int = 5
     clip_norm: float = 0.0
+    accumulate_grad_batches: int = 1
     ema_decay: float = 0.0
     model_config: Optional[Dict[str, Any]] = None
     loss: str = "auto"
@@ -147,6 +149,50 @@ class Elements(NamedTuple):
             "fixed_epoch": {"min_epoch", "num_epoch", "max_epoch"},
         }
 
+    @staticmethod
+    def resolve_epochs(
+        min_epoch: Optional[int],
+        num_epoch: Optional[int],
+        max_epoch: Optional[int],
+        fixed_epoch: Optional[int] = None,
+    ) -> Tuple[int, int, int]:
+        """fills the missing ones of (min_epoch, num_epoch, max_epoch) with defaults"""
+
+        if fixed_epoch is not None:
+            msg = "`{}` should not be provided when `fixed_epoch` is provided"
+            if min_epoch is not None:
+                raise ValueError(msg.format("min_epoch"))
+            if num_epoch is not None:
+                raise ValueError(msg.format("num_epoch"))
+            if max_epoch is not None:
+                raise ValueError(msg.format("max_epoch"))
+            min_epoch = num_epoch = max_epoch = fixed_epoch
+        if min_epoch is None or num_epoch is None or max_epoch is None:
+            if num_epoch is not None and max_epoch is not None:
+                if num_epoch > max_epoch:
+                    msg = "`num_epoch` should not be greater than `max_epoch`"
+                    raise ValueError(msg)
+            if min_epoch is not None and max_epoch is not None:
+                if min_epoch > max_epoch:
+                    msg = "`min_epoch` should not be greater than `max_epoch`"
+                    raise ValueError(msg)
+            if min_epoch is not None and num_epoch is not None:
+                if min_epoch > num_epoch:
+                    msg = "`min_epoch` should not be greater than `num_epoch`"
+                    raise ValueError(msg)
+        default_min, default_num, default_max = 0, 40, 200
+        if num_epoch is None:
+            num_epoch = default_num
+            if max_epoch is not None:
+                num_epoch = min(num_epoch, max_epoch)
+            if min_epoch is not None:
+                num_epoch = max(num_epoch, min_epoch)
+        if min_epoch is None:
+            min_epoch = min(default_min, num_epoch)
+        if max_epoch is None:
+            max_epoch = max(default_max, num_epoch)
+        return min_epoch, num_epoch, max_epoch
+
     @property
     def user_defined_config(self) -> Dict[str, Any]:
         user_config = shallow_copy_dict(self.user_config or {})
@@ -190,50 +236,19 @@ class Elements(NamedTuple):
         # trainer
         trainer_config = kwargs.setdefault("trainer_config", {})
         trainer_config.setdefault("use_amp", kwargs.pop("use_amp"))
-        min_epoch = kwargs.pop("min_epoch")
-        num_epoch = kwargs.pop("num_epoch")
-        max_epoch = kwargs.pop("max_epoch")
-        if self.fixed_epoch is not None:
-            msg = "`{}` should not be provided when `fixed_epoch` is provided"
-            if min_epoch is not None:
-                raise ValueError(msg.format("min_epoch"))
-            if num_epoch is not None:
-                raise ValueError(msg.format("num_epoch"))
-            if max_epoch is not None:
-                raise ValueError(msg.format("max_epoch"))
-            min_epoch = num_epoch = max_epoch = self.fixed_epoch
-        no_min, no_num, no_max = min_epoch is None, num_epoch is None, max_epoch is None
-        default_min, default_num, default_max = 0, 40, 200
-        if no_min and no_num and no_max:
-            min_epoch = default_min
-            num_epoch = default_num
-            max_epoch = default_max
-        elif no_min and no_num:
-            min_epoch = min(default_min, max_epoch)
-            num_epoch = min(default_num, max_epoch)
-        elif no_min and no_max:
-            min_epoch = min(default_min, num_epoch)
-            max_epoch = max(default_max, num_epoch)
-        elif no_num and no_max:
-            num_epoch = max(default_num, min_epoch)
-            max_epoch = max(default_max, min_epoch)
-        elif no_min:
-            if num_epoch > max_epoch:
-                raise ValueError("`num_epoch` should not be greater than `max_epoch`")
-            min_epoch = min(default_min, num_epoch)
-        elif no_num:
-            if min_epoch > max_epoch:
-                raise ValueError("`min_epoch` should not be greater than `max_epoch`")
-            num_epoch = max(min(default_num, max_epoch), min_epoch)
-        elif no_max:
-            if min_epoch > num_epoch:
-                raise ValueError("`min_epoch` should not be greater than `num_epoch`")
-            max_epoch = max(default_max, num_epoch)
+        min_epoch, num_epoch, max_epoch = self.resolve_epochs(
+            kwargs.pop("min_epoch"),
+            kwargs.pop("num_epoch"),
+            kwargs.pop("max_epoch"),
+            self.fixed_epoch,
+        )
         trainer_config.setdefault("min_epoch", min_epoch)
         trainer_config.setdefault("num_epoch", num_epoch)
         trainer_config.setdefault("max_epoch", max_epoch)
         trainer_config.setdefault("max_snapshot_file", kwargs.pop("max_snapshot_file"))
         trainer_config.setdefault("clip_norm", kwargs.pop("clip_norm"))
+        accumulate_grad_batches = kwargs.pop("accumulate_grad_batches")
+        trainer_config.setdefault("accumulate_grad_batches", accumulate_grad_batches)
         # model
         model_config = self.model_config or {}
         model_config["aggregator"] = kwargs.pop("aggregator")
@@ -332,6 +347,8 @@ class Elements(NamedTuple):
         # trainer general
         trainer_config = kwargs.setdefault("trainer_config", {})
         trainer_config.setdefault("update_binary_threshold_at_runtime", False)
+        trainer_config.setdefault("resumable", False)
+        trainer_config.setdefault("adaptive_monitor_config", None)
         use_amp = kwargs.get("use_amp", False)
         trainer_config["use_amp"] = use_amp and amp is not None
         default_checkpoint_folder = os.path.join(log_folder, "checkpoints")
@@ -389,6 +406,9 @@ class Environment:
                 torch.cuda.set_device(self.rank)
 
     def __getattr__(self, item: str) -> Any:
+        # attributes are not ready yet when unpickling
+        if item.startswith("__") or "config" not in self.__dict__:
+            raise AttributeError(item)
         return self.user_defined_config.get(item, self.config[item])
 
     @property
@@ -3,6 +3,9 @@ import torch
 
 import numpy as np
 
+from typing import Any
+from typing import Dict
+from typing import Optional
 from cftool.misc import update_dict
 from cftool.misc import shallow_copy_dict
 from cfdata.types import np_int_type
@@ -30,6 +33,17 @@ class TabularSampler(ImbalancedSampler, SamplerProtocol):
 
 @DataLoaderProtocol.register("tabular")
 class TabularLoader(DataLoader, DataLoaderProtocol):
+    _fixed_indices: Optional[np.ndarray] = None
+    _shuffle_fixed: bool = False
+
+    def _reset(self) -> None:
+        super()._reset()
+        if self._fixed_indices is not None:
+            if not self._shuffle_fixed:
+                self._indices_in_use = self._fixed_indices
+            else:
+                self._indices_in_use = np.random.permutation(self._fixed_indices)
+
     def __next__(self) -> loader_batch_type:
         sample = DataLoader.__next__(self)
         if self.return_indices:
@@ -56,6 +70,18 @@ class TabularLoader(DataLoader, DataLoaderProtocol):
         assert indices is not None
         return sample, indices
 
+    def state_dict(self) -> Dict[str, Any]:
+        return {
+            "indices_in_use": self._indices_in_use,
+            "siamese_cursor": self._siamese_cursor,
+            "cursor": self._cursor,
+        }
+
+    def load_state_dict(self, state_dict: Dict[str, Any]) -> None:
+        self._indices_in_use = state_dict["indices_in_use"]
+        self._siamese_cursor = state_dict["siamese_cursor"]
+        self._cursor = state_dict["cursor"]
+
     def copy(self) -> "DataLoader":
         copied_tabular_loader = copy.copy(self)
         copied_loader = super().copy()
@@ -63,6 +89,26 @@ class TabularLoader(DataLoader, DataLoaderProtocol):
         update_dict(shallow_copied, copied_tabular_loader.__dict__)
         return copied_tabular_loader
 
+    def subset(
+        self,
+        indices: np.ndarray,
+        *,
+        shuffle: bool = False,
+    ) -> "TabularLoader":
+        # the returned loader is a view, the data will not be copied
+        loader = self.copy()
+        loader._fixed_indices = indices
+        loader._shuffle_fixed = shuffle
+        loader._num_samples = len(indices)
+        loader.batch_size = min(len(indices), self.batch_size)
+        return loader
+
+    @property
+    def num_samples(self) -> int:
+        if self._fixed_indices is None:
+            return len(self.data)
+        return len(self._fixed_indices)
+
 
 __all__ = [
     "TabularData",
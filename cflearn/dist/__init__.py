@@ -1,4 +1,15 @@
 from .task import Task
+from .task import TaskStatus
+from .task import get_task_status
+from .pool import task_log_file
+from .pool import WorkerPool
+from .pool import get_worker_pool
+from .pool import close_worker_pools
+from .cache import fingerprint_data
+from .cache import ResultCache
+from .storage import JournalFileStorage
+from .scheduler import TaskResources
+from .scheduler import ResourceScheduler
 from .experiment import inject_distributed_tqdm_kwargs
 from .experiment import Experiment
 from .experiment import ExperimentResults
@@ -6,6 +17,17 @@ from .experiment import ExperimentResults
 
 __all__ = [
     "Task",
+    "TaskStatus",
+    "get_task_status",
+    "task_log_file",
+    "WorkerPool",
+    "get_worker_pool",
+    "close_worker_pools",
+    "fingerprint_data",
+    "ResultCache",
+    "JournalFileStorage",
+    "TaskResources",
+    "ResourceScheduler",
     "inject_distributed_tqdm_kwargs",
     "Experiment",
     "ExperimentResults",
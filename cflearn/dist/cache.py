@@ -0,0 +1,270 @@
+import os
+import json
+import uuid
+import shutil
+import hashlib
+
+import numpy as np
+
+from typing import *
+from cftool.misc import update_dict
+from cftool.misc import shallow_copy_dict
+
+from ..misc._api import SAVING_DELIM
+from .runs._utils import data_config_file
+
+# these keys only affect logging / devices, so they are excluded from cache keys
+cache_excluded_keys = {
+    "cuda",
+    "use_tqdm",
+    "use_step_tqdm",
+    "tqdm_position",
+    "tqdm_desc",
+    "in_distributed",
+    "verbose_level",
+    "trigger_logging",
+    "logging_folder",
+    "data_folder",
+    "mlflow_config",
+    "log_pipeline_to_artifacts",
+}
+
+
+def _update_hash(hasher: Any, value: Any) -> None:
+    if value is None:
+        hasher.update(b"none")
+    elif isinstance(value, str):
+        hasher.update(b"file")
+        with open(value, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                hasher.update(chunk)
+    else:
+        array = np.ascontiguousarray(value)
+        hasher.update(f"{array.dtype.str}{array.shape}".encode())
+        if array.dtype == object:
+            hasher.update(json.dumps(array.tolist(), default=repr).encode())
+        else:
+            hasher.update(array.data.cast("B"))
+
+
+def fingerprint_data(*data: Any) -> str:
+    """content hash of arrays (or files, if paths are provided)"""
+    hasher = hashlib.sha256()
+    for value in data:
+        _update_hash(hasher, value)
+    return hasher.hexdigest()
+
+
+def fingerprint_meta(meta: Dict[str, Any]) -> str:
+    """
+    content hash of task meta, where arrays (e.g. `sample_weights`) are hashed by
+    their contents (see `fingerprint_data`) instead of their truncated reprs
+
+    """
+
+    def _default(value: Any) -> Any:
+        if isinstance(value, np.ndarray):
+            return {"__array__": fingerprint_data(value)}
+        return repr(value)
+
+    dumped = json.dumps(meta, sort_keys=True, default=_default)
+    return hashlib.sha256(dumped.encode()).hexdigest()
+
+
+def fingerprint_data_folder(data_folder: str) -> str:
+    """
+    content hash of a data folder dumped by `Experiment`
+
+    * it is identical to `fingerprint_data(x, y, x_cv, y_cv)` of the dumped data
+    * test data (`x_te`, `y_te`, dumped by `Zoo.search`) will be hashed as well
+
+    """
+
+    config_path = os.path.join(data_folder, data_config_file)
+    if os.path.isfile(config_path):
+        with open(config_path, "r") as f:
+            data_config = json.load(f)
+        return fingerprint_data(*map(data_config.get, ["x", "y", "x_cv", "y_cv"]))
+    keys = ["x", "y", "x_cv", "y_cv"]
+    if os.path.isfile(os.path.join(data_folder, "x_te.npy")):
+        keys += ["x_te", "y_te"]
+    data: List[Optional[np.ndarray]] = []
+    for key in keys:
+        file = os.path.join(data_folder, f"{key}.npy")
+        if not os.path.isfile(file):
+            data.append(None)
+        else:
+            try:
+                data.append(np.load(file, mmap_mode="r"))
+            except ValueError:
+                # arrays of python objects cannot be memory-mapped
+                data.append(np.load(file, allow_pickle=True))
+    return fingerprint_data(*data)
+
+
+class CacheEntry(NamedTuple):
+    key: str
+    folder: str
+    meta: Dict[str, Any]
+
+    @property
+    def compress(self) -> bool:
+        return self.meta.get("compress", True)
+
+    @property
+    def scores_path(self) -> Optional[str]:
+        path = os.path.join(self.folder, ResultCache.scores_file)
+        return path if os.path.isfile(path) else None
+
+
+class ResultCache:
+    """
+    A content-addressed cache of trained pipelines
+
+    * entries are keyed by (data fingerprint, model, config, seed), where seed is
+    the index of the repeat
+    * each entry holds the saved pipeline and the `scores.json` of its checkpoints
+    * entries are published with an atomic rename, so concurrent writers are safe
+
+    Parameters
+    ----------
+    folder : str, where the entries will be stored
+
+    """
+
+    meta_file = "__cache__.json"
+    scores_file = "scores.json"
+
+    def __init__(self, folder: str):
+        self.folder = os.path.abspath(folder)
+        os.makedirs(self.folder, exist_ok=True)
+
+    @staticmethod
+    def make_key(
+        data_fingerprint: str,
+        model: str,
+        config: Dict[str, Any],
+        seed: Union[int, str],
+    ) -> str:
+        from .. import __version__
+
+        config = {k: v for k, v in config.items() if k not in cache_excluded_keys}
+        config.pop("model", None)
+        identifier = {
+            "version": __version__,
+            "data": data_fingerprint,
+            "model": model,
+            "config": config,
+            "seed": str(seed),
+        }
+        dumped = json.dumps(identifier, sort_keys=True, default=repr)
+        return hashlib.sha256(dumped.encode()).hexdigest()
+
+    @staticmethod
+    def resolve_config(
+        config: Dict[str, Any],
+        increment_config: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        config = shallow_copy_dict(config)
+        if increment_config is not None:
+            update_dict(shallow_copy_dict(increment_config), config)
+        return config
+
+    def entry_folder(self, key: str) -> str:
+        return os.path.join(self.folder, key[:2], key)
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        folder = self.entry_folder(key)
+        meta_path = os.path.join(folder, self.meta_file)
+        if not os.path.isfile(meta_path):
+            return None
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        return CacheEntry(key, folder, meta)
+
+    def put(
+        self,
+        key: str,
+        saving_folder: str,
+        *,
+        scores_path: Optional[str] = None,
+        meta: Optional[Dict[str, Any]] = None,
+    ) -> Optional[CacheEntry]:
+        """
+        Stores the pipeline saved (by `cflearn.save`) in `saving_folder`
+
+        * returns None if nothing was saved (e.g. the task failed)
+
+        """
+
+        prefix = f"cflearn{SAVING_DELIM}"
+        if not os.path.isdir(saving_folder):
+            return None
+        artifacts = [f for f in os.listdir(saving_folder) if f.startswith(prefix)]
+        if not artifacts:
+            return None
+        existing = self.get(key)
+        if existing is not None:
+            return existing
+        folder = self.entry_folder(key)
+        tmp_folder = f"{folder}.{uuid.uuid4().hex}.tmp"
+        os.makedirs(tmp_folder)
+        try:
+            for artifact in artifacts:
+                src = os.path.join(saving_folder, artifact)
+                dst = os.path.join(tmp_folder, artifact)
+                if os.path.isdir(src):
+                    shutil.copytree(src, dst)
+                else:
+                    shutil.copy2(src, dst)
+            if scores_path is not None and os.path.isfile(scores_path):
+                shutil.copy2(scores_path, os.path.join(tmp_folder, self.scores_file))
+            with open(os.path.join(tmp_folder, self.meta_file), "w") as f:
+                json.dump(meta or {}, f, default=repr)
+            try:
+                os.rename(tmp_folder, folder)
+            except OSError:
+                # another process has published the same entry
+                pass
+        finally:
+            shutil.rmtree(tmp_folder, ignore_errors=True)
+        return self.get(key)
+
+    def restore(
+        self,
+        key: str,
+        workplace: str,
+        *,
+        scores_folder: Optional[str] = None,
+    ) -> bool:
+        """copies a cached pipeline (and its scores) back to `workplace`"""
+        entry = self.get(key)
+        if entry is None:
+            return False
+        os.makedirs(workplace, exist_ok=True)
+        for artifact in os.listdir(entry.folder):
+            if artifact in (self.meta_file, self.scores_file):
+                continue
+            src = os.path.join(entry.folder, artifact)
+            dst = os.path.join(workplace, artifact)
+            if os.path.isdir(dst):
+                shutil.rmtree(dst)
+            if os.path.isdir(src):
+                shutil.copytree(src, dst)
+            else:
+                shutil.copy2(src, dst)
+        scores_path = entry.scores_path
+        if scores_folder is not None and scores_path is not None:
+            os.makedirs(scores_folder, exist_ok=True)
+            shutil.copy2(scores_path, os.path.join(scores_folder, self.scores_file))
+        return True
+
+
+__all__ = [
+    "cache_excluded_keys",
+    "fingerprint_data",
+    "fingerprint_meta",
+    "fingerprint_data_folder",
+    "CacheEntry",
+    "ResultCache",
+]
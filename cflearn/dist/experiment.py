@@ -1,6 +1,9 @@
 import os
 import json
+import time
 import torch
+import shutil
+import tempfile
 
 import numpy as np
 
@@ -12,19 +15,87 @@ from cftool.misc import Saving
 from cftool.misc import LoggingMixin
 
 from .task import Task
+from .task import task_status_file
+from .task import status_done
+from .task import status_pending
+from .task import get_task_status
+from .task import set_task_status
+from .task import TaskStatus
+from .cache import ResultCache
+from .cache import fingerprint_meta
+from .cache import fingerprint_data_folder
+from .pool import PoolJob
+from .pool import WorkerPool
+from .pool import get_worker_pool
+from .scheduler import task_history_file
+from .scheduler import get_data_shape
+from .scheduler import task_signature
+from .scheduler import heuristic_resources
+from .scheduler import estimate_resources
+from .scheduler import load_resource_usage
+from .scheduler import DataShape
+from .scheduler import TaskHistory
+from .scheduler import TaskResources
+from .scheduler import ResourceScheduler
 from ..types import data_type
 from ..pipeline import Pipeline
+from ..misc.toolkit import get_cpu_list
 from .runs._utils import meta_config_name
 from .runs._utils import data_config_file
 
 
+class ThreadSettings(NamedTuple):
+    num_threads: Optional[int]
+    cpu_list: Optional[List[int]]
+    slots_folder: Optional[str]
+    num_slots: int = 1
+
+
+def _claim_slot(slots_folder: str, num_slots: int) -> int:
+    # at most `num_slots` tasks are running at the same time, so one of the
+    # slots will be released soon if all of them are occupied
+    while True:
+        for slot in range(num_slots):
+            path = os.path.join(slots_folder, f"{slot}.lock")
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL))
+                return slot
+            except FileExistsError:
+                continue
+        time.sleep(0.1)
+
+
 def _task(
     task: Task,
     execute: str,
     config_folder: str,
+    thread_settings: Optional[ThreadSettings] = None,
     cuda: Optional[Union[int, str]] = None,
 ) -> None:
-    task.run(execute, config_folder, cuda)
+    if thread_settings is None:
+        task.run(execute, config_folder, cuda)
+        return None
+    num_threads, cpu_list, slots_folder, num_slots = thread_settings
+    if num_threads is None:
+        task.run(execute, config_folder, cuda)
+        return None
+    if cpu_list is None or slots_folder is None:
+        task.run(execute, config_folder, cuda, num_threads=num_threads)
+        return None
+    slot = _claim_slot(slots_folder, num_slots)
+    start = slot * num_threads
+    cores = [cpu_list[(start + i) % len(cpu_list)] for i in range(num_threads)]
+    cores = sorted(set(cores))
+    try:
+        task.run(
+            execute,
+            config_folder,
+            cuda,
+            num_threads=num_threads,
+            cpu_affinity=cores,
+        )
+    finally:
+        os.remove(os.path.join(slots_folder, f"{slot}.lock"))
 
 
 def inject_distributed_tqdm_kwargs(
@@ -59,8 +130,50 @@ class ExperimentResults(NamedTuple):
             folders.setdefault(model, {})[int(index)] = checkpoint_folder
         return {k: [v[i] for i in range(len(v))] for k, v in folders.items()}
 
+    @property
+    def statuses(self) -> Dict[str, Optional[TaskStatus]]:
+        return {workplace: get_task_status(workplace) for workplace in self.workplaces}
+
+    @property
+    def failed_workplaces(self) -> List[str]:
+        statuses = self.statuses.items()
+        return [w for w, status in statuses if status is None or not status.is_done]
+
 
 class Experiment(LoggingMixin):
+    """
+    Runs a bunch of tasks (each in its own process) in parallel
+
+    Parameters
+    ----------
+    thread_config : Dict[str, Any], controls the threads used by each task
+    * num_threads : int, intra-op threads (torch, BLAS, onnxruntime) of each task
+        * if not provided, `num_cpus // num_jobs` will be used when `num_jobs > 1`
+        * if <= 0, the threads will not be limited
+    * pin_cores : bool, whether pin each task to its own `num_threads` cores
+    executor : str, how the tasks will be executed
+    * 'process' : each task is executed in a brand-new python interpreter
+    * 'pool' : tasks are executed by a pool of long-lived workers (`WorkerPool`),
+    which is cached and reused by later experiments with the same settings.
+    This is recommended when there are many short tasks (e.g. hpo trials)
+    * 'scheduler' : each task is executed in a brand-new python interpreter, and
+    tasks are packed onto available cores & memory by `ResourceScheduler`, longest
+    tasks first. `num_jobs` limits the number of concurrent tasks (0 means no
+    limit), and the resources of each task can be requested in `add_task`
+    scheduler_config : Dict[str, Any], configs of the 'scheduler' executor
+    * num_cpus / memory_mb / memory_fraction : see `ResourceScheduler`
+    * history_file : str, where resource usages of finished tasks are recorded,
+    they are used to estimate similar tasks later
+        * if not provided, `{root_workplace}/__task_history__.json` will be used
+    * each task requests `num_threads` (see `thread_config`) cores, or one core if
+    the threads are not limited
+    cache_folder : str, folder of the `ResultCache`
+    * if provided, 'basic' tasks whose (data, model, config, index) have been
+    trained before will be restored from the cache instead of being executed
+    * newly trained pipelines will be stored into the cache
+
+    """
+
     tasks_folder = "__tasks__"
     default_root_workplace = "__experiment__"
 
@@ -71,7 +184,13 @@ class Experiment(LoggingMixin):
         use_cuda: bool = True,
         available_cuda_list: Optional[List[int]] = None,
         resource_config: Optional[Dict[str, Any]] = None,
+        thread_config: Optional[Dict[str, Any]] = None,
+        executor: str = "process",
+        cache_folder: Optional[str] = None,
+        scheduler_config: Optional[Dict[str, Any]] = None,
     ):
+        if executor not in ("process", "pool", "scheduler"):
+            raise ValueError(f"executor '{executor}' is not recognized")
         use_cuda = use_cuda and torch.cuda.is_available()
         if available_cuda_list is None and not use_cuda:
             available_cuda_list = []
@@ -79,6 +198,21 @@ class Experiment(LoggingMixin):
         self.use_cuda = use_cuda
         self.cuda_list = available_cuda_list
         self.resource_config = resource_config or {}
+        self.thread_config = thread_config or {}
+        self.executor = executor
+        self.pool: Optional[WorkerPool] = None
+        self.scheduler_config = scheduler_config or {}
+        self.scheduler: Optional[ResourceScheduler] = None
+        self.requests: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self.root_workplaces: Dict[Tuple[str, str], str] = {}
+        self._data_shapes: Dict[str, Optional[DataShape]] = {}
+        self._histories: Dict[str, TaskHistory] = {}
+        self.cache_folder = cache_folder
+        self.cache = None if cache_folder is None else ResultCache(cache_folder)
+        self.cache_keys: Dict[Tuple[str, str], str] = {}
+        self.cached: List[Tuple[str, str]] = []
+        self.finished: List[Tuple[str, str]] = []
+        self._data_fingerprints: Dict[str, str] = {}
         self.tasks: Dict[Tuple[str, str], Task] = {}
         self.key_indices: Dict[Tuple[str, str], int] = {}
         self.executes: Dict[Tuple[str, str], str] = {}
@@ -152,6 +286,21 @@ class Experiment(LoggingMixin):
     def num_tasks(self) -> int:
         return len(self.tasks)
 
+    @property
+    def num_threads(self) -> Optional[int]:
+        num_threads = self.thread_config.get("num_threads")
+        if num_threads is None:
+            if self.num_jobs <= 1:
+                return None
+            num_threads = max(1, len(get_cpu_list()) // self.num_jobs)
+        if num_threads <= 0:
+            return None
+        return num_threads
+
+    @property
+    def pin_cores(self) -> bool:
+        return self.thread_config.get("pin_cores", False)
+
     def add_task(
         self,
         x: data_type = None,
@@ -165,8 +314,18 @@ class Experiment(LoggingMixin):
         workplace_key: Optional[Tuple[str, str]] = None,
         config: Optional[Dict[str, Any]] = None,
         data_folder: Optional[str] = None,
+        resources: Optional[Dict[str, Any]] = None,
         **task_meta_kwargs: Any,
     ) -> str:
+        """
+        Adds a task, returns its workplace
+
+        * `resources` is only used by the 'scheduler' executor, where `num_threads`,
+        `memory_mb` and `cost` (e.g. seconds) can be requested. Those which are not
+        provided will be estimated from past runs or from heuristics
+
+        """
+
         if workplace_key is None:
             counter = 0
             while True:
@@ -199,15 +358,90 @@ class Experiment(LoggingMixin):
         self.key_indices[workplace_key] = new_idx
         self.executes[workplace_key] = execute
         self.workplaces[workplace_key] = workplace
+        self.requests[workplace_key] = shallow_copy_dict(resources or {})
+        self.root_workplaces[workplace_key] = root_workplace
+        # only built-in trainings can be cached, custom commands may do anything
+        cacheable = execute == "basic" and new_task.run_command is None
+        if self.cache is not None and cacheable:
+            cache_key = self._cache_key(model, workplace_key, new_task, data_folder)
+            if cache_key is not None:
+                self.cache_keys[workplace_key] = cache_key
         return workplace
 
-    def run_tasks(
+    def _cache_key(
         self,
-        *,
-        use_tqdm: bool = True,
-        task_loader: Optional[Callable[[str], Pipeline]] = None,
-        **parallel_kwargs: Any,
-    ) -> ExperimentResults:
+        model: str,
+        workplace_key: Tuple[str, str],
+        task: Task,
+        data_folder: Optional[str],
+    ) -> Optional[str]:
+        if data_folder is None:
+            return None
+        data_folder = os.path.abspath(data_folder)
+        fingerprint = self._data_fingerprints.get(data_folder)
+        if fingerprint is None:
+            fingerprint = fingerprint_data_folder(data_folder)
+            self._data_fingerprints[data_folder] = fingerprint
+        meta = task.meta_kwargs
+        config = ResultCache.resolve_config(meta["config"], meta["increment_config"])
+        # other task meta (e.g. `sample_weights`) affects training as well
+        excluded = {"workplace", "config", "increment_config", "compress"}
+        extra_meta = {k: v for k, v in meta.items() if k not in excluded}
+        if extra_meta:
+            fingerprint = f"{fingerprint}-{fingerprint_meta(extra_meta)}"
+        return ResultCache.make_key(fingerprint, model, config, workplace_key[1])
+
+    def _restore_from_cache(self, workplace_keys: List[Tuple[str, str]]) -> None:
+        self.cached = []
+        if self.cache is None:
+            return None
+        for workplace_key in workplace_keys:
+            cache_key = self.cache_keys.get(workplace_key)
+            if cache_key is None:
+                continue
+            workplace = self.workplaces[workplace_key]
+            scores_folder = os.path.join(workplace, "_logs", "checkpoints")
+            if self.cache.restore(cache_key, workplace, scores_folder=scores_folder):
+                signature = self.tasks[workplace_key].signature
+                set_task_status(workplace, status_done, signature=signature)
+                self.cached.append(workplace_key)
+        if self.cached:
+            print(
+                f"{self.info_prefix}{len(self.cached)} / {len(workplace_keys)} "
+                "tasks are restored from cache"
+            )
+
+    def _store_to_cache(self, workplace_keys: List[Tuple[str, str]]) -> None:
+        if self.cache is None:
+            return None
+        for workplace_key in workplace_keys:
+            cache_key = self.cache_keys.get(workplace_key)
+            if cache_key is None or workplace_key in self.cached:
+                continue
+            task = self.tasks[workplace_key]
+            workplace = self.workplaces[workplace_key]
+            if not task.is_done(workplace):
+                continue
+            scores_folder = os.path.join(workplace, "_logs", "checkpoints")
+            self.cache.put(
+                cache_key,
+                workplace,
+                scores_path=os.path.join(scores_folder, ResultCache.scores_file),
+                meta={
+                    "model": task.meta_kwargs["config"]["model"],
+                    "workplace_key": workplace_key,
+                    "compress": task.meta_kwargs.get("compress", True),
+                },
+            )
+
+    def _run_with_parallel(
+        self,
+        tasks: List[Task],
+        executes: List[str],
+        workplaces: List[str],
+        use_tqdm: bool,
+        parallel_kwargs: Dict[str, Any],
+    ) -> None:
         resource_config = shallow_copy_dict(self.resource_config)
         gpu_config = resource_config.setdefault("gpu_config", {})
         gpu_config["available_cuda_list"] = self.cuda_list
@@ -218,11 +452,183 @@ class Experiment(LoggingMixin):
             resource_config=resource_config,
             **parallel_kwargs,
         )
+        num_threads = self.num_threads
+        cpu_list = slots_folder = None
+        num_slots = max(1, min(self.num_jobs, len(tasks)))
+        if num_threads is not None and self.pin_cores:
+            cpu_list = get_cpu_list()
+            if len(cpu_list) < num_threads * num_slots:
+                print(
+                    f"{self.warning_prefix}not enough cores ({len(cpu_list)}) to pin "
+                    f"{self.num_jobs} jobs with {num_threads} threads each, "
+                    "some jobs will share cores"
+                )
+            slots_folder = tempfile.mkdtemp(prefix="cflearn_cores_")
+        args = num_threads, cpu_list, slots_folder, num_slots
+        thread_settings = ThreadSettings(*args)
+        try:
+            parallel(
+                _task,
+                tasks,
+                executes,
+                workplaces,
+                [thread_settings] * len(tasks),
+            )
+        finally:
+            if slots_folder is not None:
+                shutil.rmtree(slots_folder, ignore_errors=True)
+
+    def _run_with_pool(
+        self,
+        tasks: List[Task],
+        executes: List[str],
+        workplaces: List[str],
+        use_tqdm: bool,
+    ) -> None:
+        cuda_list = self.cuda_list
+        if cuda_list is None:
+            cuda_list = list(range(torch.cuda.device_count()))
+        self.pool = get_worker_pool(
+            self.num_jobs,
+            cuda_list=cuda_list,
+            num_threads=self.num_threads,
+            pin_cores=self.pin_cores,
+        )
+        iterator = zip(tasks, executes, workplaces)
+        jobs = [PoolJob(i, *args) for i, args in enumerate(iterator)]
+        self.pool.run(jobs, use_tqdm=use_tqdm)
+
+    def _get_history(self, workplace_key: Tuple[str, str]) -> TaskHistory:
+        history_file = self.scheduler_config.get("history_file")
+        if history_file is None:
+            root_workplace = self.root_workplaces[workplace_key]
+            history_file = os.path.join(root_workplace, task_history_file)
+        history = self._histories.get(history_file)
+        if history is None:
+            history = self._histories[history_file] = TaskHistory(history_file)
+        return history
+
+    def _task_info(self, workplace_key: Tuple[str, str]) -> Tuple[str, TaskResources]:
+        meta = self.tasks[workplace_key].meta_kwargs
+        config = meta.get("config", {})
+        increment_config = meta.get("increment_config", {})
+        data_folder = increment_config.get("data_folder")
+        shape = None
+        if data_folder is not None:
+            if data_folder not in self._data_shapes:
+                self._data_shapes[data_folder] = get_data_shape(data_folder)
+            shape = self._data_shapes[data_folder]
+        model = config.get("model", workplace_key[0])
+        # each task will use one core if the threads are not limited
+        num_threads = self.num_threads or 1
+        heuristic = heuristic_resources(config, shape, num_threads)
+        return task_signature(model, config, shape), heuristic
+
+    def estimate_resources(self, workplace_key: Tuple[str, str]) -> TaskResources:
+        """resources of a task used by the 'scheduler' executor"""
+        signature, heuristic = self._task_info(workplace_key)
+        history = self._get_history(workplace_key)
+        estimated = estimate_resources(signature, heuristic, history)
+        return estimated._replace(**self.requests[workplace_key])
+
+    def _run_with_scheduler(
+        self,
+        tasks: List[Task],
+        executes: List[str],
+        workplaces: List[str],
+        use_tqdm: bool,
+        workplace_keys: List[Tuple[str, str]],
+    ) -> None:
+        requests = list(map(self.estimate_resources, workplace_keys))
+        cuda_list = self.cuda_list
+        if cuda_list is None:
+            cuda_list = list(range(torch.cuda.device_count())) if self.use_cuda else []
+        pin_cores = self.pin_cores
+
+        def _launch(i: int, cores: List[int]) -> None:
+            cuda = None if not cuda_list else cuda_list[i % len(cuda_list)]
+            tasks[i].run(
+                executes[i],
+                workplaces[i],
+                cuda,
+                num_threads=requests[i].num_threads,
+                cpu_affinity=cores if pin_cores else None,
+            )
+
+        self.scheduler = ResourceScheduler(
+            num_cpus=self.scheduler_config.get("num_cpus"),
+            memory_mb=self.scheduler_config.get("memory_mb"),
+            memory_fraction=self.scheduler_config.get("memory_fraction", 0.8),
+            max_jobs=max(0, self.num_jobs),
+        )
+        self.scheduler.run(requests, _launch, use_tqdm=use_tqdm)
+        # records resource usages, so similar tasks can be estimated more precisely
+        for workplace_key, workplace in zip(workplace_keys, workplaces):
+            usage = load_resource_usage(workplace)
+            if usage is not None:
+                signature, heuristic = self._task_info(workplace_key)
+                history = self._get_history(workplace_key)
+                history.update(signature, usage, heuristic.cost)
+        for history in self._histories.values():
+            history.save()
+
+    def run_tasks(
+        self,
+        *,
+        use_tqdm: bool = True,
+        task_loader: Optional[Callable[[str], Pipeline]] = None,
+        resume: bool = False,
+        **parallel_kwargs: Any,
+    ) -> ExperimentResults:
+        """
+        Runs all tasks, returns their results
+
+        * each task records its status ('pending', 'running', 'done' or 'failed')
+        and artifacts to `{workplace}/__status__.json` durably
+        * if `resume` is True, tasks which are done (with the same config) in a
+        previous (maybe interrupted) run will be skipped
+        * `parallel_kwargs` will be passed to `Parallel`, so they are only
+        available with the 'process' executor
+
+        """
+
+        if parallel_kwargs and self.executor != "process":
+            raise ValueError(
+                f"`parallel_kwargs` ({', '.join(sorted(parallel_kwargs))}) are not "
+                f"supported by the '{self.executor}' executor"
+            )
+
         sorted_workplace_keys = sorted(self.tasks, key=self.key_indices.get)  # type: ignore
-        sorted_tasks = [self.tasks[key] for key in sorted_workplace_keys]
-        sorted_executes = [self.executes[key] for key in sorted_workplace_keys]
         sorted_workplaces = [self.workplaces[key] for key in sorted_workplace_keys]
-        parallel(_task, sorted_tasks, sorted_executes, sorted_workplaces)
+        self.finished = []
+        if resume:
+            for key in sorted_workplace_keys:
+                if self.tasks[key].is_done(self.workplaces[key]):
+                    self.finished.append(key)
+            if self.finished:
+                print(
+                    f"{self.info_prefix}{len(self.finished)} / "
+                    f"{len(sorted_workplace_keys)} tasks are done already, "
+                    "they will be skipped"
+                )
+        unfinished = [k for k in sorted_workplace_keys if k not in self.finished]
+        self._restore_from_cache(unfinished)
+        keys_to_run = [k for k in unfinished if k not in self.cached]
+        for key in keys_to_run:
+            signature = self.tasks[key].signature
+            set_task_status(self.workplaces[key], status_pending, signature=signature)
+        tasks = [self.tasks[key] for key in keys_to_run]
+        executes = [self.executes[key] for key in keys_to_run]
+        workplaces = [self.workplaces[key] for key in keys_to_run]
+        if tasks:
+            args = tasks, executes, workplaces, use_tqdm
+            if self.executor == "pool":
+                self._run_with_pool(*args)
+            elif self.executor == "scheduler":
+                self._run_with_scheduler(*args, keys_to_run)
+            else:
+                self._run_with_parallel(*args, parallel_kwargs)
+            self._store_to_cache(keys_to_run)
         if task_loader is None:
             pipelines = None
         else:
@@ -234,6 +640,37 @@ class Experiment(LoggingMixin):
         )
         return self.results
 
+    @staticmethod
+    def load_results(
+        root_workplace: str,
+        *,
+        task_loader: Optional[Callable[[str], Pipeline]] = None,
+    ) -> ExperimentResults:
+        """rebuilds `ExperimentResults` of the finished tasks from the disk"""
+
+        def _sort_key(key: Tuple[str, str]) -> Tuple[str, int, str]:
+            model, index = key
+            return model, int(index) if index.isdigit() else -1, index
+
+        workplace_keys = []
+        for model in sorted(os.listdir(root_workplace)):
+            model_folder = os.path.join(root_workplace, model)
+            if not os.path.isdir(model_folder):
+                continue
+            for index in os.listdir(model_folder):
+                workplace = os.path.join(model_folder, index)
+                if not os.path.isfile(os.path.join(workplace, task_status_file)):
+                    continue
+                task_status = get_task_status(workplace)
+                if task_status is not None and task_status.is_done:
+                    workplace_keys.append((model, index))
+        workplace_keys = sorted(workplace_keys, key=_sort_key)
+        workplaces = [Experiment.workplace(k, root_workplace) for k in workplace_keys]
+        pipelines = None
+        if task_loader is not None:
+            pipelines = list(map(task_loader, workplaces))
+        return ExperimentResults(workplaces, workplace_keys, pipelines)
+
     def save(self, export_folder: str, *, compress: bool = True) -> "Experiment":
         abs_folder = os.path.abspath(export_folder)
         base_folder = os.path.dirname(abs_folder)
@@ -252,6 +689,10 @@ class Experiment(LoggingMixin):
                 "use_cuda": self.use_cuda,
                 "cuda_list": self.cuda_list,
                 "resource_config": self.resource_config,
+                "thread_config": self.thread_config,
+                "executor": self.executor,
+                "cache_folder": self.cache_folder,
+                "scheduler_config": self.scheduler_config,
                 "results": ExperimentResults(
                     self.results.workplaces,
                     self.results.workplace_keys,
@@ -284,6 +725,10 @@ class Experiment(LoggingMixin):
                     use_cuda=meta_config["use_cuda"],
                     available_cuda_list=meta_config["cuda_list"],
                     resource_config=meta_config["resource_config"],
+                    thread_config=meta_config.get("thread_config"),
+                    executor=meta_config.get("executor", "process"),
+                    cache_folder=meta_config.get("cache_folder"),
+                    scheduler_config=meta_config.get("scheduler_config"),
                 )
                 experiment.executes = meta_config["executes"]
                 results = list(meta_config["results"])
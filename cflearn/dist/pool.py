@@ -0,0 +1,263 @@
+import os
+import sys
+import queue
+import atexit
+import traceback
+import multiprocessing
+
+from typing import *
+from tqdm import tqdm
+from collections import deque
+from contextlib import contextmanager
+from cftool.misc import LoggingMixin
+
+from .task import Task
+from .task import status_failed
+from .task import set_task_status
+from ..misc.toolkit import get_cpu_list
+from ..misc.toolkit import set_num_threads
+
+task_log_file = "__task__.log"
+
+
+class PoolJob(NamedTuple):
+    job_index: int
+    task: Task
+    execute: str
+    config_folder: str
+
+
+class PoolResult(NamedTuple):
+    job_index: int
+    worker: int
+    success: bool
+    message: Optional[str] = None
+
+
+@contextmanager
+def _redirect_output(log_path: str) -> Iterator[None]:
+    # file descriptors are redirected so sub-processes & C extensions are captured
+    sys.stdout.flush()
+    sys.stderr.flush()
+    stdout, stderr = os.dup(1), os.dup(2)
+    with open(log_path, "a") as f:
+        os.dup2(f.fileno(), 1)
+        os.dup2(f.fileno(), 2)
+        try:
+            yield
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(stdout, 1)
+            os.dup2(stderr, 2)
+            os.close(stdout)
+            os.close(stderr)
+
+
+def _worker_loop(
+    worker: int,
+    jobs: Any,
+    results: Any,
+    cuda: Optional[Union[int, str]],
+    num_threads: Optional[int],
+    cpu_affinity: Optional[List[int]],
+) -> None:
+    # `cflearn` (and torch, optuna, ...) has been imported when this function is
+    # unpickled by the worker, so the import cost is paid only once per worker
+    if num_threads is not None:
+        set_num_threads(num_threads, cpu_affinity)
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        success, message = True, None
+        os.makedirs(job.config_folder, exist_ok=True)
+        with _redirect_output(os.path.join(job.config_folder, task_log_file)):
+            try:
+                job.task.run(job.execute, job.config_folder, cuda, in_process=True)
+            except Exception:
+                success, message = False, traceback.format_exc()
+                print(message, file=sys.stderr)
+        results.put(PoolResult(job.job_index, worker, success, message))
+
+
+class _Worker(NamedTuple):
+    process: Any
+    jobs: Any
+
+
+class WorkerPool(LoggingMixin):
+    """
+    A pool of long-lived worker processes which run `Task`s in-process
+
+    * each worker imports `cflearn` only once, so short tasks will not pay the
+    interpreter booting cost again and again
+    * outputs of each task are written to `{workplace}/__task__.log`
+    * a worker which dies (e.g. segfault, OOM killed) will be replaced, and the
+    task it was running will be marked as failed
+    * tasks with a custom `run_command` are still executed as sub-processes
+
+    Parameters
+    ----------
+    num_workers : int, number of worker processes
+    cuda_list : List[int], cuda devices which will be assigned to the workers
+    num_threads : int, intra-op threads of each worker
+    pin_cores : bool, whether pin each worker to its own `num_threads` cores
+
+    """
+
+    def __init__(
+        self,
+        num_workers: int,
+        *,
+        cuda_list: Optional[List[int]] = None,
+        num_threads: Optional[int] = None,
+        pin_cores: bool = False,
+    ):
+        self.num_workers = max(1, num_workers)
+        self.cuda_list = cuda_list or []
+        self.num_threads = num_threads
+        self.cpu_list = None
+        if num_threads is not None and pin_cores:
+            self.cpu_list = get_cpu_list()
+        # `spawn` is used because forking a process with torch threads is unsafe
+        self.ctx = multiprocessing.get_context("spawn")
+        self.results = self.ctx.Queue()
+        self.failures: Dict[int, PoolResult] = {}
+        self.workers = [self._start_worker(i) for i in range(self.num_workers)]
+
+    def __enter__(self) -> "WorkerPool":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    @property
+    def is_alive(self) -> bool:
+        return all(worker.process.is_alive() for worker in self.workers)
+
+    @property
+    def pids(self) -> List[int]:
+        return [worker.process.pid for worker in self.workers]
+
+    def _start_worker(self, i: int) -> _Worker:
+        cuda = None if not self.cuda_list else self.cuda_list[i % len(self.cuda_list)]
+        cpu_affinity = None
+        if self.cpu_list is not None:
+            assert self.num_threads is not None
+            start = i * self.num_threads
+            num_cpus = len(self.cpu_list)
+            indices = range(start, start + self.num_threads)
+            cpu_affinity = sorted({self.cpu_list[j % num_cpus] for j in indices})
+        jobs = self.ctx.Queue()
+        args = i, jobs, self.results, cuda, self.num_threads, cpu_affinity
+        # not daemonic, because tasks may start their own processes
+        process = self.ctx.Process(target=_worker_loop, args=args)
+        process.start()
+        return _Worker(process, jobs)
+
+    def run(self, jobs: List[PoolJob], *, use_tqdm: bool = True) -> List[PoolResult]:
+        pending = deque(jobs)
+        running: Dict[int, PoolJob] = {}
+        finished: Dict[int, PoolResult] = {}
+        iterator = None if not use_tqdm else tqdm(total=len(jobs))
+
+        def _finish(result: PoolResult) -> None:
+            finished[result.job_index] = result
+            if not result.success:
+                self.failures[result.job_index] = result
+                print(
+                    f"{self.warning_prefix}task {result.job_index} failed "
+                    f"on worker {result.worker}:\n{result.message}"
+                )
+            if iterator is not None:
+                iterator.update()
+
+        while pending or running:
+            for i, worker in enumerate(self.workers):
+                if i not in running and pending:
+                    if not worker.process.is_alive():
+                        worker = self.workers[i] = self._start_worker(i)
+                    job = pending.popleft()
+                    running[i] = job
+                    worker.jobs.put(job)
+            try:
+                result = self.results.get(timeout=0.1)
+            except queue.Empty:
+                result = None
+            if result is not None:
+                running_job = running.get(result.worker)
+                # results of a replaced worker may arrive late, they are ignored
+                if running_job is not None:
+                    if running_job.job_index == result.job_index:
+                        running.pop(result.worker)
+                        _finish(result)
+                continue
+            for i, job in list(running.items()):
+                process = self.workers[i].process
+                if process.is_alive():
+                    continue
+                running.pop(i)
+                message = f"worker exited with code {process.exitcode}"
+                set_task_status(job.config_folder, status_failed, message=message)
+                _finish(PoolResult(job.job_index, i, False, message))
+                self.workers[i] = self._start_worker(i)
+        if iterator is not None:
+            iterator.close()
+        return [finished[job.job_index] for job in jobs]
+
+    def close(self, timeout: float = 5.0) -> None:
+        for worker in self.workers:
+            if worker.process.is_alive():
+                worker.jobs.put(None)
+        for worker in self.workers:
+            worker.process.join(timeout)
+            if worker.process.is_alive():
+                worker.process.terminate()
+        self.workers = []
+
+
+_pools: Dict[Tuple[Any, ...], WorkerPool] = {}
+
+
+def get_worker_pool(
+    num_workers: int,
+    *,
+    cuda_list: Optional[List[int]] = None,
+    num_threads: Optional[int] = None,
+    pin_cores: bool = False,
+) -> WorkerPool:
+    """
+    Returns a cached `WorkerPool`, so workers can be reused across experiments
+
+    * the cached pools will be closed when the interpreter exits
+
+    """
+
+    key = num_workers, tuple(cuda_list or []), num_threads, pin_cores
+    pool = _pools.get(key)
+    if pool is None or not pool.workers:
+        pool = _pools[key] = WorkerPool(
+            num_workers,
+            cuda_list=cuda_list,
+            num_threads=num_threads,
+            pin_cores=pin_cores,
+        )
+    return pool
+
+
+@atexit.register
+def close_worker_pools() -> None:
+    for pool in _pools.values():
+        pool.close()
+    _pools.clear()
+
+
+__all__ = [
+    "task_log_file",
+    "PoolJob",
+    "PoolResult",
+    "WorkerPool",
+    "get_worker_pool",
+    "close_worker_pools",
+]
@@ -12,6 +12,9 @@ from typing import NamedTuple
 from cftool.misc import Saving
 from cfdata.tabular import data_type
 
+from ...misc.toolkit import set_num_threads
+from ...misc.toolkit import get_default_num_threads
+
 meta_config_name = "__meta__"
 data_config_file = "__data__.json"
 
@@ -24,12 +27,21 @@ class Info(NamedTuple):
     data_list: Optional[List[data_type]]
 
 
-def get_info(*, requires_data: bool = True) -> Info:
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--config_folder", type=str)
-    args = parser.parse_args()
+def get_info(
+    config_folder: Optional[str] = None,
+    *,
+    requires_data: bool = True,
+) -> Info:
+    if config_folder is None:
+        parser = argparse.ArgumentParser()
+        parser.add_argument("--config_folder", type=str)
+        config_folder = parser.parse_args().config_folder
+        # thread limits are passed from `Task.run` through environment variables
+        num_threads = get_default_num_threads()
+        if num_threads is not None:
+            set_num_threads(num_threads)
     # common
-    meta_config = Saving.load_dict(meta_config_name, args.config_folder)
+    meta_config = Saving.load_dict(meta_config_name, config_folder)
     cuda = meta_config["cuda"]
     kwargs = meta_config["config"]
     workplace = meta_config["workplace"]
@@ -1,10 +1,15 @@
+import time
 import cflearn
 
+from typing import Optional
+
 from ._utils import get_info
+from ..scheduler import dump_resource_usage
 
 
-if __name__ == "__main__":
-    info = get_info()
+def run(config_folder: Optional[str] = None) -> None:
+    t = time.time()
+    info = get_info(config_folder)
     kwargs = info.kwargs
     increment_kwargs = info.increment_kwargs
     data_list = info.data_list
@@ -15,3 +20,8 @@ if __name__ == "__main__":
     m.fit(*data_list, sample_weights=sample_weights)
     compress = info.meta.get("compress", True)
     cflearn.save(m, saving_folder=info.workplace, compress=compress)
+    dump_resource_usage(info.workplace, time.time() - t)
+
+
+if __name__ == "__main__":
+    run()
@@ -1,12 +1,13 @@
 import cflearn
 
+from typing import Optional
 from cflearn.api.hpo import OptunaArgs
 
 from ._utils import get_info
 
 
-if __name__ == "__main__":
-    info = get_info(requires_data=False)
+def run(config_folder: Optional[str] = None) -> None:
+    info = get_info(config_folder, requires_data=False)
     cflearn.optuna_core(
         OptunaArgs(
             info.meta["cuda"],
@@ -16,3 +17,7 @@ if __name__ == "__main__":
             info.meta["key_mapping_folder"],
         )
     )
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,302 @@
+import os
+import json
+import psutil
+import hashlib
+
+import numpy as np
+
+from typing import *
+from tqdm import tqdm
+from collections import deque
+from concurrent.futures import wait
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import FIRST_COMPLETED
+from cftool.misc import LoggingMixin
+
+from .cache import cache_excluded_keys
+from .runs._utils import data_config_file
+from ..misc.toolkit import get_cpu_list
+from ..misc.telemetry import peak_rss_mb
+
+resources_file = "__resources__.json"
+task_history_file = "__task_history__.json"
+
+# python interpreter + torch runtime
+base_memory_mb = 400.0
+# copies of the data kept during training (raw, processed, tensors, ...)
+data_memory_factor = 6.0
+
+
+class TaskResources(NamedTuple):
+    num_threads: int = 1
+    memory_mb: float = base_memory_mb
+    cost: float = 1.0
+
+
+class DataShape(NamedTuple):
+    num_samples: int
+    num_features: int
+    nbytes: int
+
+
+def get_data_shape(data_folder: Optional[str]) -> Optional[DataShape]:
+    """reads the shape of the training data without loading it"""
+    if data_folder is None:
+        return None
+    config_path = os.path.join(data_folder, data_config_file)
+    if os.path.isfile(config_path):
+        with open(config_path, "r") as f:
+            x_path = json.load(f).get("x")
+        if x_path is None or not os.path.isfile(x_path):
+            return None
+        with open(x_path, "r") as f:
+            num_columns = len(f.readline().split(","))
+            num_lines = 1 + sum(1 for _ in f)
+        return DataShape(num_lines, num_columns, os.path.getsize(x_path))
+    x_file = os.path.join(data_folder, "x.npy")
+    if not os.path.isfile(x_file):
+        return None
+    try:
+        x = np.load(x_file, mmap_mode="r")
+    except ValueError:
+        # arrays of python objects cannot be memory-mapped
+        x = np.load(x_file, allow_pickle=True)
+    num_features = 1 if x.ndim == 1 else int(np.prod(x.shape[1:]))
+    return DataShape(len(x), num_features, os.path.getsize(x_file))
+
+
+def get_num_epoch(config: Dict[str, Any]) -> int:
+    for key in ["fixed_epoch", "num_epoch", "max_epoch"]:
+        value = config.get(key)
+        if value is not None:
+            return max(1, int(value))
+    return 40
+
+
+def task_signature(
+    model: str,
+    config: Dict[str, Any],
+    shape: Optional[DataShape],
+) -> str:
+    """identifies 'similar' tasks, whose resource usages are shared"""
+    config = {k: v for k, v in config.items() if k not in cache_excluded_keys}
+    config.pop("model", None)
+    shape_tuple = None if shape is None else shape[:2]
+    identifier = {"model": model, "config": config, "shape": shape_tuple}
+    dumped = json.dumps(identifier, sort_keys=True, default=repr)
+    return hashlib.sha256(dumped.encode()).hexdigest()
+
+
+def heuristic_resources(
+    config: Dict[str, Any],
+    shape: Optional[DataShape],
+    num_threads: int,
+) -> TaskResources:
+    """
+    estimates resources from the data shape
+
+    * the cost is (samples x features x epochs), models are not distinguished.
+    Model-specific costs are picked up from `TaskHistory` once similar tasks
+    have been run
+
+    """
+
+    if shape is None:
+        return TaskResources(num_threads)
+    num_epoch = get_num_epoch(config)
+    cost = shape.num_samples * shape.num_features * num_epoch
+    memory_mb = base_memory_mb + data_memory_factor * shape.nbytes / 1024.0 ** 2
+    return TaskResources(num_threads, memory_mb, float(cost))
+
+
+def dump_resource_usage(workplace: str, seconds: float) -> None:
+    """called by the task process, records its own resource usage"""
+    usage = {"seconds": seconds, "peak_rss_mb": peak_rss_mb()}
+    with open(os.path.join(workplace, resources_file), "w") as f:
+        json.dump(usage, f)
+
+
+def load_resource_usage(workplace: str) -> Optional[Dict[str, float]]:
+    path = os.path.join(workplace, resources_file)
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+class TaskHistory:
+    """
+    Records the resource usages of past tasks
+
+    * records are keyed by `task_signature`
+    * the heuristic cost is stored as well, so the (relative) heuristic costs of
+    unseen tasks can be calibrated to seconds
+
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records: Dict[str, Dict[str, float]] = {}
+        if os.path.isfile(path):
+            with open(path, "r") as f:
+                self.records = json.load(f)
+
+    @property
+    def seconds_per_cost(self) -> Optional[float]:
+        ratios = [
+            record["seconds"] / record["cost"]
+            for record in self.records.values()
+            if record.get("cost", 0.0) > 0.0
+        ]
+        if not ratios:
+            return None
+        return float(np.median(ratios))
+
+    def get(self, signature: str) -> Optional[Dict[str, float]]:
+        return self.records.get(signature)
+
+    def update(self, signature: str, usage: Dict[str, float], cost: float) -> None:
+        record = dict(usage)
+        record["cost"] = cost
+        self.records[signature] = record
+
+    def save(self) -> None:
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.records, f)
+        os.replace(tmp_path, self.path)
+
+
+def estimate_resources(
+    signature: str,
+    heuristic: TaskResources,
+    history: Optional[TaskHistory] = None,
+) -> TaskResources:
+    """estimates from past runs if possible, otherwise from heuristics"""
+    if history is None:
+        return heuristic
+    record = history.get(signature)
+    if record is not None:
+        memory_mb = record["peak_rss_mb"]
+        return heuristic._replace(memory_mb=memory_mb, cost=record["seconds"])
+    seconds_per_cost = history.seconds_per_cost
+    if seconds_per_cost is None:
+        return heuristic
+    return heuristic._replace(cost=heuristic.cost * seconds_per_cost)
+
+
+class ResourceScheduler(LoggingMixin):
+    """
+    Packs tasks onto available cores & memory, longest tasks first
+
+    * tasks are sorted by their (estimated) costs, and each time resources are
+    released, the longest pending task which fits will be started. This is the
+    'longest processing time first' rule, which minimises the makespan
+    * smaller tasks will fill the gaps left by the ones which do not fit
+    * a task which does not fit even when nothing is running will be started
+    alone, so oversized requests will not dead-lock the scheduler
+
+    Parameters
+    ----------
+    num_cpus : int, number of cores which can be used
+    * if not provided, all cores available to current process will be used
+    memory_mb : float, memory (in MB) which can be used
+    * if not provided, `memory_fraction` of the available memory will be used
+    memory_fraction : float, see `memory_mb`
+    max_jobs : int, maximum number of concurrent tasks, 0 means no limit
+
+    """
+
+    def __init__(
+        self,
+        *,
+        num_cpus: Optional[int] = None,
+        memory_mb: Optional[float] = None,
+        memory_fraction: float = 0.8,
+        max_jobs: int = 0,
+    ):
+        self.cpu_list = get_cpu_list()
+        if num_cpus is not None:
+            self.cpu_list = self.cpu_list[: max(1, num_cpus)]
+        if memory_mb is None:
+            available = psutil.virtual_memory().available / 1024.0 ** 2
+            memory_mb = memory_fraction * available
+        self.memory_mb = memory_mb
+        self.max_jobs = max_jobs
+        self.order: List[int] = []
+
+    @property
+    def num_cpus(self) -> int:
+        return len(self.cpu_list)
+
+    def run(
+        self,
+        requests: List[TaskResources],
+        fn: Callable[[int, List[int]], Any],
+        *,
+        use_tqdm: bool = True,
+    ) -> List[int]:
+        """
+        Runs `fn(index, cores)` for each request, returns the starting order
+
+        * `cores` are the cores assigned to the task
+
+        """
+
+        pending = deque(sorted(range(len(requests)), key=lambda i: -requests[i].cost))
+        free_cpus = list(self.cpu_list)
+        free_memory = self.memory_mb
+        running: Dict[Future, Tuple[int, List[int]]] = {}
+        self.order = []
+        iterator = None if not use_tqdm else tqdm(total=len(requests))
+        max_workers = self.max_jobs or len(requests) or 1
+        with ThreadPoolExecutor(max_workers) as executor:
+            while pending or running:
+                for i in list(pending):
+                    if self.max_jobs > 0 and len(running) >= self.max_jobs:
+                        break
+                    request = requests[i]
+                    num_threads = min(max(1, request.num_threads), self.num_cpus)
+                    fits = num_threads <= len(free_cpus)
+                    fits = fits and request.memory_mb <= free_memory
+                    if not fits and running:
+                        continue
+                    cores = free_cpus[:num_threads]
+                    free_cpus = free_cpus[num_threads:]
+                    free_memory -= request.memory_mb
+                    pending.remove(i)
+                    self.order.append(i)
+                    running[executor.submit(fn, i, cores)] = i, cores
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    i, cores = running.pop(future)
+                    free_cpus = sorted(set(free_cpus) | set(cores))
+                    free_memory += requests[i].memory_mb
+                    exception = future.exception()
+                    if exception is not None:
+                        print(f"{self.warning_prefix}task {i} failed: {exception}")
+                    if iterator is not None:
+                        iterator.update()
+        if iterator is not None:
+            iterator.close()
+        return self.order
+
+
+__all__ = [
+    "resources_file",
+    "task_history_file",
+    "TaskResources",
+    "DataShape",
+    "get_data_shape",
+    "task_signature",
+    "heuristic_resources",
+    "estimate_resources",
+    "dump_resource_usage",
+    "load_resource_usage",
+    "TaskHistory",
+    "ResourceScheduler",
+]
@@ -0,0 +1,278 @@
+import os
+import sys
+import uuid
+import pickle
+import optuna
+import warnings
+
+from typing import *
+from datetime import datetime
+from optuna.trial import TrialState
+from optuna.trial import FrozenTrial
+from optuna.study import StudySummary
+from optuna.study import StudyDirection
+from optuna.storages import BaseStorage
+from optuna.storages import InMemoryStorage
+from optuna.distributions import BaseDistribution
+
+if sys.platform != "win32":
+    import fcntl
+
+journal_prefix = "journal:///"
+# same as the prefix of the study names generated by optuna storages
+default_study_name_prefix = "no-name-"
+
+
+def _optuna_major_version() -> int:
+    return int(optuna.__version__.split(".")[0])
+
+
+def _native_journal_storage(path: str) -> Optional[BaseStorage]:
+    # `JournalStorage` is shipped with optuna>=3.1
+    storages = optuna.storages
+    journal_storage_base = getattr(storages, "JournalStorage", None)
+    if journal_storage_base is None:
+        return None
+    backend_base = getattr(storages, "JournalFileStorage")
+    try:
+        # optuna>=4.0 renames the file backend
+        from optuna.storages.journal import JournalFileBackend
+
+        backend_base = JournalFileBackend
+    except ImportError:
+        pass
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with warnings.catch_warnings():
+        # `JournalStorage` is marked as experimental in optuna 3.x
+        warnings.simplefilter("ignore", optuna.exceptions.ExperimentalWarning)
+        return journal_storage_base(backend_base(path))
+
+
+class JournalFileStorage(BaseStorage):
+    """
+    An optuna storage backed by an append-only journal file, it is used when
+    optuna does not ship its own `JournalStorage` (optuna<3.1)
+
+    * it implements the `BaseStorage` api of optuna 2.x, so it is only available
+    with optuna<3.0 (see `is_journal_available`)
+
+    * every process keeps an in-memory replica of the storage, which is
+    synchronized by replaying the (new) operations of the journal file
+    * writes are appended under an exclusive `flock`, reads only need a shared
+    one, so workers never wait on database level locks as with sqlite
+    * non-deterministic values (generated study names, timestamps) are resolved
+    before they are written, so all replicas are identical
+
+    Parameters
+    ----------
+    path : str, path of the journal file
+
+    """
+
+    def __init__(self, path: str):
+        if sys.platform == "win32":
+            raise ValueError("`JournalFileStorage` requires `fcntl`")
+        if _optuna_major_version() >= 3:
+            msg = "`JournalFileStorage` only supports optuna<3.0"
+            raise ValueError(msg)
+        self.path = os.path.abspath(path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        open(self.path, "ab").close()
+        self._replica = InMemoryStorage()
+        self._offset = 0
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {"path": self.path}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__init__(state["path"])  # type: ignore
+
+    # core
+
+    def _apply(self, op: Tuple[str, Tuple[Any, ...], Optional[datetime]]) -> Any:
+        name, args, now = op
+        result = getattr(self._replica, name)(*args)
+        if now is not None and name == "set_trial_state" and result:
+            trial = self._replica._get_trial(args[0])
+            if args[1] == TrialState.RUNNING:
+                trial.datetime_start = now
+            if trial.datetime_complete is not None:
+                trial.datetime_complete = now
+        return result
+
+    def _read(self, f: BinaryIO) -> None:
+        f.seek(self._offset)
+        while True:
+            try:
+                op = pickle.load(f)
+            except Exception:
+                # reaches the end, or the last record is incomplete because a
+                # process crashed in the middle of writing
+                break
+            self._offset = f.tell()
+            self._apply(op)
+
+    def _sync(self) -> None:
+        with open(self.path, "rb") as f:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            try:
+                self._read(f)
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _write(self, name: str, *args: Any, now: Optional[datetime] = None) -> Any:
+        with open(self.path, "ab+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                self._read(f)
+                op = name, args, now
+                # invalid operations raise here and will not be written
+                result = self._apply(op)
+                # drops the incomplete record (if any) left by a crashed process
+                f.truncate(self._offset)
+                f.write(pickle.dumps(op))
+                f.flush()
+                self._offset = f.tell()
+                return result
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _get(self, name: str, *args: Any, **kwargs: Any) -> Any:
+        self._sync()
+        return getattr(self._replica, name)(*args, **kwargs)
+
+    # study
+
+    def create_new_study(self, study_name: Optional[str] = None) -> int:
+        if study_name is None:
+            study_name = default_study_name_prefix + str(uuid.uuid4())
+        return self._write("create_new_study", study_name)
+
+    def delete_study(self, study_id: int) -> None:
+        self._write("delete_study", study_id)
+
+    def set_study_user_attr(self, study_id: int, key: str, value: Any) -> None:
+        self._write("set_study_user_attr", study_id, key, value)
+
+    def set_study_system_attr(self, study_id: int, key: str, value: Any) -> None:
+        self._write("set_study_system_attr", study_id, key, value)
+
+    def set_study_directions(
+        self,
+        study_id: int,
+        directions: Sequence[StudyDirection],
+    ) -> None:
+        self._write("set_study_directions", study_id, list(directions))
+
+    def get_study_id_from_name(self, study_name: str) -> int:
+        return self._get("get_study_id_from_name", study_name)
+
+    def get_study_id_from_trial_id(self, trial_id: int) -> int:
+        return self._get("get_study_id_from_trial_id", trial_id)
+
+    def get_study_name_from_id(self, study_id: int) -> str:
+        return self._get("get_study_name_from_id", study_id)
+
+    def get_study_directions(self, study_id: int) -> List[StudyDirection]:
+        return self._get("get_study_directions", study_id)
+
+    def get_study_user_attrs(self, study_id: int) -> Dict[str, Any]:
+        return self._get("get_study_user_attrs", study_id)
+
+    def get_study_system_attrs(self, study_id: int) -> Dict[str, Any]:
+        return self._get("get_study_system_attrs", study_id)
+
+    def get_all_study_summaries(self) -> List[StudySummary]:
+        return self._get("get_all_study_summaries")
+
+    # trial
+
+    def create_new_trial(
+        self,
+        study_id: int,
+        template_trial: Optional[FrozenTrial] = None,
+    ) -> int:
+        if template_trial is None:
+            template_trial = InMemoryStorage._create_running_trial()
+        return self._write("create_new_trial", study_id, template_trial)
+
+    def set_trial_state(self, trial_id: int, state: TrialState) -> bool:
+        return self._write("set_trial_state", trial_id, state, now=datetime.now())
+
+    def set_trial_param(
+        self,
+        trial_id: int,
+        param_name: str,
+        param_value_internal: float,
+        distribution: BaseDistribution,
+    ) -> None:
+        args = trial_id, param_name, param_value_internal, distribution
+        self._write("set_trial_param", *args)
+
+    def set_trial_values(self, trial_id: int, values: Sequence[float]) -> None:
+        self._write("set_trial_values", trial_id, list(values))
+
+    def set_trial_intermediate_value(
+        self,
+        trial_id: int,
+        step: int,
+        intermediate_value: float,
+    ) -> None:
+        args = trial_id, step, intermediate_value
+        self._write("set_trial_intermediate_value", *args)
+
+    def set_trial_user_attr(self, trial_id: int, key: str, value: Any) -> None:
+        self._write("set_trial_user_attr", trial_id, key, value)
+
+    def set_trial_system_attr(self, trial_id: int, key: str, value: Any) -> None:
+        self._write("set_trial_system_attr", trial_id, key, value)
+
+    def get_trial_number_from_id(self, trial_id: int) -> int:
+        return self._get("get_trial_number_from_id", trial_id)
+
+    def get_trial_param(self, trial_id: int, param_name: str) -> float:
+        return self._get("get_trial_param", trial_id, param_name)
+
+    def get_trial(self, trial_id: int) -> FrozenTrial:
+        return self._get("get_trial", trial_id)
+
+    def get_all_trials(
+        self,
+        study_id: int,
+        deepcopy: bool = True,
+        states: Optional[Tuple[TrialState, ...]] = None,
+    ) -> List[FrozenTrial]:
+        return self._get("get_all_trials", study_id, deepcopy, states)
+
+    def read_trials_from_remote_storage(self, study_id: int) -> None:
+        self._sync()
+
+
+def is_journal_available() -> bool:
+    if getattr(optuna.storages, "JournalStorage", None) is not None:
+        return True
+    return sys.platform != "win32" and _optuna_major_version() < 3
+
+
+def make_storage(storage: Optional[str]) -> Optional[Union[str, BaseStorage]]:
+    """
+    parses `journal:///path` into optuna's `JournalStorage` if it is available,
+    otherwise into a `JournalFileStorage`
+
+    """
+
+    if storage is None or not storage.startswith(journal_prefix):
+        return storage
+    path = storage[len(journal_prefix) :]
+    native = _native_journal_storage(path)
+    if native is not None:
+        return native
+    return JournalFileStorage(path)
+
+
+__all__ = [
+    "journal_prefix",
+    "is_journal_available",
+    "make_storage",
+    "JournalFileStorage",
+]
@@ -1,22 +1,147 @@
 import os
 import sys
+import json
+import time
+import importlib
+import subprocess
 
 from typing import *
+from functools import partial
 from cftool.misc import Saving, shallow_copy_dict
 
+from .cache import cache_excluded_keys
+from .cache import fingerprint_meta
+from .cache import fingerprint_data_folder
 from .runs._utils import meta_config_name
+from ..misc._api import SAVING_DELIM
+from ..misc.toolkit import get_thread_env
+
+task_status_file = "__status__.json"
+status_pending = "pending"
+status_running = "running"
+status_done = "done"
+status_failed = "failed"
+
+
+class TaskStatus(NamedTuple):
+    status: str
+    signature: Optional[str] = None
+    artifacts: Optional[List[str]] = None
+    pid: Optional[int] = None
+    message: Optional[str] = None
+    updated: Optional[float] = None
+
+    @property
+    def is_done(self) -> bool:
+        if self.status != status_done:
+            return False
+        return all(map(os.path.exists, self.artifacts or []))
+
+
+def get_task_status(workplace: str) -> Optional[TaskStatus]:
+    path = os.path.join(workplace, task_status_file)
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path, "r") as f:
+            return TaskStatus(**json.load(f))
+    except (ValueError, TypeError):
+        return None
+
+
+def set_task_status(
+    workplace: str,
+    status: str,
+    *,
+    signature: Optional[str] = None,
+    message: Optional[str] = None,
+) -> TaskStatus:
+    """
+    Writes the status of the task in `workplace` durably (atomic rename + fsync)
+
+    * artifacts (pipelines saved by `cflearn.save`) are recorded when it is done
+
+    """
+
+    artifacts = None
+    if status == status_done and os.path.isdir(workplace):
+        prefix = f"cflearn{SAVING_DELIM}"
+        artifacts = sorted(
+            os.path.join(workplace, file)
+            for file in os.listdir(workplace)
+            if file.startswith(prefix)
+        )
+    task_status = TaskStatus(
+        status,
+        signature,
+        artifacts,
+        os.getpid(),
+        message,
+        time.time(),
+    )
+    os.makedirs(workplace, exist_ok=True)
+    path = os.path.join(workplace, task_status_file)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(task_status._asdict(), f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return task_status
 
 
 class Task:
     def __init__(self, run_command: Optional[str] = None, **meta_kwargs: Any):
         self.run_command = run_command
         self.meta_kwargs = meta_kwargs
+        self._data_fingerprints: Dict[str, str] = {}
+
+    def _fingerprint(self, data_folder: str) -> str:
+        fingerprint = self._data_fingerprints.get(data_folder)
+        if fingerprint is None:
+            fingerprint = fingerprint_data_folder(data_folder)
+            self._data_fingerprints[data_folder] = fingerprint
+        return fingerprint
+
+    @property
+    def signature(self) -> str:
+        """
+        identifies the task, so resumed runs can detect modified tasks
+
+        * the content of the data folder is hashed, so re-dumped data (e.g. new
+        data under the same workplace) will be detected as well
+        * arrays in the meta (e.g. `sample_weights`) are hashed by their contents
+
+        """
+
+        meta = shallow_copy_dict(self.meta_kwargs)
+        data_folder = None
+        for key in ["config", "increment_config"]:
+            config = meta.get(key)
+            if isinstance(config, dict):
+                data_folder = config.get("data_folder", data_folder)
+                excluded = cache_excluded_keys - {"data_folder"}
+                meta[key] = {k: v for k, v in config.items() if k not in excluded}
+        if data_folder is not None and os.path.isdir(data_folder):
+            meta["data_fingerprint"] = self._fingerprint(data_folder)
+        meta["run_command"] = self.run_command
+        return fingerprint_meta(meta)
+
+    def is_done(self, workplace: str) -> bool:
+        task_status = get_task_status(workplace)
+        if task_status is None or not task_status.is_done:
+            return False
+        return task_status.signature == self.signature
 
     def run(
         self,
         execute: str,
         config_folder: str,
         cuda: Optional[Union[int, str]],
+        *,
+        num_threads: Optional[int] = None,
+        cpu_affinity: Optional[List[int]] = None,
+        in_process: bool = False,
     ) -> "Task":
         if self.run_command is not None:
             command = self.run_command
@@ -26,7 +151,35 @@ class Task:
         meta_config["cuda"] = cuda
         os.makedirs(config_folder, exist_ok=True)
         Saving.save_dict(meta_config, meta_config_name, config_folder)
-        os.system(f"{command} --config_folder {config_folder}")
+        signature = self.signature
+        set_task_status(config_folder, status_running, signature=signature)
+        # `in_process` is used by warm workers, which have imported `cflearn` already
+        if in_process and self.run_command is None:
+            module = importlib.import_module(f"cflearn.dist.runs.{execute}")
+            try:
+                module.run(config_folder)  # type: ignore
+            except Exception as err:
+                message = f"{type(err).__name__}: {err}"
+                set_task_status(config_folder, status_failed, message=message)
+                raise
+            set_task_status(config_folder, status_done, signature=signature)
+            return self
+        command = f"{command} --config_folder {config_folder}"
+        if num_threads is None and cpu_affinity is None:
+            code = os.system(command)
+        else:
+            env = os.environ.copy()
+            if num_threads is not None:
+                env.update(get_thread_env(num_threads))
+            preexec_fn = None
+            if cpu_affinity is not None and hasattr(os, "sched_setaffinity"):
+                preexec_fn = partial(os.sched_setaffinity, 0, cpu_affinity)
+            code = subprocess.call(command, shell=True, env=env, preexec_fn=preexec_fn)
+        if code == 0:
+            set_task_status(config_folder, status_done, signature=signature)
+        else:
+            message = f"'{command}' exited with code {code}"
+            set_task_status(config_folder, status_failed, message=message)
         return self
 
     def save(self, saving_folder: str) -> "Task":
@@ -42,4 +195,14 @@ class Task:
         return cls(**meta_config)
 
 
-__all__ = ["Task"]
+__all__ = [
+    "task_status_file",
+    "status_pending",
+    "status_running",
+    "status_done",
+    "status_failed",
+    "TaskStatus",
+    "get_task_status",
+    "set_task_status",
+    "Task",
+]
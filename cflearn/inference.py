@@ -5,6 +5,7 @@ import torch
 import numpy as np
 
 from typing import *
+from onnxruntime import SessionOptions
 from onnxruntime import InferenceSession
 from cftool.misc import shallow_copy_dict
 from cftool.misc import lock_manager
@@ -19,6 +20,7 @@ from .protocol import InferenceProtocol
 from .protocol import DataLoaderProtocol
 from .misc.toolkit import to_standard
 from .misc.toolkit import eval_context
+from .misc.toolkit import get_default_num_threads
 from .misc.toolkit import LoggingMixinWithRank
 from .models.base import ModelBase
 
@@ -151,7 +153,17 @@ class ONNX:
             onnx_path = onnx_config["onnx_path"]
             self.output_names = onnx_config["output_names"]
             self.output_probabilities = onnx_config["output_probabilities"]
-            self.ort_session = InferenceSession(onnx_path)
+            # falls back to the limit set by `Experiment` / `set_num_threads`
+            num_threads = onnx_config.get("num_threads")
+            if num_threads is None:
+                num_threads = get_default_num_threads()
+            if num_threads is None:
+                self.ort_session = InferenceSession(onnx_path)
+            else:
+                options = SessionOptions()
+                options.intra_op_num_threads = num_threads
+                options.inter_op_num_threads = 1
+                self.ort_session = InferenceSession(onnx_path, options)
         else:
             assert model is not None
             self.model = model.cpu()
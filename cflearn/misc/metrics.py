@@ -0,0 +1,274 @@
+import torch
+
+import numpy as np
+import torch.nn.functional as F
+
+from abc import abstractmethod
+from abc import ABC
+from typing import *
+from cftool.misc import register_core
+
+from .toolkit import to_numpy
+
+streaming_metric_dict: Dict[str, Type["StreamingMetric"]] = {}
+
+
+class StreamingMetric(ABC):
+    """
+    Base class of metrics which can be accumulated batch by batch
+    * statistics are kept on the device of the inputs and will only be
+    synchronized once, when `finalize` is called
+    * rows with nan predictions will be ignored, which aligns with `Metrics`
+
+    """
+
+    requires_prob: bool = False
+
+    __identifier__: str
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        self.config = config or {}
+        self.reset()
+
+    @abstractmethod
+    def reset(self) -> None:
+        pass
+
+    @abstractmethod
+    def _update(
+        self,
+        labels: torch.Tensor,
+        predictions: torch.Tensor,
+        valid: torch.Tensor,
+    ) -> None:
+        pass
+
+    @abstractmethod
+    def finalize(self) -> float:
+        pass
+
+    def update(self, labels: torch.Tensor, predictions: torch.Tensor) -> None:
+        if not torch.is_floating_point(predictions):
+            valid = torch.ones_like(predictions[..., :1], dtype=torch.bool)
+        else:
+            valid = ~torch.isnan(predictions).any(dim=1, keepdim=True)
+            predictions = predictions.masked_fill(~valid, 0.0)
+        self._update(labels, predictions, valid)
+
+    @classmethod
+    def get(cls, name: str) -> Type["StreamingMetric"]:
+        return streaming_metric_dict[name]
+
+    @classmethod
+    def make(
+        cls, name: str, config: Optional[Dict[str, Any]] = None
+    ) -> "StreamingMetric":
+        return cls.get(name)(config)
+
+    @classmethod
+    def register(cls, name: str) -> Callable[[Type], Type]:
+        global streaming_metric_dict
+
+        def before(cls_: Type) -> None:
+            cls_.__identifier__ = name
+
+        return register_core(name, streaming_metric_dict, before_register=before)
+
+
+class MeanMetric(StreamingMetric):
+    """averages element-wise values over all valid rows & columns"""
+
+    def reset(self) -> None:
+        self._sum: Union[float, torch.Tensor] = 0.0
+        self._count: Union[float, torch.Tensor] = 0.0
+
+    @abstractmethod
+    def _values(self, labels: torch.Tensor, predictions: torch.Tensor) -> torch.Tensor:
+        pass
+
+    def _update(
+        self,
+        labels: torch.Tensor,
+        predictions: torch.Tensor,
+        valid: torch.Tensor,
+    ) -> None:
+        values = self._values(labels, predictions)
+        values = values.to(torch.float64).masked_fill(~valid, 0.0)
+        self._sum = self._sum + values.sum()
+        self._count = self._count + valid.sum() * values.shape[1]
+
+    def finalize(self) -> float:
+        if isinstance(self._sum, float):
+            return float("nan")
+        return (self._sum / self._count).item()
+
+
+@StreamingMetric.register("mae")
+class MAE(MeanMetric):
+    def _values(self, labels: torch.Tensor, predictions: torch.Tensor) -> torch.Tensor:
+        return torch.abs(labels - predictions)
+
+
+@StreamingMetric.register("mse")
+class MSE(MeanMetric):
+    def _values(self, labels: torch.Tensor, predictions: torch.Tensor) -> torch.Tensor:
+        return torch.square(labels - predictions)
+
+
+@StreamingMetric.register("acc")
+class Accuracy(MeanMetric):
+    def _values(self, labels: torch.Tensor, predictions: torch.Tensor) -> torch.Tensor:
+        return labels == predictions
+
+
+@StreamingMetric.register("quantile")
+class Quantile(MeanMetric):
+    def _values(self, labels: torch.Tensor, predictions: torch.Tensor) -> torch.Tensor:
+        q = self.config["q"]
+        if not isinstance(q, float):
+            q = torch.tensor(q, dtype=predictions.dtype, device=predictions.device)
+            q = q.view(1, -1)
+        error = labels - predictions
+        # `Metrics.quantile` averages over samples and sums over quantiles
+        num_quantiles = predictions.shape[1]
+        return torch.max(q * error, (q - 1.0) * error) * num_quantiles
+
+
+class ProbabilityHistogram:
+    """
+    Util class which accumulates per-class histograms of probabilities,
+    split by whether the sample belongs to the class or not
+    * `positives[c, b]` is the number of samples with label `c`
+    whose probability of class `c` falls into the `b`-th bin
+
+    """
+
+    def __init__(self, num_bins: int = 10000):
+        self.num_bins = num_bins
+        self.reset()
+
+    def reset(self) -> None:
+        self._positives: Optional[torch.Tensor] = None
+        self._negatives: Optional[torch.Tensor] = None
+
+    def update(
+        self,
+        labels: torch.Tensor,
+        probabilities: torch.Tensor,
+        valid: Optional[torch.Tensor] = None,
+    ) -> None:
+        if valid is None:
+            valid = ~torch.isnan(probabilities).any(dim=1, keepdim=True)
+            probabilities = probabilities.masked_fill(~valid, 0.0)
+        num_classes = probabilities.shape[1]
+        bins = (probabilities.clamp(0.0, 1.0) * self.num_bins).to(torch.long)
+        bins = bins.clamp_(max=self.num_bins - 1)
+        offsets = torch.arange(num_classes, device=bins.device) * self.num_bins
+        flat_bins = (bins + offsets.view(1, -1)).view(-1)
+        is_positive = F.one_hot(labels.view(-1).to(torch.long), num_classes).bool()
+        is_negative = ~is_positive & valid
+        is_positive = is_positive & valid
+        num_total = num_classes * self.num_bins
+        positives = torch.bincount(
+            flat_bins,
+            is_positive.view(-1).to(torch.float64),
+            minlength=num_total,
+        )
+        negatives = torch.bincount(
+            flat_bins,
+            is_negative.view(-1).to(torch.float64),
+            minlength=num_total,
+        )
+        shape = num_classes, self.num_bins
+        if self._positives is None or self._negatives is None:
+            self._positives = positives.view(*shape)
+            self._negatives = negatives.view(*shape)
+        else:
+            self._positives += positives.view(*shape)
+            self._negatives += negatives.view(*shape)
+
+    @property
+    def is_empty(self) -> bool:
+        return self._positives is None
+
+    def counts(self) -> Tuple[np.ndarray, np.ndarray]:
+        if self._positives is None or self._negatives is None:
+            raise ValueError("histogram is empty")
+        return to_numpy(self._positives), to_numpy(self._negatives)
+
+    @staticmethod
+    def auc(positives: np.ndarray, negatives: np.ndarray) -> float:
+        num_positives, num_negatives = positives.sum(), negatives.sum()
+        if num_positives == 0 or num_negatives == 0:
+            return float("nan")
+        # samples which fall into the same bin are treated as ties
+        negatives_below = np.cumsum(negatives) - negatives
+        area = (positives * (negatives_below + 0.5 * negatives)).sum()
+        return float(area / (num_positives * num_negatives))
+
+    def _binary_curve(self, metric_type: str, class_index: int) -> np.ndarray:
+        positives, negatives = self.counts()
+        positives, negatives = positives[class_index], negatives[class_index]
+        num_positives, num_negatives = positives.sum(), negatives.sum()
+        if num_positives == 0 or num_negatives == 0:
+            raise ValueError("both positive & negative samples are required")
+        # the i-th element corresponds to the threshold `i / num_bins`,
+        # and samples whose bin index >= i will be predicted as positive
+        zero = np.zeros(1, np.float64)
+        tp = np.concatenate([np.cumsum(positives[::-1])[::-1], zero])
+        fp = np.concatenate([np.cumsum(negatives[::-1])[::-1], zero])
+        tpr, fpr = tp / num_positives, fp / num_negatives
+        if metric_type == "acc":
+            return (tp + num_negatives - fp) / (num_positives + num_negatives)
+        if metric_type == "ber":
+            return 0.5 * (1.0 - tpr + fpr)
+        msg = f"transformation from fpr, tpr -> '{metric_type}' is not implemented"
+        raise NotImplementedError(msg)
+
+    def binary_threshold(self, metric_type: str, class_index: int = 1) -> float:
+        curve = self._binary_curve(metric_type, class_index)
+        if metric_type == "ber":
+            curve = -curve
+        return np.argmax(curve).item() / self.num_bins
+
+    def binary_metric(
+        self,
+        metric_type: str,
+        threshold: float,
+        class_index: int = 1,
+    ) -> float:
+        curve = self._binary_curve(metric_type, class_index)
+        index = min(max(int(np.ceil(threshold * self.num_bins)), 0), self.num_bins)
+        return curve[index].item()
+
+
+@StreamingMetric.register("auc")
+class AUC(StreamingMetric):
+    requires_prob = True
+
+    def reset(self) -> None:
+        self.histogram = ProbabilityHistogram(self.config.get("num_bins", 10000))
+
+    def _update(
+        self,
+        labels: torch.Tensor,
+        predictions: torch.Tensor,
+        valid: torch.Tensor,
+    ) -> None:
+        self.histogram.update(labels, predictions, valid)
+
+    def finalize(self) -> float:
+        if self.histogram.is_empty:
+            return float("nan")
+        positives, negatives = self.histogram.counts()
+        if positives.shape[0] == 2:
+            return self.histogram.auc(positives[1], negatives[1])
+        aucs = [self.histogram.auc(p, n) for p, n in zip(positives, negatives)]
+        return float(np.mean(aucs))
+
+
+__all__ = [
+    "StreamingMetric",
+    "MeanMetric",
+    "ProbabilityHistogram",
+]
@@ -0,0 +1,198 @@
+import os
+import sys
+import json
+import time
+import psutil
+
+import numpy as np
+
+from typing import *
+
+
+def peak_rss_mb() -> float:
+    """peak resident set size of current process, in MB"""
+    if sys.platform != "win32":
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # linux reports kilobytes while macOS reports bytes
+        return peak / (1024.0 ** 2 if sys.platform == "darwin" else 1024.0)
+    info = psutil.Process().memory_info()
+    return getattr(info, "peak_wset", info.rss) / 1024.0 ** 2
+
+
+def rss_mb() -> float:
+    """current resident set size of current process, in MB"""
+    return psutil.Process().memory_info().rss / 1024.0 ** 2
+
+
+class _NullPhase:
+    def __enter__(self) -> None:
+        pass
+
+    def __exit__(self, *args: Any) -> None:
+        pass
+
+
+null_phase = _NullPhase()
+
+
+class _Phase:
+    def __init__(self, telemetry: "StepTelemetry", name: str):
+        self.telemetry = telemetry
+        self.name = name
+
+    def __enter__(self) -> None:
+        self.tic = time.perf_counter()
+        self.telemetry._children.append(0.0)
+
+    def __exit__(self, *args: Any) -> None:
+        elapsed = time.perf_counter() - self.tic
+        children = self.telemetry._children
+        # nested phases (e.g. checkpoint inside monitor) are excluded from parents
+        own = elapsed - children.pop()
+        current = self.telemetry._current
+        current[self.name] = current.get(self.name, 0.0) + own
+        if children:
+            children[-1] += elapsed
+
+
+class StepTelemetry:
+    """
+    Records wall time of each phase of every optimizer step
+
+    * each step is written as a json line to `__telemetry__.jsonl`
+    * percentiles of each field are written to `__telemetry_summary__.json`
+    when `close` is called
+    * time which is not covered by any phase will be recorded as 'other'
+
+    Parameters
+    ----------
+    folder : str, where the telemetry files will be written
+    flush_interval : int, number of steps between two flushes of the jsonl file
+    percentiles : List[float], percentiles which will be summarized
+
+    Examples
+    --------
+    >>> telemetry = StepTelemetry("_logs")
+    >>> for step, batch in enumerate(loader, 1):
+    >>>     telemetry.batch_fetched(len(batch))
+    >>>     with telemetry.phase("forward"):
+    >>>         ...
+    >>>     telemetry.end_step(step)
+    >>> telemetry.close()
+
+    """
+
+    phases = (
+        "data",
+        "forward",
+        "backward",
+        "optimizer",
+        "ema",
+        "monitor",
+        "checkpoint",
+    )
+
+    jsonl_file = "__telemetry__.jsonl"
+    summary_file = "__telemetry_summary__.json"
+
+    def __init__(
+        self,
+        folder: str,
+        *,
+        flush_interval: int = 50,
+        percentiles: Tuple[float, ...] = (50.0, 95.0, 99.0),
+    ):
+        os.makedirs(folder, exist_ok=True)
+        self.jsonl_path = os.path.join(folder, self.jsonl_file)
+        self.summary_path = os.path.join(folder, self.summary_file)
+        self.flush_interval = flush_interval
+        self.percentiles = percentiles
+        self.records: List[Dict[str, float]] = []
+        self._lines: List[str] = []
+        self._current: Dict[str, float] = {}
+        self._children: List[float] = []
+        self._num_samples = 0
+        self._last_tic: Optional[float] = None
+        self._step_tic: Optional[float] = None
+        open(self.jsonl_path, "w").close()
+
+    def phase(self, name: str) -> _Phase:
+        return _Phase(self, name)
+
+    def batch_fetched(self, num_samples: int) -> None:
+        tic = time.perf_counter()
+        if self._last_tic is None:
+            self._last_tic = tic
+        if self._step_tic is None:
+            self._step_tic = self._last_tic
+        self._current["data"] = self._current.get("data", 0.0) + tic - self._last_tic
+        self._num_samples += num_samples
+
+    def end_batch(self) -> None:
+        self._last_tic = time.perf_counter()
+
+    def end_step(self, step: int, epoch: Optional[int] = None) -> None:
+        toc = time.perf_counter()
+        wall = toc - (toc if self._step_tic is None else self._step_tic)
+        record: Dict[str, float] = {"step": step}
+        if epoch is not None:
+            record["epoch"] = epoch
+        record["wall"] = wall
+        for name in self.phases:
+            record[name] = self._current.get(name, 0.0)
+        record["other"] = max(0.0, wall - sum(self._current.values()))
+        record["samples_per_sec"] = self._num_samples / wall if wall > 0 else 0.0
+        record["peak_rss_mb"] = peak_rss_mb()
+        self.records.append(record)
+        self._lines.append(json.dumps({k: _compact(v) for k, v in record.items()}))
+        if len(self._lines) >= self.flush_interval:
+            self.flush()
+        self._current = {}
+        self._num_samples = 0
+        self._last_tic = toc
+        self._step_tic = None
+
+    def flush(self) -> None:
+        if not self._lines:
+            return None
+        with open(self.jsonl_path, "a") as f:
+            f.write("\n".join(self._lines) + "\n")
+        self._lines = []
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        if not self.records:
+            return {}
+        keys = ["wall", *self.phases, "other", "samples_per_sec"]
+        summary = {}
+        for key in keys:
+            values = np.array([record[key] for record in self.records])
+            key_summary = {"mean": float(values.mean())}
+            for p in self.percentiles:
+                key_summary[f"p{p:g}"] = float(np.percentile(values, p))
+            summary[key] = key_summary
+        summary["peak_rss_mb"] = {"max": self.records[-1]["peak_rss_mb"]}
+        summary["num_steps"] = {"total": float(len(self.records))}
+        return summary
+
+    def close(self) -> Dict[str, Dict[str, float]]:
+        self.flush()
+        summary = self.summary()
+        with open(self.summary_path, "w") as f:
+            json.dump(summary, f, indent=2)
+        return summary
+
+
+def _compact(value: float) -> Union[int, float]:
+    if isinstance(value, int):
+        return value
+    return float(f"{value:.6g}")
+
+
+__all__ = [
+    "rss_mb",
+    "peak_rss_mb",
+    "null_phase",
+    "StepTelemetry",
+]
@@ -1,6 +1,7 @@
 import os
 import math
 import torch
+import random
 import inspect
 import logging
 import platform
@@ -116,6 +117,33 @@ def get_gradient(
     return grads
 
 
+def amp_context(device: Union[str, torch.device], enabled: bool) -> ContextManager:
+    # cuda uses float16 (with grad scaler), cpu uses bfloat16
+    device_type = torch.device(device).type
+    if device_type == "cuda":
+        return torch.cuda.amp.autocast(enabled=enabled)
+    return torch.autocast(device_type, dtype=torch.bfloat16, enabled=enabled)
+
+
+def full_precision_context(device: Union[str, torch.device]) -> ContextManager:
+    return torch.autocast(torch.device(device).type, enabled=False)
+
+
+def is_amp_enabled(device: Union[str, torch.device]) -> bool:
+    if torch.device(device).type == "cuda":
+        return torch.is_autocast_enabled()
+    return torch.is_autocast_cpu_enabled()
+
+
+def to_full_precision(tensors: tensor_dict_type) -> tensor_dict_type:
+    results = {}
+    for k, v in tensors.items():
+        if isinstance(v, torch.Tensor) and v.dtype in (torch.float16, torch.bfloat16):
+            v = v.float()
+        results[k] = v
+    return results
+
+
 def scheduler_requires_metric(scheduler: Any) -> bool:
     signature = inspect.signature(scheduler.step)
     for name, param in signature.parameters.items():
@@ -125,6 +153,73 @@ def scheduler_requires_metric(scheduler: Any) -> bool:
     return False
 
 
+num_threads_env_key = "CFLEARN_NUM_THREADS"
+thread_env_keys = [
+    "OMP_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    num_threads_env_key,
+]
+
+
+def get_default_num_threads() -> Optional[int]:
+    num_threads = os.environ.get(num_threads_env_key)
+    if num_threads is None:
+        return None
+    return int(num_threads)
+
+
+def get_thread_env(num_threads: int) -> Dict[str, str]:
+    return {key: str(num_threads) for key in thread_env_keys}
+
+
+def get_cpu_list() -> List[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def set_num_threads(
+    num_threads: int,
+    cpu_affinity: Optional[List[int]] = None,
+) -> None:
+    """
+    Limits the intra-op threads of torch and (via environment variables, which
+    will be inherited by sub-processes) BLAS libraries & onnxruntime
+    * BLAS libraries read these variables when they are loaded, so this should
+    be called before sub-processes are started
+    * `cpu_affinity` pins current process (and its sub-processes) to the cores
+
+    """
+
+    os.environ.update(get_thread_env(num_threads))
+    torch.set_num_threads(num_threads)
+    if cpu_affinity is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpu_affinity)
+
+
+def get_random_states() -> Dict[str, Any]:
+    states = {
+        "random": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        states["cuda"] = torch.cuda.get_rng_state_all()
+    return states
+
+
+def set_random_states(states: Dict[str, Any]) -> None:
+    random.setstate(states["random"])
+    np.random.set_state(states["numpy"])
+    torch.set_rng_state(states["torch"])
+    cuda_states = states.get("cuda")
+    if cuda_states is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(cuda_states)
+
+
 def parse_uri(path: str) -> str:
     delim = "/" if platform.system() == "Windows" else ""
     return f"file://{delim}{path}"
@@ -385,6 +480,126 @@ def summary(
     return msg
 
 
+def _tensor_bytes(tensor: Optional[torch.Tensor]) -> int:
+    if tensor is None:
+        return 0
+    return tensor.numel() * tensor.element_size()
+
+
+def memory_summary(
+    model: nn.Module,
+    sample_batch: Optional[tensor_dict_type] = None,
+    optimizers: Optional[Iterable[torch.optim.Optimizer]] = None,
+    *,
+    return_only: bool = False,
+) -> str:
+    """
+    Reports memory usage (in MB) of each direct child of `model`, where items
+    of `ModuleDict` (e.g. transforms, extractors & heads of each pipe) are
+    reported separately
+    * 'Grads' are the gradients of trainable parameters, which are
+    materialized during backward pass
+    * 'Buffers' contain EMA copies, encoder caches, index buffers, etc.
+    * 'Activations' are the tensors saved for backward pass in a forward pass
+    on `sample_batch`, which dominate the peak memory of a training step. The
+    forward pass runs in eval mode (so running statistics, e.g. those of batch
+    norm, will not be touched) and the recorded graph is discarded without any
+    backward pass
+
+    """
+
+    rows: OrderedDict[str, nn.Module] = OrderedDict()
+    for name, child in model.named_children():
+        if not isinstance(child, nn.ModuleDict):
+            rows[name] = child
+        else:
+            for key, sub_child in child.items():
+                rows[f"{name}.{key}"] = sub_child
+    optimizer_bytes: Dict[torch.Tensor, int] = defaultdict(int)
+    for optimizer in optimizers or []:
+        for param, state in optimizer.state.items():
+            if not isinstance(param, torch.Tensor):
+                continue
+            for v in state.values():
+                if isinstance(v, torch.Tensor):
+                    optimizer_bytes[param] += _tensor_bytes(v)
+    # activations
+    activation_bytes: Dict[str, int] = defaultdict(int)
+    if sample_batch is not None:
+        param_pointers = {p.data_ptr() for p in model.parameters()}
+        param_pointers |= {b.data_ptr() for b in model.buffers()}
+        saved_pointers: Set[int] = set()
+        stack: List[str] = []
+        hooks = []
+
+        def pack(tensor: torch.Tensor) -> torch.Tensor:
+            pointer = tensor.data_ptr()
+            if pointer not in param_pointers and pointer not in saved_pointers:
+                saved_pointers.add(pointer)
+                activation_bytes[stack[-1] if stack else ""] += _tensor_bytes(tensor)
+            return tensor
+
+        def _enter_hook(row_name: str) -> Callable:
+            def _enter(*_: Any) -> None:
+                stack.append(row_name)
+
+            return _enter
+
+        def _exit_hook(*_: Any) -> None:
+            stack.pop()
+
+        for row_name, row_module in rows.items():
+            enter_hook = _enter_hook(row_name)
+            for m in row_module.modules():
+                hooks.append(m.register_forward_pre_hook(enter_hook))
+                hooks.append(m.register_forward_hook(_exit_hook))
+        try:
+            with mode_context(model, to_train=False, use_grad=True):
+                with torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t):
+                    model(sample_batch)
+        finally:
+            for h in hooks:
+                h.remove()
+
+    def _mb(num_bytes: float) -> str:
+        return f"{num_bytes / 1024 ** 2:.4f}"
+
+    line_length = 128
+    line_format = "{:50}  {:>14} {:>14} {:>14} {:>14} {:>14}"
+    headers = "Module", "Params", "Grads", "Optim States", "Buffers", "Activations"
+    messages = ["=" * line_length, line_format.format(*headers), "-" * line_length]
+    totals = [0] * 5
+
+    def _add_row(name: str, values: List[int]) -> None:
+        messages.append(line_format.format(name, *map(_mb, values)))
+        for i, v in enumerate(values):
+            totals[i] += v
+
+    for row_name, row_module in rows.items():
+        params = list(row_module.parameters())
+        trainable = [p for p in params if p.requires_grad]
+        _add_row(
+            row_name,
+            [
+                sum(map(_tensor_bytes, params)),
+                sum(map(_tensor_bytes, trainable)),
+                sum(optimizer_bytes.get(p, 0) for p in params),
+                sum(map(_tensor_bytes, row_module.buffers())),
+                activation_bytes.get(row_name, 0),
+            ],
+        )
+    others = activation_bytes.get("", 0)
+    if others > 0:
+        _add_row("(others)", [0, 0, 0, 0, others])
+    messages.append("=" * line_length)
+    messages.append(line_format.format("Total (MB)", *map(_mb, totals)))
+    messages.append("-" * line_length)
+    msg = "\n".join(messages)
+    if not return_only:
+        print(msg)
+    return msg
+
+
 class LoggingMixinWithRank(LoggingMixin):
     is_rank_0: bool = True
 
@@ -864,13 +1079,24 @@ __all__ = [
     "collate_tensor_dicts",
     "switch_requires_grad",
     "get_gradient",
+    "amp_context",
+    "full_precision_context",
+    "is_amp_enabled",
+    "to_full_precision",
     "scheduler_requires_metric",
+    "get_default_num_threads",
+    "get_thread_env",
+    "get_cpu_list",
+    "set_num_threads",
+    "get_random_states",
+    "set_random_states",
     "parse_uri",
     "to_relative",
     "parse_args",
     "parse_path",
     "inject_mlflow_stuffs",
     "summary",
+    "memory_summary",
     "Lambda",
     "LoggingMixinWithRank",
     "Initializer",
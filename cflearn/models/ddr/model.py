@@ -297,6 +297,11 @@ class DDR(ModelBase):
         loader_name: Optional[str] = None,
         **kwargs: Any,
     ) -> tensor_dict_type:
+        # cdf / pdf (gradient of cdf) are too sensitive for half precision
+        if is_amp_enabled(self.device):
+            with full_precision_context(self.device):
+                args = batch, batch_idx, state, batch_indices, loader_name
+                return self.forward(*args, **kwargs)
         # pre-processing
         x_batch = batch["x_batch"]
         labels = batch[self.labels_key]
@@ -34,8 +34,7 @@ class Dropout(nn.Module):
             mask = self._mask_cache
         else:
             self._mask_cache = mask = (
-                torch.bernoulli(net.new(*net.shape).fill_(self._keep_prob))
-                / self._keep_prob
+                torch.empty_like(net).bernoulli_(self._keep_prob) / self._keep_prob
             )
         net = net * mask
         del mask
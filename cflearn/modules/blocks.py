@@ -655,11 +655,14 @@ class DNDF(Module):
         if self._is_regression or self._output_dim <= 1:
             outputs = features.mm(self.leaves)
         else:
-            if self._fast:
-                outputs = LeafAggregation.apply(features, self.leaves)
-            else:
-                leaves = F.softmax(self.leaves, dim=1)
-                outputs = features.mm(leaves)
+            # softmax over leaves should be calculated in full precision
+            with full_precision_context(features.device):
+                features = features.float()
+                if self._fast:
+                    outputs = LeafAggregation.apply(features, self.leaves)
+                else:
+                    leaves = F.softmax(self.leaves, dim=1)
+                    outputs = features.mm(leaves)
         return outputs / self._num_tree
 
 
@@ -22,6 +22,28 @@ register_optimizer("adamw")(torch.optim.AdamW)
 register_optimizer("rmsprop")(torch.optim.RMSprop)
 
 
+def _group_params(
+    params: List[torch.Tensor],
+    key_fn: Optional[Callable[[torch.Tensor], Any]] = None,
+) -> List[List[torch.Tensor]]:
+    """
+    Groups parameters (which have gradients) by device & dtype, so each
+    group can be updated with `torch._foreach_*` (multi-tensor) operations
+
+    """
+    groups: Dict[Any, List[torch.Tensor]] = {}
+    for p in params:
+        if p.grad is None:
+            continue
+        if p.grad.is_sparse:
+            raise RuntimeError("foreach optimizers do not support sparse gradients")
+        key: Tuple[Any, ...] = p.device, p.dtype
+        if key_fn is not None:
+            key += (key_fn(p),)
+        groups.setdefault(key, []).append(p)
+    return list(groups.values())
+
+
 @register_optimizer("nag")
 class NAG(Optimizer):
     def __init__(
@@ -30,9 +52,11 @@ class NAG(Optimizer):
         lr: float,
         momentum: float = 0.0,
         weight_decay: float = 0.0,
+        foreach: bool = False,
     ):
         defaults = dict(lr=lr, lr_old=lr, momentum=momentum, weight_decay=weight_decay)
         super().__init__(params, defaults)
+        self.foreach = foreach
 
     def step(self, closure: Optional[Callable] = None) -> Optional[Any]:
         loss = None
@@ -44,6 +68,11 @@ class NAG(Optimizer):
             lr = group["lr"]
             lr_old = group.get("lr_old", lr)
             lr_correct = lr / lr_old
+            if self.foreach:
+                for params in _group_params(group["params"]):
+                    self._foreach_update(params, lr, lr_correct, momentum, weight_decay)
+                group["lr_old"] = lr
+                continue
             for p in group["params"]:
                 if p.grad is None:
                     continue
@@ -60,6 +89,29 @@ class NAG(Optimizer):
             group["lr_old"] = lr
         return loss
 
+    def _foreach_update(
+        self,
+        params: List[torch.Tensor],
+        lr: float,
+        lr_correct: float,
+        momentum: float,
+        weight_decay: float,
+    ) -> None:
+        data = [p.data for p in params]
+        grads = [p.grad.data for p in params]  # type: ignore
+        bufs = []
+        for p, d_p in zip(params, grads):
+            param_state = self.state[p]
+            if "momentum_buffer" not in param_state:
+                param_state["momentum_buffer"] = d_p.clone().zero_()
+            bufs.append(param_state["momentum_buffer"])
+        if weight_decay != 0:
+            torch._foreach_mul_(data, 1 - lr * weight_decay)
+        torch._foreach_add_(data, bufs, alpha=momentum * momentum * lr_correct)
+        torch._foreach_add_(data, grads, alpha=-(1 + momentum) * lr)
+        torch._foreach_mul_(bufs, momentum * lr_correct)
+        torch._foreach_add_(bufs, grads, alpha=-lr)
+
 
 @register_optimizer("madgrad")
 class MADGRAD(Optimizer):
@@ -70,9 +122,11 @@ class MADGRAD(Optimizer):
         momentum: float = 0.0,
         weight_decay: float = 0.0,
         eps: float = 1.0e-6,
+        foreach: bool = False,
     ):
         defaults = dict(lr=lr, eps=eps, momentum=momentum, weight_decay=weight_decay)
         super().__init__(params, defaults)
+        self.foreach = foreach
 
     def step(self, closure: Optional[Callable[[], float]] = None) -> Optional[float]:
         loss = None
@@ -92,6 +146,11 @@ class MADGRAD(Optimizer):
             ck = 1.0 - momentum
             lb = lr * math.sqrt(k + 1)
 
+            if self.foreach:
+                for params in _group_params(group["params"]):
+                    self._foreach_update(params, lr, lb, ck, eps, decay, momentum)
+                continue
+
             for p in group["params"]:
                 if p.grad is None:
                     continue
@@ -133,6 +192,52 @@ class MADGRAD(Optimizer):
         self.state["k"] += 1
         return loss
 
+    def _foreach_update(
+        self,
+        params: List[torch.Tensor],
+        lr: float,
+        lb: float,
+        ck: float,
+        eps: float,
+        decay: float,
+        momentum: float,
+    ) -> None:
+        data = [p.data for p in params]
+        grads = [p.grad.data for p in params]  # type: ignore
+        grad_sum_sq, s, x0 = [], [], []
+        for p in params:
+            state = self.state[p]
+            if "grad_sum_sq" not in state:
+                state["grad_sum_sq"] = torch.zeros_like(p.data).detach()
+                state["s"] = torch.zeros_like(p.data).detach()
+                if momentum != 0.0:
+                    state["x0"] = torch.clone(p.data).detach()
+            grad_sum_sq.append(state["grad_sum_sq"])
+            s.append(state["s"])
+            if momentum != 0.0:
+                x0.append(state["x0"])
+
+        if decay:
+            torch._foreach_mul_(data, 1.0 - lr * decay)
+
+        if momentum == 0.0:
+            rms = torch._foreach_pow(grad_sum_sq, 1.0 / 3.0)
+            torch._foreach_add_(rms, eps)
+            x0 = torch._foreach_addcdiv(data, s, rms, value=1.0)
+
+        torch._foreach_addcmul_(grad_sum_sq, grads, grads, value=lb)
+        rms = torch._foreach_pow(grad_sum_sq, 1.0 / 3.0)
+        torch._foreach_add_(rms, eps)
+
+        torch._foreach_add_(s, grads, alpha=lb)
+
+        z = torch._foreach_addcdiv(x0, s, rms, value=-1.0)
+        if momentum == 0.0:
+            torch._foreach_copy_(data, z)
+        else:
+            torch._foreach_mul_(data, 1.0 - ck)
+            torch._foreach_add_(data, z, alpha=ck)
+
 
 @register_optimizer("ranger")
 class Ranger(Optimizer):
@@ -148,6 +253,7 @@ class Ranger(Optimizer):
         weight_decay: float = 0.0,
         use_gc: bool = True,
         gc_conv_only: bool = False,
+        foreach: bool = False,
     ):
         defaults = dict(
             lr=lr,
@@ -166,6 +272,39 @@ class Ranger(Optimizer):
         self.radam_buffer: List[List[Any]] = [[None, None, None] for _ in range(10)]
         self.use_gc = use_gc
         self.gc_gradient_threshold = 3 if gc_conv_only else 1
+        self.foreach = foreach
+
+    def _get_step(self, p: torch.Tensor) -> int:
+        return self.state[p].get("step", 0)
+
+    def _get_step_size(
+        self,
+        step: int,
+        beta1: float,
+        beta2: float,
+    ) -> Tuple[float, float]:
+        buffered = self.radam_buffer[int(step % 10)]
+        if step == buffered[0]:
+            return buffered[1], buffered[2]
+        buffered[0] = step
+        beta2_t = beta2**step
+        n_sma_max = 2.0 / (1.0 - beta2) - 1.0
+        n_sma = n_sma_max - 2.0 * step * beta2_t / (1.0 - beta2_t)
+        buffered[1] = n_sma
+        if n_sma <= self.n_sma_threshold:
+            step_size = 1.0 / (1.0 - beta1**step)
+        else:
+            step_size = math.sqrt(
+                (1.0 - beta2_t)
+                * (n_sma - 4.0)
+                / (n_sma_max - 4.0)
+                * (n_sma - 2.0)
+                / n_sma
+                * n_sma_max
+                / (n_sma_max - 2.0)
+            ) / (1.0 - beta1**step)
+        buffered[2] = step_size
+        return n_sma, step_size
 
     def step(self, closure: Optional[Callable[[], float]] = None) -> Optional[float]:
         loss = None
@@ -173,6 +312,12 @@ class Ranger(Optimizer):
             loss = closure()
 
         for group in self.param_groups:
+            if self.foreach:
+                # parameters are also grouped by their steps, because
+                # step sizes & lookahead depend on them
+                for params in _group_params(group["params"], self._get_step):
+                    self._foreach_update(params, group)
+                continue
             for p in group["params"]:
                 if p.grad is None:
                     continue
@@ -249,5 +394,63 @@ class Ranger(Optimizer):
 
         return loss
 
+    def _foreach_update(
+        self, params: List[torch.Tensor], group: Dict[str, Any]
+    ) -> None:
+        data = [p.data for p in params]
+        is_fp32 = params[0].dtype == torch.float32
+        data_fp32 = data if is_fp32 else [d.float() for d in data]
+        grads = [p.grad.data.float() for p in params]  # type: ignore
+        exp_avg, exp_avg_sq, slow_buffer = [], [], []
+        for p, p_data_fp32 in zip(params, data_fp32):
+            state = self.state[p]
+            if len(state) != 0:
+                state["exp_avg"] = state["exp_avg"].type_as(p_data_fp32)
+                state["exp_avg_sq"] = state["exp_avg_sq"].type_as(p_data_fp32)
+            else:
+                state["step"] = 0
+                state["exp_avg"] = torch.zeros_like(p_data_fp32)
+                state["exp_avg_sq"] = torch.zeros_like(p_data_fp32)
+                state["slow_buffer"] = torch.empty_like(p.data)
+                state["slow_buffer"].copy_(p.data)
+            state["step"] += 1
+            exp_avg.append(state["exp_avg"])
+            exp_avg_sq.append(state["exp_avg_sq"])
+            slow_buffer.append(state["slow_buffer"])
+        beta1, beta2 = group["betas"]
+        step = self.state[params[0]]["step"]
+
+        # gradient centralization is a reduction over each tensor's own shape
+        for grad in grads:
+            if grad.dim() > self.gc_gradient_threshold:
+                grad.add_(-grad.mean(dim=tuple(range(1, grad.dim())), keepdim=True))
+
+        torch._foreach_mul_(exp_avg_sq, beta2)
+        torch._foreach_addcmul_(exp_avg_sq, grads, grads, value=1.0 - beta2)
+        torch._foreach_mul_(exp_avg, beta1)
+        torch._foreach_add_(exp_avg, grads, alpha=1.0 - beta1)
+
+        n_sma, step_size = self._get_step_size(step, beta1, beta2)
+
+        if group["weight_decay"] != 0:
+            alpha = -group["weight_decay"] * group["lr"]
+            torch._foreach_add_(data_fp32, data_fp32, alpha=alpha)
+
+        if n_sma <= self.n_sma_threshold:
+            torch._foreach_add_(data_fp32, exp_avg, alpha=-step_size * group["lr"])
+        else:
+            denom = torch._foreach_sqrt(exp_avg_sq)
+            torch._foreach_add_(denom, group["eps"])
+            value = -step_size * group["lr"]
+            torch._foreach_addcdiv_(data_fp32, exp_avg, denom, value=value)
+
+        if not is_fp32:
+            torch._foreach_copy_(data, data_fp32)
+
+        if step % group["k"] == 0:
+            diff = torch._foreach_sub(data, slow_buffer)
+            torch._foreach_add_(slow_buffer, diff, alpha=self.alpha)
+            torch._foreach_copy_(data, slow_buffer)
+
 
 __all__ = ["optimizer_dict", "register_optimizer"]
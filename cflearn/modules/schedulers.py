@@ -128,6 +128,21 @@ class WarmupScheduler(_LRScheduler):
             return super().get_last_lr()  # type: ignore
         return self.scheduler_afterwards.get_last_lr()  # type: ignore
 
+    def state_dict(self) -> Dict[str, Any]:
+        state_dict = {
+            key: value
+            for key, value in self.__dict__.items()
+            if key not in ("optimizer", "scheduler_afterwards")
+        }
+        state_dict["scheduler_afterwards"] = self.scheduler_afterwards.state_dict()
+        return state_dict
+
+    def load_state_dict(self, state_dict: Dict[str, Any]) -> None:
+        state_dict = dict(state_dict)
+        afterwards_state_dict = state_dict.pop("scheduler_afterwards")
+        self.__dict__.update(state_dict)
+        self.scheduler_afterwards.load_state_dict(afterwards_state_dict)
+
     def step(self, metrics: Optional[float] = None) -> None:
         if not self.finished_warmup or self.scheduler_afterwards is None:
             return super().step()
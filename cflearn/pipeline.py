@@ -40,7 +40,11 @@ from .misc._api import _fetch_saving_paths
 from .misc.toolkit import to_2d
 from .misc.toolkit import to_relative
 from .misc.toolkit import eval_context
+from .misc.toolkit import memory_summary
+from .misc.toolkit import get_random_states
+from .misc.toolkit import set_random_states
 from .misc.toolkit import LoggingMixinWithRank
+from .misc.telemetry import rss_mb
 from .misc.time_series import TSLabelCollator
 from .models.base import model_dict
 from .models.base import ModelBase
@@ -63,6 +67,24 @@ class Pipeline(LoggingMixinWithRank):
     custom_fit: Optional[fit_type] = None
     custom_predict: Optional[predict_type] = None
     config_bundle_name = "config_bundle"
+    # attributes built by `_before_loop` which only depend on the data
+    shared_data_keys = [
+        "sample_weights",
+        "_original_data",
+        "_save_original_data",
+        "tr_data",
+        "cv_data",
+        "tr_weights",
+        "cv_weights",
+        "tr_split_indices",
+        "cv_split_indices",
+        "ts_label_collator",
+        "preprocessor",
+        "batch_size",
+        "tr_loader",
+        "cv_loader",
+        "tr_loader_copy",
+    ]
 
     def __init__(self, environment: Environment):
         # typing
@@ -83,8 +105,12 @@ class Pipeline(LoggingMixinWithRank):
         self.data_config["use_timing_context"] = self.timing
         self.data_config["default_categorical_process"] = "identical"
         self.sampler_config = self.config.setdefault("sampler_config", {})
+        self.memory_stages: Dict[str, float] = {}
 
     def __getattr__(self, item: str) -> Any:
+        # attributes are not ready yet when unpickling
+        if item.startswith("__") or "environment" not in self.__dict__:
+            raise AttributeError(item)
         return self.environment.config.get(item)
 
     def __str__(self) -> str:
@@ -227,10 +253,27 @@ class Pipeline(LoggingMixinWithRank):
                 self.environment,
                 is_loading,
             )
+            # `trial` may be injected after the pipeline is created (e.g. in hpo)
+            if self.trial is not None:
+                self.trainer.trial = self.trial
         # to device
         with timing_context(self, "init device", enable=self.timing):
             self.model.to(self.device)
 
+    def _prepare_logging(self, is_resuming: bool = False) -> None:
+        if not is_resuming and os.path.isdir(self.logging_folder):
+            if os.listdir(self.logging_folder):
+                print(
+                    f"{self.warning_prefix}'{self.logging_folder}' already exists, "
+                    "it will be cleared up to store our logging"
+                )
+            shutil.rmtree(self.logging_folder)
+        os.makedirs(self.logging_folder, exist_ok=True)
+        self._init_logging(self.verbose_level, self.trigger_logging)
+        self.memory_stages = {}
+        self._record_memory("start")
+        self.data_config["trigger_logging"] = self.trigger_logging
+
     def _before_loop(
         self,
         x: data_type,
@@ -238,18 +281,11 @@ class Pipeline(LoggingMixinWithRank):
         x_cv: data_type,
         y_cv: data_type,
         sample_weights: Optional[np.ndarray],
+        *,
+        is_resuming: bool = False,
     ) -> None:
         # logging
-        if os.path.isdir(self.logging_folder):
-            if os.listdir(self.logging_folder):
-                print(
-                    f"{self.warning_prefix}'{self.logging_folder}' already exists, "
-                    "it will be cleared up to store our logging"
-                )
-            shutil.rmtree(self.logging_folder)
-        os.makedirs(self.logging_folder)
-        self._init_logging(self.verbose_level, self.trigger_logging)
-        self.data_config["trigger_logging"] = self.trigger_logging
+        self._prepare_logging(is_resuming)
         # data
         y, y_cv = map(to_2d, [y, y_cv])
         args = (x, y) if y is not None else (x,)
@@ -259,6 +295,7 @@ class Pipeline(LoggingMixinWithRank):
             self.sample_weights = sample_weights.copy()
         self._original_data = DataProtocol.make(self.data_protocol, **self.data_config)
         self._original_data.read(*args, **self.read_config)
+        self._record_memory("read data")
         self.tr_data = self._original_data
         self._save_original_data = x_cv is None
         self.tr_weights = self.cv_weights = None
@@ -283,15 +320,72 @@ class Pipeline(LoggingMixinWithRank):
                 if sample_weights is not None:
                     self.tr_weights = sample_weights[split.remained_indices]
                     self.cv_weights = sample_weights[split.split_indices]
+        self._record_memory("split data")
         # deep speed
         self.set_rank_0(self.environment.is_rank_0)
         # data
         self._init_data()
+        self._record_memory("init data")
         # modules
         self._prepare_modules()
+        self._record_memory("prepare modules")
         # deep speed
         self.set_rank_0(self.is_rank_0)
 
+    def _share_data(self, source: "Pipeline") -> None:
+        """
+        Uses the data, preprocessor & loaders of a prepared `source` pipeline
+        instead of reading & processing the data again (see `fit_population`)
+
+        """
+
+        self._prepare_logging()
+        for key in self.shared_data_keys:
+            if key in source.__dict__:
+                setattr(self, key, source.__dict__[key])
+        if "lr_ratio" in source.config:
+            self.config["lr_ratio"] = source.config["lr_ratio"]
+        self._record_memory("share data")
+        self.set_rank_0(self.environment.is_rank_0)
+        self._prepare_modules()
+        self._record_memory("prepare modules")
+        self.set_rank_0(self.is_rank_0)
+
+    def _record_memory(self, stage: str) -> None:
+        rss = self.memory_stages[stage] = rss_mb()
+        self.log_msg(f"rss after '{stage}' : {rss:.2f} MB", self.info_prefix, 4)
+
+    def memory_summary(self, *, return_only: bool = False) -> str:
+        """
+        Reports process rss at each stage of `_before_loop`, and the memory
+        usage of each module of the model (see `cflearn.misc.toolkit.memory_summary`)
+
+        """
+
+        if self.model is None:
+            raise ValueError("`model` is not generated yet")
+        messages = ["=" * 128, f"{'Stage':50}  {'RSS (MB)':>14}", "-" * 128]
+        for stage, rss in self.memory_stages.items():
+            messages.append(f"{stage:50}  {rss:>14.2f}")
+        loader = self.trainer.tr_loader_copy or PrefetchLoader(
+            self.tr_loader_copy,
+            self.device,
+        )
+        next_item = next(iter(loader))
+        sample_batch = next_item[0] if isinstance(next_item, tuple) else next_item
+        messages.append(
+            memory_summary(
+                self.model,
+                sample_batch,
+                self.trainer.optimizers.values(),
+                return_only=True,
+            )
+        )
+        msg = "\n".join(messages)
+        if not return_only:
+            print(msg)
+        return msg
+
     def _handle_pretrain(
         self,
         strict: bool,
@@ -312,8 +406,7 @@ class Pipeline(LoggingMixinWithRank):
             with Saving.compress_loader(path, compress):
                 self.trainer.restore_checkpoint(path, strict, state_dict_callback)
 
-    def _loop(self) -> None:
-        # dump information
+    def _dump_information(self) -> None:
         logging_folder = self.logging_folder
         os.makedirs(logging_folder, exist_ok=True)
         if self.is_rank_0:
@@ -322,15 +415,22 @@ class Pipeline(LoggingMixinWithRank):
             Saving.save_dict(self.config, "__config__", logging_folder)
             with open(os.path.join(logging_folder, "__model__.txt"), "w") as f:
                 f.write(str(self.model))
-        # training loop
+
+    def _after_loop(self) -> None:
+        self._record_memory("fit")
+        self.log_timing()
+
+    def _loop(self, training_state: Optional[Dict[str, Any]] = None) -> None:
+        self._dump_information()
         self.trainer.fit(
             self.tr_loader,
             self.tr_loader_copy,
             self.cv_loader,
             self.tr_weights,
             self.cv_weights,
+            training_state=training_state,
         )
-        self.log_timing()
+        self._after_loop()
 
     @staticmethod
     def _rectangle(
@@ -553,19 +653,41 @@ class Pipeline(LoggingMixinWithRank):
         pretrain_identifier: Optional[str] = None,
         state_dict_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
         sample_weights: Optional[np.ndarray] = None,
+        resume_from: Optional[str] = None,
     ) -> "Pipeline":
         if self.custom_fit is not None:
             self.custom_fit(self, x, y, x_cv, y_cv, sample_weights)  # type: ignore
             return self
-        self._before_loop(x, y, x_cv, y_cv, sample_weights)
+        # resuming should also replay the data splitting & model initialization
+        training_state = None
+        if resume_from is None:
+            initial_random_states = get_random_states()
+        else:
+            training_state = Trainer.load_training_state(resume_from)
+            initial_random_states = training_state["initial_random_states"]
+            if initial_random_states is not None:
+                set_random_states(initial_random_states)
+            self.environment.trainer_config["resumable"] = True
+        self._before_loop(
+            x,
+            y,
+            x_cv,
+            y_cv,
+            sample_weights,
+            is_resuming=training_state is not None,
+        )
+        self.trainer.initial_random_states = initial_random_states
         self._handle_pretrain(
             pretrain_strict,
             pretrain_folder,
             pretrain_identifier,
             state_dict_callback,
         )
-        self._loop()
-        # finalize mlflow
+        self._loop(training_state)
+        self._finalize_mlflow()
+        return self
+
+    def _finalize_mlflow(self) -> None:
         run_id = self.trainer.run_id
         mlflow_client = self.trainer.mlflow_client
         if mlflow_client is not None:
@@ -608,7 +730,6 @@ class Pipeline(LoggingMixinWithRank):
             self.trainer._log_artifacts()
             # terminate
             mlflow_client.set_terminated(run_id)
-        return self
 
     def predict(
         self,
@@ -870,6 +991,45 @@ class Pipeline(LoggingMixinWithRank):
         print(prof.key_averages().table(sort_by="self_cpu_time_total"))
         self.model.to(self.device)
 
+    def profile_fit(
+        self,
+        x: data_type,
+        y: data_type = None,
+        x_cv: data_type = None,
+        y_cv: data_type = None,
+        *,
+        num_steps: int = 10,
+        num_warmup: int = 2,
+        sample_weights: Optional[np.ndarray] = None,
+        **kwargs: Any,
+    ) -> "Pipeline":
+        """
+        Runs `num_steps` real training steps (data loading, forward, backward,
+        optimizer, monitor, ...) under torch profiler and stops training
+        * the chrome trace (`trace.json`, which can be opened in `chrome://tracing`
+        or perfetto) and the operator table (`operators.txt`) will be exported
+        to `{logging_folder}/profiler`
+        * `kwargs` will be passed to `torch.profiler.profile`
+
+        """
+
+        trainer_config = self.environment.trainer_config
+        trainer_config["profiler_config"] = {
+            "num_wait": 0,
+            "num_warmup": num_warmup,
+            "num_active": num_steps,
+            "stop_after": True,
+            "profiler_kwargs": kwargs,
+        }
+        try:
+            self.fit(x, y, x_cv, y_cv, sample_weights=sample_weights)
+        finally:
+            trainer_config.pop("profiler_config")
+        operators_path = os.path.join(self.trainer.profiler_folder, "operators.txt")
+        with open(operators_path, "r") as f:
+            print(f.read())
+        return self
+
 
 class ExternalPipelineProtocol(ABC):
     @abstractmethod
@@ -0,0 +1,461 @@
+import torch
+import random
+import logging
+
+import numpy as np
+
+from typing import *
+from cftool.misc import shallow_copy_dict
+from cftool.misc import LoggingMixin
+
+try:
+    from torch.func import vmap
+    from torch.func import functional_call
+    from torch.func import stack_module_state
+
+    has_torch_func = True
+except ImportError:  # torch<2.0
+    has_torch_func = False
+
+from .types import data_type
+from .types import tensor_dict_type
+from .trainer import Trainer
+from .pipeline import Pipeline
+from .protocol import StepOutputs
+from .protocol import ModelProtocol
+from .protocol import DataLoaderProtocol
+from .misc.toolkit import get_random_states
+
+
+class StackedReplicas(LoggingMixin):
+    """
+    Stacks the parameters & buffers of replicas (which share the same training
+    batches) along a leading dimension, so their forward & backward passes can be
+    performed in a single vectorized (`torch.func.vmap`) pass
+
+    * parameters & buffers of each replica become views of the stacked tensors,
+    so optimizers, schedulers & monitors of each `Trainer` work as usual, and the
+    gradients of the stacked pass are handed to them as views as well
+    * dropout masks are drawn independently for each replica
+    * forward passes of all replicas will use the `TrainerState` of the first one,
+    which is identical to the others' because they are stepped in lockstep
+    * use `StackedReplicas.make` to construct it, which returns None if the
+    replicas cannot be stacked, and `release` to split the replicas back into
+    independent models after training
+
+    Parameters
+    ----------
+    trainers : List[Trainer], the replicas, which should have been prepared
+    (see `Trainer._before_fit`)
+
+    """
+
+    def __init__(self, trainers: List[Trainer]):
+        self.trainers = trainers
+        self.models = [trainer.model for trainer in trainers]
+        params, buffers = stack_module_state(self.models)
+        self.params: tensor_dict_type = params
+        self.buffers: tensor_dict_type = buffers
+        for i, model in enumerate(self.models):
+            for key, param in model.named_parameters():
+                param.data = self.params[key].data[i]
+            for key, buffer in model.named_buffers():
+                buffer.data = self.buffers[key].data[i]
+        self.enabled = True
+        self.verified = False
+
+    @classmethod
+    def make(cls, trainers: List[Trainer]) -> Optional["StackedReplicas"]:
+        if len(trainers) < 2 or not has_torch_func:
+            return None
+        if any(not cls._is_stackable(trainer) for trainer in trainers):
+            return None
+        models = [trainer.model for trainer in trainers]
+        if len(set(type(model) for model in models)) > 1:
+            return None
+        if len(set(trainer.device for trainer in trainers)) > 1:
+            return None
+        signatures = [cls._signature(model) for model in models]
+        if any(signature != signatures[0] for signature in signatures[1:]):
+            return None
+        return cls(trainers)
+
+    @staticmethod
+    def _signature(model: ModelProtocol) -> List[Tuple[str, torch.Size, Any]]:
+        tensors = list(model.named_parameters()) + list(model.named_buffers())
+        return [(key, tensor.shape, tensor.dtype) for key, tensor in tensors]
+
+    @staticmethod
+    def _is_stackable(trainer: Trainer) -> bool:
+        model = trainer.model
+        if trainer.ddp or trainer.use_amp or trainer.state.num_accumulate > 1:
+            return False
+        # customized `step`s cannot be vectorized generically
+        if type(model).step is not ModelProtocol.step:
+            return False
+        # tied parameters cannot be stacked
+        num_params = len(list(model.named_parameters(remove_duplicate=False)))
+        if num_params != len(list(model.parameters())):
+            return False
+        # losses are calculated outside `functional_call`, so they should be stateless
+        loss = getattr(model, "loss", None)
+        if isinstance(loss, torch.nn.Module):
+            if any(True for _ in loss.parameters()):
+                return False
+            if any(True for _ in loss.buffers()):
+                return False
+        return True
+
+    def step(
+        self,
+        indices: List[int],
+        batch_idx: int,
+        batch: tensor_dict_type,
+        batch_indices: Optional[torch.Tensor],
+    ) -> Optional[List[StepOutputs]]:
+        """
+        Performs the forward & backward passes of the replicas at `indices`
+        (positions in `trainers`), and returns their `StepOutputs`
+
+        * the gradients will be assigned to the parameters of each replica
+        * if the first vectorized pass fails (e.g. the model has data dependent
+        control flows), a warning will be printed, the stacking will be disabled
+        and None will be returned, so the replicas can be stepped one by one
+
+        """
+
+        snapshot = None
+        if not self.verified:
+            snapshot = {k: v.clone() for k, v in self.buffers.items()}
+        try:
+            outputs = self._step(indices, batch_idx, batch, batch_indices)
+        except Exception as err:
+            if snapshot is None:
+                raise
+            with torch.no_grad():
+                for k, v in snapshot.items():
+                    self.buffers[k].copy_(v)
+            for param in self.params.values():
+                param.grad = None
+            self.enabled = False
+            self.log_msg(  # type: ignore
+                f"failed to vectorize the replicas ({err}), "
+                "they will be stepped one by one",
+                self.warning_prefix,
+                msg_level=logging.WARNING,
+            )
+            return None
+        self.verified = True
+        return outputs
+
+    def _step(
+        self,
+        indices: List[int],
+        batch_idx: int,
+        batch: tensor_dict_type,
+        batch_indices: Optional[torch.Tensor],
+    ) -> List[StepOutputs]:
+        model = self.models[indices[0]]
+        state = self.trainers[indices[0]].state
+        full = len(indices) == len(self.trainers)
+        params, buffers = self.params, self.buffers
+        if not full:
+            positions = torch.tensor(indices, device=self.trainers[0].device)
+            params = {k: v[positions] for k, v in params.items()}
+            buffers = {k: v[positions] for k, v in buffers.items()}
+
+        def _forward(
+            params_: tensor_dict_type,
+            buffers_: tensor_dict_type,
+        ) -> Tuple[tensor_dict_type, tensor_dict_type]:
+            args = batch, batch_idx, state, batch_indices, "tr"
+            forward = functional_call(model, (params_, buffers_), args)
+            losses = model.loss_function(
+                batch_idx,
+                batch,
+                batch_indices,
+                forward,
+                state,
+            )
+            # only tensors can be returned from `vmap`
+            forward = {k: v for k, v in forward.items() if torch.is_tensor(v)}
+            return forward, losses
+
+        vectorized = vmap(_forward, randomness="different")
+        forward_results, loss_dict = vectorized(params, buffers)
+        loss_dict["loss"].sum().backward()
+        with torch.no_grad():
+            if not full:
+                for k, v in buffers.items():
+                    self.buffers[k][positions] = v
+            for i in indices:
+                for key, param in self.models[i].named_parameters():
+                    grad = self.params[key].grad
+                    param.grad = None if grad is None else grad[i]
+            for stacked in self.params.values():
+                stacked.grad = None
+        loss_dict = {k: v.detach() for k, v in loss_dict.items()}
+        loss_items = {k: v.tolist() for k, v in loss_dict.items()}
+        forward_results = {k: v.detach() for k, v in forward_results.items()}
+        outputs = []
+        for i in range(len(indices)):
+            outputs.append(
+                StepOutputs(
+                    {k: v[i] for k, v in forward_results.items()},
+                    {k: v[i] for k, v in loss_dict.items()},
+                    {k: v[i] for k, v in loss_items.items()},
+                )
+            )
+        return outputs
+
+    def release(self) -> None:
+        """splits the replicas back into independent models"""
+        for model in self.models:
+            for param in model.parameters():
+                param.data = param.data.clone()
+            for buffer in model.buffers():
+                buffer.data = buffer.data.clone()
+        self.params = {}
+        self.buffers = {}
+
+
+class PopulationTrainer(LoggingMixin):
+    """
+    Trains a population of `Trainer`s in lockstep, in current process
+
+    * replicas which share the same training loader are fed with the same batches,
+    and each batch is fetched (and moved to the device) only once. Replicas with
+    their own loaders (e.g. bootstrap views, see `fit_population`) are stepped
+    in lockstep as well
+    * each replica keeps its own optimizers, schedulers & monitor, so early
+    stopping is independent: a replica which terminates leaves the population,
+    while the others keep training
+    * if `vectorize` is True, replicas which share the same training loader will
+    be stacked (see `StackedReplicas`) and their forward & backward passes will
+    be performed in a single vectorized pass. Replicas which cannot be stacked
+    (e.g. they use amp, accumulate gradients or have customized `step`s) will
+    fall back to be stepped one by one
+
+    Parameters
+    ----------
+    trainers : List[Trainer], the replicas
+    vectorize : Optional[bool], whether to stack the replicas when possible
+    * if None, replicas will only be stacked when they are on cuda, because on cpu
+    the batched kernels are not faster than stepping the replicas one by one
+
+    """
+
+    def __init__(self, trainers: List[Trainer], *, vectorize: Optional[bool] = None):
+        for trainer in trainers:
+            if trainer.ddp:
+                raise ValueError("population training does not support ddp")
+        self.trainers = trainers
+        self.vectorize = vectorize
+        self.stacked: Dict[int, StackedReplicas] = {}
+
+    def fit(
+        self,
+        tr_loaders: List[DataLoaderProtocol],
+        tr_loader_copy: DataLoaderProtocol,
+        cv_loader: Optional[DataLoaderProtocol],
+        tr_weights: Optional[np.ndarray],
+        cv_weights: Optional[np.ndarray],
+    ) -> None:
+        if len(tr_loaders) != len(self.trainers):
+            raise ValueError(
+                f"{len(tr_loaders)} loaders are provided "
+                f"but there are {len(self.trainers)} trainers"
+            )
+        groups: Dict[int, List[int]] = {}
+        # resources of the replicas which have started should always be released
+        started: List[Trainer] = []
+        try:
+            for i, (trainer, tr_loader) in enumerate(zip(self.trainers, tr_loaders)):
+                groups.setdefault(id(tr_loader), []).append(i)
+                trainer._before_fit(
+                    tr_loader,
+                    tr_loader_copy,
+                    cv_loader,
+                    tr_weights,
+                    cv_weights,
+                )
+                started.append(trainer)
+            for key, group in groups.items():
+                replicas = [self.trainers[i] for i in group]
+                vectorize = self.vectorize
+                if vectorize is None:
+                    vectorize = all(t.device.type == "cuda" for t in replicas)
+                if vectorize:
+                    stacked = StackedReplicas.make(replicas)
+                    if stacked is not None:
+                        self.stacked[key] = stacked
+            self._loop(groups)
+            for trainer in self.trainers:
+                trainer._after_fit()
+        finally:
+            for stacked in self.stacked.values():
+                stacked.release()
+            self.stacked = {}
+            for trainer in started:
+                trainer._shutdown_async_monitor()
+                trainer._close_mlflow_logger()
+
+    def _loop(self, groups: Dict[int, List[int]]) -> None:
+        active = set(range(len(self.trainers)))
+        while True:
+            active = {i for i in active if self.trainers[i].state.should_train}
+            if not active:
+                break
+            for i in active:
+                self.trainers[i].state.epoch += 1
+            streams = []
+            for key, group in groups.items():
+                replicas = [i for i in group if i in active]
+                if replicas:
+                    loader = self.trainers[replicas[0]].tr_loader
+                    streams.append((iter(loader), key, replicas))
+            terminated: Set[int] = set()
+            try:
+                batch_idx = 0
+                while streams:
+                    for stream in list(streams):
+                        iterator, key, replicas = stream
+                        item = next(iterator, None)
+                        if item is None:
+                            streams.remove(stream)
+                            continue
+                        batch, batch_indices = item
+                        alive = [i for i in replicas if i not in terminated]
+                        stacked_args = key, alive, batch_idx, batch, batch_indices
+                        outputs = self._stacked_step(*stacked_args)
+                        for j, i in enumerate(alive):
+                            # models may modify the batch in-place (e.g. siamese)
+                            args = batch_idx, shallow_copy_dict(batch), batch_indices
+                            step_outputs = None if outputs is None else outputs[j]
+                            if self.trainers[i]._train_step(*args, step_outputs):
+                                terminated.add(i)
+                        if all(i in terminated for i in replicas):
+                            streams.remove(stream)
+                    batch_idx += 1
+            except KeyboardInterrupt:
+                self.log_msg(  # type: ignore
+                    "keyboard interrupted",
+                    self.error_prefix,
+                    msg_level=logging.ERROR,
+                )
+                terminated.update(active)
+            active -= terminated
+            for i in sorted(active):
+                self.trainers[i]._end_epoch()
+
+    def _stacked_step(
+        self,
+        key: int,
+        replicas: List[int],
+        batch_idx: int,
+        batch: tensor_dict_type,
+        batch_indices: Optional[torch.Tensor],
+    ) -> Optional[List[StepOutputs]]:
+        stacked = self.stacked.get(key)
+        if stacked is None or not stacked.enabled or len(replicas) < 2:
+            return None
+        group = [self.trainers[i] for i in replicas]
+        indices = [stacked.trainers.index(trainer) for trainer in group]
+        return stacked.step(indices, batch_idx, shallow_copy_dict(batch), batch_indices)
+
+
+def _seed(seed: int) -> None:
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+
+def fit_population(
+    pipelines: List[Pipeline],
+    x: data_type,
+    y: data_type = None,
+    x_cv: data_type = None,
+    y_cv: data_type = None,
+    *,
+    sample_weights: Optional[np.ndarray] = None,
+    seeds: Optional[List[int]] = None,
+    bootstrap: bool = False,
+    vectorize: Optional[bool] = None,
+) -> List[Pipeline]:
+    """
+    Trains `pipelines` (replicas of the same model) as a population
+
+    * the data is read & processed only once (by the first pipeline), and then
+    shared by all pipelines
+    * the replicas are trained in lockstep (see `PopulationTrainer`), and each of
+    them is still a complete `Pipeline` which can be saved / loaded separately
+    * if `seeds` are provided, each replica will be initialized with its own seed,
+    otherwise they are initialized one after another from current random states
+    * replicas share the cv split and the batch order of the first pipeline, so
+    they only differ in their initializations (unless `bootstrap` is True)
+    * if `bootstrap` is True, each replica will be trained on its own bootstrap
+    sample (drawn with replacement) of the training set. The samples are index
+    views over the shared data, and they replace the (imbalance) sampling of the
+    training loader, in which case a warning will be printed
+    * if `vectorize` is True, replicas will be stacked and trained in a single
+    vectorized pass when possible (see `StackedReplicas`). Since each replica
+    needs the same batches, this only applies when `bootstrap` is False. If None,
+    it will be True only on cuda (see `PopulationTrainer`)
+
+    """
+
+    if not pipelines:
+        return pipelines
+    if seeds is not None and len(seeds) != len(pipelines):
+        raise ValueError(
+            f"{len(seeds)} seeds are provided "
+            f"but there are {len(pipelines)} pipelines"
+        )
+    for pipeline in pipelines:
+        if pipeline.custom_fit is not None:
+            msg = "population training does not support `custom_fit`"
+            raise ValueError(msg)
+    source = pipelines[0]
+    for i, pipeline in enumerate(pipelines):
+        if seeds is not None:
+            _seed(seeds[i])
+        if i > 0:
+            pipeline._share_data(source)
+        else:
+            initial_random_states = get_random_states()
+            pipeline._before_loop(x, y, x_cv, y_cv, sample_weights)
+            pipeline.trainer.initial_random_states = initial_random_states
+        pipeline._dump_information()
+    if bootstrap:
+        if source.tr_data.is_ts:
+            raise ValueError("`bootstrap` is not supported for time series data")
+        tr_loader = source.tr_loader
+        if getattr(tr_loader.sampler, "is_imbalance", False):
+            print(
+                f"{LoggingMixin.warning_prefix}imbalance sampling (or `sample_weights`) "
+                "of the training loader will be replaced by bootstrap sampling"
+            )
+        num_samples = tr_loader.num_samples
+        for i, pipeline in enumerate(pipelines):
+            random_state = np.random.RandomState(None if seeds is None else seeds[i])
+            indices = random_state.randint(0, num_samples, num_samples)
+            pipeline.tr_loader = tr_loader.subset(indices, shuffle=True)
+    trainers = [pipeline.trainer for pipeline in pipelines]
+    PopulationTrainer(trainers, vectorize=vectorize).fit(
+        [pipeline.tr_loader for pipeline in pipelines],
+        source.tr_loader_copy,
+        source.cv_loader,
+        source.tr_weights,
+        source.cv_weights,
+    )
+    for pipeline in pipelines:
+        pipeline._after_loop()
+        pipeline._finalize_mlflow()
+    return pipelines
+
+
+__all__ = [
+    "StackedReplicas",
+    "PopulationTrainer",
+    "fit_population",
+]
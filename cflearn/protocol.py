@@ -8,6 +8,7 @@ import logging
 import numpy as np
 import datatable as dt
 import torch.nn as nn
+import torch.nn.functional as F
 
 from abc import abstractmethod
 from abc import ABC
@@ -24,6 +25,7 @@ from typing import Optional
 from typing import NamedTuple
 from functools import partial
 from tqdm.autonotebook import tqdm
+from torch.profiler import record_function
 from cftool.ml import Metrics
 from cftool.misc import register_core
 from cftool.misc import timing_context
@@ -43,8 +45,12 @@ from .misc.toolkit import to_prob
 from .misc.toolkit import is_float
 from .misc.toolkit import to_numpy
 from .misc.toolkit import to_torch
+from .misc.toolkit import amp_context
 from .misc.toolkit import eval_context
+from .misc.toolkit import to_full_precision
+from .misc.toolkit import full_precision_context
 from .misc.toolkit import LoggingMixinWithRank
+from .misc.metrics import ProbabilityHistogram
 from .modules.blocks import EMA
 
 data_dict: Dict[str, Type["DataProtocol"]] = {}
@@ -264,6 +270,23 @@ class DataLoaderProtocol(ABC):
     def copy(self) -> "DataLoaderProtocol":
         pass
 
+    def state_dict(self) -> Dict[str, Any]:
+        msg = f"`state_dict` is not implemented for '{type(self).__name__}'"
+        raise NotImplementedError(msg)
+
+    def load_state_dict(self, state_dict: Dict[str, Any]) -> None:
+        msg = f"`load_state_dict` is not implemented for '{type(self).__name__}'"
+        raise NotImplementedError(msg)
+
+    def subset(
+        self,
+        indices: np.ndarray,
+        *,
+        shuffle: bool = False,
+    ) -> "DataLoaderProtocol":
+        msg = f"`subset` is not implemented for '{type(self).__name__}'"
+        raise NotImplementedError(msg)
+
     @property
     def num_samples(self) -> int:
         return len(self.data)
@@ -307,11 +330,15 @@ class PrefetchLoader:
         self.next_batch_indices: Optional[torch.Tensor]
         self.stop_at_next_batch = False
         self.batch_size = loader.batch_size
+        self._resumed_state: Optional[Dict[str, Any]] = None
 
     def __len__(self) -> int:
         return len(self.loader)
 
     def __iter__(self) -> "PrefetchLoader":
+        if self._resumed_state is not None:
+            self._resume()
+            return self
         self.stop_at_next_batch = False
         self.loader.__iter__()
         self.preload()
@@ -320,12 +347,14 @@ class PrefetchLoader:
     def __next__(self) -> prefetch_batch_type:
         if self.stop_at_next_batch:
             raise StopIteration
-        if self.use_stream:
-            torch.cuda.current_stream(self.device).wait_stream(self.stream)
-        if not self.enable_prefetch and not self.is_cpu:
-            self._to_device(self.next_batch_indices)
+        with record_function("PrefetchLoader.wait"):
+            if self.use_stream:
+                torch.cuda.current_stream(self.device).wait_stream(self.stream)
+            if not self.enable_prefetch and not self.is_cpu:
+                self._to_device(self.next_batch_indices)
         batch, batch_indices = self.next_batch, self.next_batch_indices
-        self.preload()
+        with record_function("PrefetchLoader.preload"):
+            self.preload()
         return batch, batch_indices
 
     def _to_device(self, indices_tensor: Optional[torch.Tensor]) -> None:
@@ -367,6 +396,32 @@ class PrefetchLoader:
             with torch.cuda.stream(self.stream):
                 self._to_device(indices_tensor)
 
+    # the underlying loader is always one batch ahead because of `preload`,
+    #  so the preloaded batch is stored as well
+    def state_dict(self) -> Dict[str, Any]:
+        return {
+            "loader": self.loader.state_dict(),
+            "next_batch": self.next_batch,
+            "next_batch_indices": self.next_batch_indices,
+            "stop_at_next_batch": self.stop_at_next_batch,
+        }
+
+    # the state will be applied in the next `__iter__` call
+    def load_state_dict(self, state_dict: Dict[str, Any]) -> None:
+        self._resumed_state = state_dict
+
+    def _resume(self) -> None:
+        state_dict, self._resumed_state = self._resumed_state, None
+        assert state_dict is not None
+        self.loader.load_state_dict(state_dict["loader"])
+        self.stop_at_next_batch = state_dict["stop_at_next_batch"]
+        self.next_batch = state_dict["next_batch"]
+        indices_tensor = state_dict["next_batch_indices"]
+        if self.is_cpu or not self.enable_prefetch:
+            self.next_batch_indices = indices_tensor
+        else:
+            self._to_device(indices_tensor)
+
     @property
     def is_cpu(self) -> bool:
         if self.is_onnx:
@@ -404,14 +459,46 @@ class TrainerState:
         self.num_snapshot_per_epoch = int(num_snapshot_per_epoch)
         self.max_step_per_snapshot = int(max_step_per_snapshot)
         self.plateau_start = int(plateau_start)
+        # `step` counts optimizer updates, each of which consumes
+        # `num_accumulate` micro-batches (except the last one of each epoch)
+        num_accumulate = self.config.setdefault("accumulate_grad_batches", 1)
+        self.num_accumulate = int(num_accumulate)
+        if self.num_accumulate < 1:
+            raise ValueError("`accumulate_grad_batches` should be positive")
 
     def inject_loader(self, loader: DataLoaderProtocol) -> None:
-        self.batch_size = loader.batch_size
-        self.num_step_per_epoch = len(loader)
+        self.num_batch_per_epoch = len(loader)
+        self.batch_size = loader.batch_size * self.num_accumulate
+        self.num_step_per_epoch = math.ceil(len(loader) / self.num_accumulate)
+
+    def accumulation_info(self, batch_idx: int) -> Tuple[int, bool]:
+        """
+        Returns the number of micro-batches which contribute to the optimizer
+        update that the `batch_idx`-th batch (of current epoch) belongs to, and
+        whether this batch is the last one of them
+
+        """
+        start_idx = batch_idx - batch_idx % self.num_accumulate
+        num_accumulate = min(self.num_accumulate, self.num_batch_per_epoch - start_idx)
+        return num_accumulate, batch_idx == start_idx + num_accumulate - 1
 
     def set_terminate(self) -> None:
         self.step = self.epoch = -1
 
+    def state_dict(self) -> Dict[str, Any]:
+        return {
+            "step": self.step,
+            "epoch": self.epoch,
+            "min_epoch": self.min_epoch,
+            "num_epoch": self.num_epoch,
+            "max_epoch": self.max_epoch,
+            "plateau_start": self.plateau_start,
+        }
+
+    def load_state_dict(self, state_dict: Dict[str, Any]) -> None:
+        for key, value in state_dict.items():
+            setattr(self, key, value)
+
     @property
     def is_terminate(self) -> bool:
         return self.epoch == -1
@@ -651,13 +738,15 @@ class ModelProtocol(nn.Module, LoggingMixinWithRank, metaclass=ABCMeta):
             args = batch, batch_idx, state, batch_indices, loader_name
             forward_results = (engine or self)(*args)
         with timing_context(self, "loss.forward", enable=self.timing):
-            loss_dict = self.loss_function(
-                batch_idx,
-                batch,
-                batch_indices,
-                forward_results,
-                state,
-            )
+            # losses are always calculated in full precision
+            with full_precision_context(self.device):
+                loss_dict = self.loss_function(
+                    batch_idx,
+                    batch,
+                    batch_indices,
+                    to_full_precision(forward_results),
+                    state,
+                )
         with timing_context(self, "loss.to_item", enable=self.timing):
             loss_items = {k: v.item() for k, v in loss_dict.items()}
         return StepOutputs(forward_results, loss_dict, loss_items)
@@ -701,6 +790,57 @@ class ModelProtocol(nn.Module, LoggingMixinWithRank, metaclass=ABCMeta):
         pass
 
 
+class ArrayAccumulator:
+    """
+    Util class which writes batches into a preallocated buffer in place
+    * torch tensors will be kept on their own device until `finalize` is called,
+    so no device synchronization will be triggered per batch
+    * the buffer will be enlarged if more samples than `capacity` are received
+
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.cursor = 0
+        self.buffer: Optional[Union[np.ndarray, torch.Tensor]] = None
+
+    def _allocate(self, num: int, like: Union[np.ndarray, torch.Tensor]) -> Any:
+        shape = [num, *like.shape[1:]]
+        if isinstance(like, np.ndarray):
+            return np.empty(shape, like.dtype)
+        return torch.empty(shape, dtype=like.dtype, device=like.device)
+
+    def update(self, value: Union[np.ndarray, torch.Tensor]) -> None:
+        # align with `np.vstack`
+        if len(value.shape) < 2:
+            value = value.reshape([1, -1])
+        if isinstance(value, torch.Tensor):
+            value = value.detach()
+        num = len(value)
+        end = self.cursor + num
+        buffer: Any = self.buffer
+        if buffer is None:
+            buffer = self._allocate(max(self.capacity, num), value)
+        elif end > len(buffer):
+            new_buffer = self._allocate(max(end, 2 * len(buffer)), value)
+            new_buffer[: self.cursor] = buffer[: self.cursor]
+            buffer = new_buffer
+        buffer[self.cursor : end] = value
+        self.buffer = buffer
+        self.cursor = end
+
+    def finalize(self) -> Optional[np.ndarray]:
+        if self.buffer is None:
+            return None
+        buffer = self.buffer[: self.cursor]
+        if isinstance(buffer, torch.Tensor):
+            return to_numpy(buffer)
+        return buffer
+
+
+batch_callback_type = Callable[[tensor_dict_type, Optional[torch.Tensor]], None]
+
+
 class InferenceProtocol(ABC):
     data: DataProtocol
     model: Optional[ModelProtocol]
@@ -711,6 +851,7 @@ class InferenceProtocol(ABC):
     onnx: Any = None
     use_tqdm: bool = True
     use_grad_in_predict: bool = False
+    use_amp: bool = False
 
     @property
     def binary_config(self) -> Dict[str, Any]:
@@ -750,24 +891,25 @@ class InferenceProtocol(ABC):
         return_outputs: bool = True,
         state: Optional[TrainerState] = None,
         portion: float = 1.0,
+        batch_callback: Optional[batch_callback_type] = None,
         **kwargs: Any,
     ) -> InferenceOutputs:
         labels_key = loader.loader.labels_key
+        num_samples = loader.loader.num_samples
         if use_tqdm:
             loader = self.to_tqdm(loader)
 
         def _core() -> InferenceOutputs:
-            results: Dict[str, Optional[List[np.ndarray]]] = {}
-            loss_items: Dict[str, List[float]] = {}
-            labels = []
+            results: Dict[str, Optional[ArrayAccumulator]] = {}
+            loss_sums: Dict[str, Union[float, torch.Tensor]] = {}
+            num_loss_batches = 0
+            labels = ArrayAccumulator(num_samples)
             for i, (batch, batch_indices) in enumerate(loader):
                 if i / len(loader) >= portion:
                     break
                 local_labels = batch[labels_key]
                 if local_labels is not None:
-                    if not isinstance(local_labels, np.ndarray):
-                        local_labels = to_numpy(local_labels)
-                    labels.append(local_labels)
+                    labels.update(local_labels)
                 if self.onnx is not None:
                     local_results = self.onnx.inference(batch)
                     local_losses = None
@@ -777,14 +919,16 @@ class InferenceProtocol(ABC):
                         assert not self.model.training
                         local_kwargs = shallow_copy_dict(kwargs)
                         local_kwargs["return_loss"] = return_loss
-                        local_results = self.model(
-                            batch,
-                            i,
-                            state,
-                            batch_indices,
-                            loader_name,
-                            **local_kwargs,
-                        )
+                        with amp_context(self.model.device, self.use_amp):
+                            local_results = self.model(
+                                batch,
+                                i,
+                                state,
+                                batch_indices,
+                                loader_name,
+                                **local_kwargs,
+                            )
+                        local_results = to_full_precision(local_results)
                     if not return_loss:
                         local_losses = None
                     else:
@@ -797,37 +941,38 @@ class InferenceProtocol(ABC):
                                 local_results,
                                 state,
                             )
+                if batch_callback is not None:
+                    batch_callback(local_results, local_labels)
                 for k, v in local_results.items():
                     if v is None:
                         continue
-                    if self.onnx is not None:
-                        v_np = v
-                    else:
-                        v_np = to_numpy(v)
                     if not return_outputs:
                         results[k] = None
                     else:
-                        results.setdefault(k, []).append(v_np)  # type: ignore
+                        accumulator = results.get(k)
+                        if accumulator is None:
+                            accumulator = results[k] = ArrayAccumulator(num_samples)
+                        accumulator.update(v)
                 if local_losses is not None:
+                    num_loss_batches += 1
                     for k, v in local_losses.items():
-                        loss_items.setdefault(k, []).append(v.item())
+                        # losses are reduced on device, and will be synced only once
+                        loss_sums[k] = loss_sums.get(k, 0.0) + v.detach()
 
             final_results: Dict[str, Union[np.ndarray, Any]]
             if not return_outputs:
                 final_results = {k: None for k in results}
             else:
                 final_results = {
-                    k: np.vstack(v) for k, v in results.items() if v is not None
+                    k: v.finalize() for k, v in results.items() if v is not None
+                }
+            loss_items = None
+            if loss_sums:
+                loss_items = {
+                    k: float(v) / num_loss_batches for k, v in loss_sums.items()
                 }
 
-            return InferenceOutputs(
-                final_results,
-                None
-                if not loss_items
-                else {k: sum(v) / len(v) for k, v in loss_items.items()},
-                None if not labels else np.vstack(labels),
-                None,
-            )
+            return InferenceOutputs(final_results, loss_items, labels.finalize(), None)
 
         use_grad = kwargs.pop("use_grad", self.use_grad_in_predict)
         try:
@@ -935,9 +1080,39 @@ class InferenceProtocol(ABC):
         *,
         return_loss: bool = True,
         use_tqdm: bool = False,
+        num_bins: Optional[int] = None,
     ) -> Optional[InferenceOutputs]:
         if not self.need_binary_threshold:
             return None
+        # approximate search with per-class histograms, which will not
+        # materialize the outputs and therefore returns nothing to reuse
+        if num_bins is not None:
+            histogram = ProbabilityHistogram(num_bins)
+
+            def _update(
+                local_results: tensor_dict_type,
+                local_labels: Optional[torch.Tensor],
+            ) -> None:
+                assert local_labels is not None
+                local_probabilities = local_results["predictions"]
+                if not self.output_probabilities:
+                    local_probabilities = F.softmax(local_probabilities, dim=1)
+                histogram.update(local_labels, local_probabilities)
+
+            self.get_outputs(
+                loader,
+                loader_name,
+                return_outputs=False,
+                getting_metrics=True,
+                use_tqdm=use_tqdm,
+                batch_callback=_update,
+            )
+            assert self.binary_metric is not None
+            try:
+                self.binary_threshold = histogram.binary_threshold(self.binary_metric)
+            except ValueError:
+                self.binary_threshold = None
+            return None
         outputs = self.get_outputs(
             loader,
             loader_name,
@@ -975,6 +1150,7 @@ __all__ = [
     "TrainerState",
     "StepOutputs",
     "InferenceOutputs",
+    "ArrayAccumulator",
     "TrainerDataProtocol",
     "ModelProtocol",
     "InferenceProtocol",
@@ -1,20 +1,33 @@
 import os
+import copy
 import json
 import math
 import torch
 import mlflow
 import optuna
+import time
+import shutil
 import getpass
 import logging
+import threading
 
 import numpy as np
+import torch.nn.functional as F
 import torch.distributed as dist
 
 from typing import *
 from abc import abstractmethod
 from abc import ABC
+from functools import partial
+from contextlib import ExitStack
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
 from tqdm.autonotebook import tqdm
 from torch.optim import Optimizer
+from torch.profiler import profile
+from torch.profiler import schedule
+from torch.profiler import record_function
+from torch.profiler import ProfilerActivity
 from torch.optim.lr_scheduler import _LRScheduler
 from torch.nn.parallel import DistributedDataParallel as DDP
 from cftool.ml import Metrics
@@ -26,17 +39,28 @@ from cftool.misc import fix_float_to_length
 from cftool.misc import lock_manager
 from cftool.misc import timing_context
 from cftool.misc import Incrementer
+from cftool.misc import LoggingMixin
+from mlflow.entities import Param
+from mlflow.entities import Metric
 from mlflow.exceptions import MlflowException
 from mlflow.utils.mlflow_tags import MLFLOW_USER
 from mlflow.utils.mlflow_tags import MLFLOW_RUN_NAME
 from mlflow.tracking.fluent import _RUN_ID_ENV_VAR
+from mlflow.utils.validation import MAX_METRICS_PER_BATCH
+from mlflow.utils.validation import MAX_PARAMS_TAGS_PER_BATCH
 
 from .misc.toolkit import *
+from .misc.metrics import streaming_metric_dict
+from .misc.metrics import StreamingMetric
+from .misc.metrics import ProbabilityHistogram
+from .misc.telemetry import null_phase
+from .misc.telemetry import StepTelemetry
 from .types import tensor_dict_type
 from .configs import Environment
 from .modules import optimizer_dict
 from .modules import scheduler_dict
 from .protocol import StepOutputs
+from .protocol import DataProtocol
 from .protocol import TrainerState
 from .protocol import ModelProtocol
 from .protocol import PrefetchLoader
@@ -353,16 +377,129 @@ class TrainMonitor:
                         self._plateau_counter = 0
         return self._handle_trainer_terminate(new_score)
 
+    def state_dict(self) -> Dict[str, Any]:
+        return {k: v for k, v in self.__dict__.items() if k != "monitored"}
+
+    def load_state_dict(self, state_dict: Dict[str, Any]) -> None:
+        self.__dict__.update(state_dict)
+
     @classmethod
     def monitor(cls, monitored: MonitoredMixin, **kwargs: Any) -> "TrainMonitor":
         return cls(monitored, **kwargs)
 
 
+class AdaptiveMonitor:
+    """
+    Util class which decides how much validation should be performed at each snapshot
+    * Snapshots will be evaluated on a stratified subsample of the validation set first,
+    and the full validation set will only be evaluated when the subsample suggests a new
+    best score, or when a termination decision is about to be made
+    * Snapshots will be skipped if the score is not moving, and will be performed more
+    frequently again once the score starts to change rapidly
+
+    Parameters
+    ----------
+    subsample_ratio : float, ratio of the stratified validation subsample
+    min_subsample : int, minimum number of samples in the subsample
+        * validation set will not be subsampled if the subsample is too small
+    max_interval : int, maximum number of snapshots between two evaluations
+    max_partial : int, maximum number of subsample-only evaluations between two full evaluations
+        * full evaluations are required periodically to detect plateau & over-fitting
+    slow_threshold : float, interval will be doubled if relative score change is below this
+    fast_threshold : float, interval will be halved if relative score change is above this
+    seed : int, random seed used to generate the subsample
+
+    """
+
+    def __init__(
+        self,
+        *,
+        subsample_ratio: float = 0.2,
+        min_subsample: int = 500,
+        max_interval: int = 4,
+        max_partial: int = 4,
+        slow_threshold: float = 1.0e-3,
+        fast_threshold: float = 1.0e-2,
+        seed: int = 142857,
+    ):
+        if not 0.0 < subsample_ratio <= 1.0:
+            raise ValueError("`subsample_ratio` should be in (0, 1]")
+        self.subsample_ratio = subsample_ratio
+        self.min_subsample = min_subsample
+        self.max_interval = max_interval
+        self.max_partial = max_partial
+        self.slow_threshold = slow_threshold
+        self.fast_threshold = fast_threshold
+        self.seed = seed
+        self.interval = 1
+        self._last_step = -math.inf
+        self._last_score: Optional[float] = None
+        self._best_partial_score = -math.inf
+        self._num_partial = 0
+
+    def subsample_indices(self, data: DataProtocol) -> Optional[np.ndarray]:
+        num_samples = len(data)
+        num_subsample = int(round(num_samples * self.subsample_ratio))
+        if num_subsample >= num_samples or num_subsample < self.min_subsample:
+            return None
+        y = data.processed.y
+        if y is None:
+            return None
+        y = y.ravel()
+        random_state = np.random.RandomState(self.seed)
+        if data.is_clf:
+            strata = [np.nonzero(y == label)[0] for label in np.unique(y)]
+        else:
+            sorted_indices = np.argsort(y, kind="stable")
+            strata = np.array_split(sorted_indices, num_subsample)
+        picked = []
+        for stratum in strata:
+            num_picked = max(1, int(round(len(stratum) * num_subsample / num_samples)))
+            picked.append(random_state.choice(stratum, num_picked, replace=False))
+        return np.sort(np.concatenate(picked))
+
+    def should_evaluate(self, state: TrainerState) -> bool:
+        num_step = state.step - self._last_step
+        return num_step >= self.interval * state.num_step_per_snapshot
+
+    def should_evaluate_full(self, score: float, *, is_decisive: bool) -> bool:
+        self._num_partial += 1
+        is_best = score > self._best_partial_score
+        if is_best:
+            self._best_partial_score = score
+        if is_best or is_decisive or self._num_partial >= self.max_partial:
+            self._num_partial = 0
+            return True
+        return False
+
+    def update(self, state: TrainerState, score: float) -> None:
+        self._last_step = state.step
+        if self._last_score is not None and not math.isnan(score):
+            change = abs(score - self._last_score)
+            change /= max(abs(self._last_score), 1.0e-8)
+            if change < self.slow_threshold:
+                self.interval = min(self.interval * 2, self.max_interval)
+            elif change > self.fast_threshold:
+                self.interval = max(self.interval // 2, 1)
+        self._last_score = score
+
+    def state_dict(self) -> Dict[str, Any]:
+        return shallow_copy_dict(self.__dict__)
+
+    def load_state_dict(self, state_dict: Dict[str, Any]) -> None:
+        self.__dict__.update(state_dict)
+
+
 class MonitorResults(NamedTuple):
     terminate: bool
     outputs: Optional[InferenceOutputs]
 
 
+class AsyncMonitorJob(NamedTuple):
+    future: Future
+    state: TrainerState
+
+
 class TrainerCallback:
     def __init__(self, trainer: "Trainer"):
         self.trainer = trainer
@@ -374,6 +511,134 @@ class TrainerCallback:
         pass
 
 
+class MlflowBatchLogger(LoggingMixin):
+    """
+    Util class which buffers mlflow metrics & params and flushes them with
+    `log_batch` in a background thread, so the training loop will not be
+    blocked by (possibly slow) tracking storage writes
+    * buffers will be flushed every `flush_interval` seconds, or as soon as
+    `flush_threshold` items are buffered
+    * after `close` is called, every logging call will be flushed immediately
+    * items which failed to be flushed are kept and retried by the next flush,
+    they will only be dropped after `max_retries` consecutive failures
+
+    """
+
+    def __init__(
+        self,
+        client: mlflow.tracking.MlflowClient,
+        run_id: str,
+        *,
+        flush_interval: float = 5.0,
+        flush_threshold: int = 1000,
+        max_retries: int = 3,
+        verbose_level: int = 1,
+    ):
+        self.client = client
+        self.run_id = run_id
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.max_retries = max_retries
+        self._verbose_level = verbose_level
+        self._num_failures = 0
+        self._metrics: List[Metric] = []
+        self._params: List[Param] = []
+        self._buffer_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flush_event = threading.Event()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._worker, daemon=True)
+        self._thread.start()
+
+    @property
+    def is_closed(self) -> bool:
+        return self._closed.is_set()
+
+    def _on_logged(self, num_buffered: int) -> None:
+        if self.is_closed:
+            self._safe_flush()
+        elif num_buffered >= self.flush_threshold:
+            self._flush_event.set()
+
+    def _worker(self) -> None:
+        while not self.is_closed:
+            self._flush_event.wait(self.flush_interval)
+            self._flush_event.clear()
+            self._safe_flush()
+
+    def _safe_flush(self) -> bool:
+        """flushes the buffers, returns whether there is no pending item left"""
+        try:
+            self.flush()
+            self._num_failures = 0
+            return True
+        except Exception as err:
+            self._num_failures += 1
+            if self._num_failures <= self.max_retries:
+                self.log_msg(  # type: ignore
+                    f"failed to flush mlflow logs ({err}), they will be retried "
+                    f"({self._num_failures} / {self.max_retries})",
+                    self.warning_prefix,
+                    msg_level=logging.WARNING,
+                )
+                return False
+            with self._buffer_lock:
+                num_dropped = len(self._metrics) + len(self._params)
+                self._metrics, self._params = [], []
+            self._num_failures = 0
+            self.log_msg(  # type: ignore
+                f"failed to flush mlflow logs ({err}) after {self.max_retries} "
+                f"retries, {num_dropped} metrics & params are dropped",
+                self.warning_prefix,
+                msg_level=logging.WARNING,
+            )
+            return True
+
+    def log_metric(self, key: str, value: float, step: Optional[int] = None) -> None:
+        metric = Metric(key, float(value), int(time.time() * 1000), step or 0)
+        with self._buffer_lock:
+            self._metrics.append(metric)
+            num_buffered = len(self._metrics) + len(self._params)
+        self._on_logged(num_buffered)
+
+    def log_param(self, key: str, value: Any) -> None:
+        with self._buffer_lock:
+            self._params.append(Param(key, str(value)))
+            num_buffered = len(self._metrics) + len(self._params)
+        self._on_logged(num_buffered)
+
+    def flush(self) -> None:
+        with self._flush_lock:
+            with self._buffer_lock:
+                metrics, self._metrics = self._metrics, []
+                params, self._params = self._params, []
+            try:
+                while params:
+                    batch = params[:MAX_PARAMS_TAGS_PER_BATCH]
+                    self.client.log_batch(self.run_id, params=batch)
+                    params = params[MAX_PARAMS_TAGS_PER_BATCH:]
+                while metrics:
+                    batch = metrics[:MAX_METRICS_PER_BATCH]
+                    self.client.log_batch(self.run_id, metrics=batch)
+                    metrics = metrics[MAX_METRICS_PER_BATCH:]
+            finally:
+                # items which are not flushed are put back, in their original order
+                if params or metrics:
+                    with self._buffer_lock:
+                        self._params = params + self._params
+                        self._metrics = metrics + self._metrics
+
+    def close(self) -> None:
+        if self.is_closed:
+            return None
+        self._closed.set()
+        self._flush_event.set()
+        self._thread.join()
+        # pending items are retried at most `max_retries` times before dropping
+        while not self._safe_flush():
+            pass
+
+
 class TqdmSettings(NamedTuple):
     use_tqdm: bool
     use_step_tqdm: bool
@@ -397,6 +662,7 @@ def _setup_ddp(
 
 class Trainer(MonitoredMixin):
     callback_base = TrainerCallback
+    training_state_file = "__training_state__.pt"
 
     def __init__(
         self,
@@ -416,12 +682,18 @@ class Trainer(MonitoredMixin):
         self.is_rank_0 = environment.is_rank_0
         self._init_mlflow(environment)
         self.checkpoint_scores: Dict[str, float] = {}
+        self.optimizers: Dict[str, Optimizer] = {}
         self.tr_loader_copy: Optional[PrefetchLoader] = None
         self.intermediate: Optional[IntermediateResults] = None
+        self._checkpoint_model: Optional[ModelProtocol] = None
+        self._checkpoint_state: Optional[TrainerState] = None
+        self.telemetry: Optional[StepTelemetry] = None
+        self.profiler: Optional[profile] = None
         self.intermediate_updated = False
         self.final_results: Optional[IntermediateResults] = None
         self._use_grad_in_predict = False
         self.onnx: Optional[Any] = None
+        self.initial_random_states: Optional[Dict[str, Any]] = None
         # config based
         self.timing = environment.use_timing_context
         self.config = environment.trainer_config
@@ -435,10 +707,20 @@ class Trainer(MonitoredMixin):
         )
         self._verbose_level = environment.verbose_level
         self.update_bt_runtime = self.update_binary_threshold_at_runtime
-        self.grad_scaler = torch.cuda.amp.GradScaler(enabled=self.use_amp)
+        # grad scaler is not needed for bfloat16, which is used on cpu
+        use_grad_scaler = self.use_amp and self.device.type == "cuda"
+        self.grad_scaler = torch.cuda.amp.GradScaler(enabled=use_grad_scaler)
+        self.inference.use_amp = self.use_amp
         self.state = TrainerState(self.config)
+        # index of the next micro-batch in the current epoch, which is only
+        #  updated on optimizer-step boundaries
+        self._tr_batch_offset = 0
+        self._resume_batch_offset: Optional[int] = None
 
     def __getattr__(self, item: str) -> Any:
+        # attributes are not ready yet when unpickling
+        if item.startswith("__") or "config" not in self.__dict__:
+            raise AttributeError(item)
         value = self.config.get(item)
         if value is not None:
             return value
@@ -449,6 +731,7 @@ class Trainer(MonitoredMixin):
     def _init_mlflow(self, environment: Environment) -> None:
         self.run_id: Optional[str] = None
         self.mlflow_client: Optional[mlflow.tracking.MlflowClient] = None
+        self.mlflow_logger: Optional[MlflowBatchLogger] = None
         mlflow_config = environment.mlflow_config
         if mlflow_config is None or self.is_loading or not self.is_rank_0:
             return None
@@ -496,6 +779,7 @@ class Trainer(MonitoredMixin):
         self.run_id = run.info.run_id
 
         self.mlflow_params = mlflow_config.get("mlflow_params")
+        self.mlflow_logger_config = mlflow_config.setdefault("logger_config", {})
 
     def _prepare_log(self) -> None:
         tuple(
@@ -510,16 +794,34 @@ class Trainer(MonitoredMixin):
             pass
         if self.mlflow_client is None:
             return None
+        assert self.run_id is not None
+        mlflow_logger_config = shallow_copy_dict(self.mlflow_logger_config)
+        mlflow_logger_config.setdefault("verbose_level", self._verbose_level)
+        self.mlflow_logger = MlflowBatchLogger(
+            self.mlflow_client,
+            self.run_id,
+            **mlflow_logger_config,
+        )
         mlflow_params = self.mlflow_params or self.environment.user_defined_config
         if not self.from_external:
             for key, value in mlflow_params.items():
-                self.mlflow_client.log_param(self.run_id, key, value)
+                self.mlflow_logger.log_param(key, value)
 
-    def _log_scalars(self, metrics: Dict[str, float]) -> None:
-        if self.mlflow_client is None:
+    def _log_scalars(
+        self,
+        metrics: Dict[str, float],
+        step: Optional[int] = None,
+    ) -> None:
+        if self.mlflow_logger is None:
             return None
+        if step is None:
+            step = self.state.step
         for key, value in metrics.items():
-            self.mlflow_client.log_metric(self.run_id, key, value, step=self.state.step)
+            self.mlflow_logger.log_metric(key, value, step=step)
+
+    def _close_mlflow_logger(self) -> None:
+        if self.mlflow_logger is not None:
+            self.mlflow_logger.close()
 
     def _log_artifacts(self) -> None:
         if self.mlflow_client is None:
@@ -616,7 +918,7 @@ class Trainer(MonitoredMixin):
 
     def _init_optimizers(self) -> None:
         optimizers_settings = self.config.setdefault("optimizers", {"all": {}})
-        self.optimizers: Dict[str, Optimizer] = {}
+        self.optimizers = {}
         self.schedulers: Dict[str, Optional[_LRScheduler]] = {}
         lr_ratio = max(1.0, self.environment.pipeline_config.get("lr_ratio", 1.0))
         default_lr = 1.0e-3 * lr_ratio
@@ -631,7 +933,7 @@ class Trainer(MonitoredMixin):
             else:
                 multiplier = scheduler_config.setdefault("multiplier", 3)
                 optimizer_config.setdefault("lr", default_lr / multiplier)
-                default_max_warmup_step = int(round(3.0e5 / self.tr_loader.batch_size))
+                default_max_warmup_step = int(round(3.0e5 / self.state.batch_size))
                 num_step_per_epoch = self.state.num_step_per_epoch
                 warmup_step = scheduler_config.setdefault(
                     "warmup_step",
@@ -725,6 +1027,29 @@ class Trainer(MonitoredMixin):
         self.metrics_weights = metric_config.setdefault("weights", {})
         for metric_type in metric_types:
             self.metrics_weights.setdefault(metric_type, 1.0)
+        # streaming metrics are opt-in, and will only be used if all metrics
+        # can be streamed
+        self.streaming_metrics: Optional[Dict[str, StreamingMetric]] = None
+        if metric_config.setdefault("streaming", False):
+            streaming_metrics = {}
+            for metric_type, metric_ins in self.metrics.items():
+                if metric_ins is None:
+                    continue
+                if metric_type in Metrics.custom_metrics:
+                    break
+                if metric_type not in streaming_metric_dict:
+                    break
+                streaming_metrics[metric_type] = StreamingMetric.make(
+                    metric_type,
+                    metric_ins.config,
+                )
+            else:
+                self.streaming_metrics = streaming_metrics
+        self.binary_threshold_bins = metric_config.setdefault(
+            "binary_threshold_bins",
+            10000,
+        )
+        self._binary_histogram: Optional[ProbabilityHistogram] = None
 
     @property
     def ddp(self) -> bool:
@@ -760,6 +1085,14 @@ class Trainer(MonitoredMixin):
         loader = self.binary_threshold_loader
         return "tr" if loader is self.tr_loader_copy else "cv"
 
+    @property
+    def fuse_binary_threshold(self) -> bool:
+        if not self.inference.need_binary_threshold:
+            return False
+        if self.streaming_metrics is None:
+            return False
+        return self.binary_threshold_loader is self.validation_loader
+
     # core
 
     @property
@@ -805,9 +1138,8 @@ class Trainer(MonitoredMixin):
         for key, scheduler in self.schedulers.items():
             if scheduler is not None:
                 should_log_lr, kwargs = self._get_scheduler_settings(key, scheduler)
-                if self.mlflow_client is not None and should_log_lr:
-                    self.mlflow_client.log_metric(
-                        self.run_id,
+                if self.mlflow_logger is not None and should_log_lr:
+                    self.mlflow_logger.log_metric(
                         f"lr-{key}",
                         scheduler.get_last_lr()[0],  # type: ignore
                         step=self.state.step,
@@ -840,103 +1172,533 @@ class Trainer(MonitoredMixin):
             f.write(f"{msg}\n")
         self.log_msg(msg, verbose_level=None)  # type: ignore
 
-    def _generate_binary_threshold(self) -> Optional[InferenceOutputs]:
-        if not self.inference.need_binary_threshold:
+    def _generate_binary_threshold(
+        self,
+        inference: Optional[InferenceProtocol] = None,
+    ) -> Optional[InferenceOutputs]:
+        if inference is None:
+            inference = self.inference
+        if not inference.need_binary_threshold:
             return None
-        return self.inference.generate_binary_threshold(
+        num_bins = None
+        if self.streaming_metrics is not None:
+            num_bins = self.binary_threshold_bins
+        return inference.generate_binary_threshold(
             self.binary_threshold_loader,
             self.binary_threshold_loader_name,
             return_loss=self._metrics_need_loss,
             use_tqdm=self.use_tqdm_in_cv,
+            num_bins=num_bins,
+        )
+
+    def _init_adaptive_monitor(self) -> None:
+        self._adaptive_monitor: Optional[AdaptiveMonitor] = None
+        self._subsample_loader: Optional[PrefetchLoader] = None
+        adaptive_config = self.config.setdefault("adaptive_monitor_config", None)
+        if adaptive_config is None:
+            return None
+        self._adaptive_monitor = AdaptiveMonitor(**adaptive_config)
+        validation_loader = self.validation_loader
+        indices = self._adaptive_monitor.subsample_indices(validation_loader.data)
+        if indices is None:
+            return None
+        try:
+            subset = validation_loader.loader.subset(indices)
+        except NotImplementedError:
+            self.log_msg(  # type: ignore
+                "validation loader does not support subsampling, "
+                "only the monitor frequency will be adapted",
+                self.warning_prefix,
+                2,
+            )
+            return None
+        self._subsample_loader = PrefetchLoader(
+            subset,
+            self.device,
+            enable_prefetch=validation_loader.enable_prefetch,
+        )
+
+    def _get_subsample_score(self) -> float:
+        loader = self._subsample_loader
+        loader_name = self.validation_loader_name
+        assert loader is not None
+        args = loader, loader_name, None, False, self.inference, self.state
+        _, metrics = self._compute_metrics(None, *args)
+        scores = []
+        for metric_type, metric_ins in self.metrics.items():
+            sign = -1 if metric_ins is None else metric_ins.sign
+            weight = self.metrics_weights[metric_type]
+            scores.append(metrics[metric_type] * weight * sign)
+        return sum(scores) / len(scores)
+
+    # return whether full validation should be performed
+    def _adaptive_monitor_step(self) -> bool:
+        adaptive_monitor = self._adaptive_monitor
+        assert adaptive_monitor is not None
+        # termination (or extension) will be decided at the end of these epochs
+        is_decisive = self.state.should_extend_epoch or self.state.reached_max_epoch
+        if not is_decisive and not adaptive_monitor.should_evaluate(self.state):
+            return False
+        if self._subsample_loader is None:
+            return True
+        score = self._get_subsample_score()
+        adaptive_monitor.update(self.state, score)
+        # early snapshots will only be evaluated on the subsample
+        if not self.state.should_start_snapshot:
+            return False
+        return adaptive_monitor.should_evaluate_full(score, is_decisive=is_decisive)
+
+    def _init_async_monitor(self) -> None:
+        self._async_executor: Optional[ThreadPoolExecutor] = None
+        self._async_pending: Optional[AsyncMonitorJob] = None
+        self._snapshot_model: Optional[ModelProtocol] = None
+        self._snapshot_inference: Optional[InferenceProtocol] = None
+        async_config = self.config.setdefault("async_monitor_config", None)
+        if async_config is None:
+            return None
+        if self._adaptive_monitor is not None:
+            msg = "`async_monitor_config` cannot be used with `adaptive_monitor_config`"
+            raise ValueError(msg)
+        self.async_max_staleness = async_config.setdefault("max_staleness", 1)
+        # attributes which are shared with the training model should not be copied
+        memo = {
+            id(v): v
+            for v in self.model.__dict__.values()
+            if not isinstance(v, (dict, torch.nn.Module, torch.Tensor))
+        }
+        self._snapshot_model = copy.deepcopy(self.model, memo)
+        self._snapshot_inference = copy.copy(self.inference)
+        self._snapshot_inference.model = self._snapshot_model
+        self._async_executor = ThreadPoolExecutor(1, "cflearn_monitor")
+
+    def _async_metrics(
+        self,
+        update_binary_threshold: bool,
+        state: TrainerState,
+    ) -> Tuple[InferenceOutputs, Dict[str, float]]:
+        inference = self._snapshot_inference
+        assert inference is not None
+        binary_outputs = None
+        fuse_binary_threshold = False
+        if update_binary_threshold:
+            if self.fuse_binary_threshold:
+                fuse_binary_threshold = True
+            else:
+                binary_outputs = self._generate_binary_threshold(inference)
+        return self._compute_metrics(
+            binary_outputs,
+            None,
+            None,
+            None,
+            fuse_binary_threshold,
+            inference,
+            state,
         )
 
+    def _submit_async_monitor(self) -> None:
+        assert self._async_executor is not None
+        assert self._snapshot_model is not None
+        assert self._snapshot_inference is not None
+        with timing_context(self, "monitor.snapshot", enable=self.timing):
+            self._snapshot_model.load_state_dict(self.model.state_dict())
+            self._snapshot_inference.binary_threshold = self.inference.binary_threshold
+        update_binary_threshold = False
+        if self.update_bt_runtime and self.state.should_start_snapshot:
+            update_binary_threshold = True
+        state = copy.copy(self.state)
+        future = self._async_executor.submit(
+            self._async_metrics,
+            update_binary_threshold,
+            state,
+        )
+        self._async_pending = AsyncMonitorJob(future, state)
+
+    def _apply_async_monitor(self) -> MonitorResults:
+        pending = self._async_pending
+        assert pending is not None
+        assert self._snapshot_inference is not None
+        self._async_pending = None
+        with timing_context(self, "monitor.wait", enable=self.timing):
+            outputs, metrics = pending.future.result()
+        self.inference.binary_threshold = self._snapshot_inference.binary_threshold
+        self.intermediate = self._get_intermediate(metrics, False, pending.state)
+        self.intermediate_updated = True
+        # checkpoints should be saved from the weights which were evaluated
+        self._checkpoint_model = self._snapshot_model
+        self._checkpoint_state = pending.state
+        try:
+            terminate = self._handle_intermediate(pending.state)
+        finally:
+            self._checkpoint_model = None
+            self._checkpoint_state = None
+        return MonitorResults(terminate, outputs)
+
+    def _async_monitor_step(self, *, wait: bool = False) -> MonitorResults:
+        pending = self._async_pending
+        if pending is not None:
+            if self.state.should_monitor:
+                num_step = self.state.step - pending.state.step
+                max_step = self.async_max_staleness * self.state.num_step_per_snapshot
+                wait = wait or num_step >= max_step
+            if wait or pending.future.done():
+                monitor_results = self._apply_async_monitor()
+                if monitor_results.terminate:
+                    return monitor_results
+        if self.state.should_monitor and self._async_pending is None:
+            self._submit_async_monitor()
+        return MonitorResults(False, None)
+
+    def _finish_async_monitor(self) -> bool:
+        terminate = False
+        if self._async_pending is not None:
+            terminate = self._apply_async_monitor().terminate
+        self._shutdown_async_monitor()
+        return terminate
+
+    def _shutdown_async_monitor(self) -> None:
+        self._async_pending = None
+        if self._async_executor is not None:
+            self._async_executor.shutdown()
+            self._async_executor = None
+            self._snapshot_model = self._snapshot_inference = None
+
+    # `state` is the snapshot of the evaluated step, defaults to current state
+    def _handle_intermediate(self, state: Optional[TrainerState] = None) -> bool:
+        if state is None:
+            state = self.state
+        intermediate = self.intermediate
+        assert intermediate is not None
+        terminate = False
+        if state.should_start_monitor_plateau:
+            if not self._monitor.plateau_flag:
+                self.log_msg(  # type: ignore
+                    "start monitoring plateau",
+                    self.info_prefix,
+                    3,
+                )
+            self._monitor.plateau_flag = True
+        if self._adaptive_monitor is not None:
+            if self._subsample_loader is None:
+                score = intermediate.final_score
+                self._adaptive_monitor.update(state, score)
+
+        with timing_context(self, "monitor.logging", enable=self.timing):
+            if state.should_log_artifacts:
+                self._log_artifacts()
+            if state.should_log_metrics_msg:
+                self._log_metrics_msg(intermediate)
+
+        if state.should_start_snapshot:
+            timing_name = "monitor.prune_trial"
+            with timing_context(self, timing_name, enable=self.timing):
+                score = intermediate.final_score
+                if self.trial is not None:
+                    self.trial.report(score, step=state.step)
+                    if self.trial.should_prune():
+                        self._finish_async_monitor()
+                        self._close_mlflow_logger()
+                        raise optuna.TrialPruned()
+            timing_name = "monitor.check_terminate"
+            with timing_context(self, timing_name, enable=self.timing):
+                if self._monitor.check_terminate(score):
+                    terminate = True
+        return terminate
+
     # return whether we need to terminate
     def _monitor_step(self) -> MonitorResults:
+        if self._async_executor is not None:
+            return self._async_monitor_step()
         outputs = None
         terminate = False
+        if self.state.should_monitor and self._adaptive_monitor is not None:
+            with timing_context(self, "monitor.adaptive", enable=self.timing):
+                if not self._adaptive_monitor_step():
+                    return MonitorResults(terminate, outputs)
         if self.state.should_monitor:
 
             with timing_context(self, "monitor.binary_threshold", enable=self.timing):
                 binary_outputs = None
+                update_binary_threshold = False
                 if self.update_bt_runtime and self.state.should_start_snapshot:
-                    binary_outputs = self._generate_binary_threshold()
+                    # reuse the metric pass if possible
+                    if self.fuse_binary_threshold:
+                        update_binary_threshold = True
+                    else:
+                        binary_outputs = self._generate_binary_threshold()
 
             with timing_context(self, "monitor.get_metrics", enable=self.timing):
-                pack = self.get_metrics(binary_outputs=binary_outputs)
+                pack = self.get_metrics(
+                    binary_outputs=binary_outputs,
+                    update_binary_threshold=update_binary_threshold,
+                )
                 outputs, self.intermediate = pack
                 self.intermediate_updated = True
-                if self.state.should_start_monitor_plateau:
-                    if not self._monitor.plateau_flag:
-                        self.log_msg(  # type: ignore
-                            "start monitoring plateau",
-                            self.info_prefix,
-                            3,
-                        )
-                    self._monitor.plateau_flag = True
-
-            with timing_context(self, "monitor.logging", enable=self.timing):
-                if self.state.should_log_artifacts:
-                    self._log_artifacts()
-                if self.state.should_log_metrics_msg:
-                    self._log_metrics_msg(self.intermediate)
-
-            if self.state.should_start_snapshot:
-                timing_name = "monitor.prune_trial"
-                with timing_context(self, timing_name, enable=self.timing):
-                    score = self.intermediate.final_score
-                    if self.trial is not None:
-                        self.trial.report(score, step=self.state.step)
-                        if self.trial.should_prune():
-                            raise optuna.TrialPruned()
-                timing_name = "monitor.check_terminate"
-                with timing_context(self, timing_name, enable=self.timing):
-                    if self._monitor.check_terminate(score):
-                        terminate = True
+
+            terminate = self._handle_intermediate()
 
         return MonitorResults(terminate, outputs)
 
     def on_save_checkpoint(self, score: float) -> None:
-        self.save_checkpoint(score)
+        with self._phase("checkpoint"):
+            self.save_checkpoint(
+                score,
+                model=self._checkpoint_model,
+                state=self._checkpoint_state,
+            )
+
+    @property
+    def training_state_path(self) -> str:
+        return os.path.join(self.logging_folder, self.training_state_file)
+
+    def save_training_state(self, path: Optional[str] = None) -> None:
+        if path is None:
+            path = self.training_state_path
+        tr_loader_state = None
+        if not self.tr_loader.stop_at_next_batch:
+            tr_loader_state = self.tr_loader.state_dict()
+        schedulers_state = {
+            key: None if scheduler is None else scheduler.state_dict()
+            for key, scheduler in self.schedulers.items()
+        }
+        adaptive_monitor_state = None
+        if self._adaptive_monitor is not None:
+            adaptive_monitor_state = self._adaptive_monitor.state_dict()
+        training_state = {
+            "model": self.model.state_dict(),
+            "optimizers": {k: v.state_dict() for k, v in self.optimizers.items()},
+            "schedulers": schedulers_state,
+            "grad_scaler": self.grad_scaler.state_dict(),
+            "state": self.state.state_dict(),
+            "monitor": self._monitor.state_dict(),
+            "adaptive_monitor": adaptive_monitor_state,
+            "metrics_decay": self.metrics_decay,
+            "intermediate": self.intermediate,
+            "intermediate_updated": self.intermediate_updated,
+            "binary_threshold": self.inference.binary_threshold,
+            "checkpoint_folder": os.path.abspath(self.checkpoint_folder),
+            "checkpoint_scores": self.checkpoint_scores,
+            "tr_loader": tr_loader_state,
+            "tr_batch_offset": self._tr_batch_offset,
+            "random_states": get_random_states(),
+            "initial_random_states": self.initial_random_states,
+        }
+        # write to a temporary file first so an interruption will not
+        #  corrupt the previous training state
+        tmp_path = f"{path}.tmp"
+        torch.save(training_state, tmp_path)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load_training_state(cls, path: str) -> Dict[str, Any]:
+        if os.path.isdir(path):
+            path = os.path.join(path, cls.training_state_file)
+        if not os.path.isfile(path):
+            raise ValueError(f"training state '{path}' does not exist")
+        return torch.load(path, map_location="cpu")
+
+    # return whether the training state is stored in the middle of an epoch
+    def _restore_training_state(self, training_state: Dict[str, Any]) -> bool:
+        self.model.load_state_dict(training_state["model"])
+        for key, opt_state in training_state["optimizers"].items():
+            self.optimizers[key].load_state_dict(opt_state)
+        for key, scheduler_state in training_state["schedulers"].items():
+            scheduler = self.schedulers[key]
+            if scheduler is not None and scheduler_state is not None:
+                scheduler.load_state_dict(scheduler_state)
+        self.grad_scaler.load_state_dict(training_state["grad_scaler"])
+        self.state.load_state_dict(training_state["state"])
+        self._monitor.load_state_dict(training_state["monitor"])
+        adaptive_monitor_state = training_state.get("adaptive_monitor")
+        if self._adaptive_monitor is not None and adaptive_monitor_state is not None:
+            self._adaptive_monitor.load_state_dict(adaptive_monitor_state)
+        self.metrics_decay = training_state["metrics_decay"]
+        self.intermediate = training_state["intermediate"]
+        self.intermediate_updated = training_state["intermediate_updated"]
+        self.inference.binary_threshold = training_state["binary_threshold"]
+        # checkpoints
+        self.checkpoint_scores = training_state["checkpoint_scores"]
+        src_folder = training_state["checkpoint_folder"]
+        tgt_folder = os.path.abspath(self.checkpoint_folder)
+        if src_folder != tgt_folder:
+            for file in self.checkpoint_scores:
+                src_path = os.path.join(src_folder, file)
+                if os.path.isfile(src_path):
+                    shutil.copy(src_path, os.path.join(tgt_folder, file))
+            with open(os.path.join(tgt_folder, self.model.scores_file), "w") as f:
+                json.dump(self.checkpoint_scores, f)
+        # loader & random states
+        tr_loader_state = training_state["tr_loader"]
+        if tr_loader_state is not None:
+            self.tr_loader.load_state_dict(tr_loader_state)
+        # states saved before the offset was recorded fall back to the step count
+        self._resume_batch_offset = training_state.get("tr_batch_offset")
+        set_random_states(training_state["random_states"])
+        self.log_msg(  # type: ignore
+            f"training resumed from epoch {self.state.epoch} "
+            f"(step {self.state.step})",
+            self.info_prefix,
+            2,
+        )
+        return tr_loader_state is not None
 
     def _finalize(self, step_outputs: StepOutputs) -> None:
         if self.model.use_ema:
-            with timing_context(self, "EMA", enable=self.timing):
+            with self._phase("ema"), timing_context(self, "EMA", enable=self.timing):
                 self.model.apply_ema()
         if self.state.should_log_losses:
             tr_losses = {f"tr_{k}": v for k, v in step_outputs.loss_items.items()}
             self._log_scalars(tr_losses)
 
+    # telemetry
+
+    def _init_telemetry(self) -> None:
+        self.telemetry = None
+        telemetry_config = self.config.setdefault("telemetry_config", None)
+        if telemetry_config is None or not self.is_rank_0:
+            return None
+        self.telemetry = StepTelemetry(self.logging_folder, **telemetry_config)
+
+    def _phase(self, name: str) -> ContextManager:
+        if self.profiler is None:
+            if self.telemetry is None:
+                return null_phase
+            return self.telemetry.phase(name)
+        stack = ExitStack()
+        stack.enter_context(record_function(f"cflearn::{name}"))
+        if self.telemetry is not None:
+            stack.enter_context(self.telemetry.phase(name))
+        return stack
+
+    @staticmethod
+    def _get_num_samples(batch: tensor_dict_type) -> int:
+        x_batch = batch.get("x_batch")
+        if x_batch is None:
+            return 0
+        return len(x_batch)
+
+    def _finish_telemetry(self) -> None:
+        if self.telemetry is None:
+            return None
+        summary = self.telemetry.close()
+        if not summary:
+            return None
+        msg_list = [f"{'':>16s} | {'p50':>10s} | {'p95':>10s} | {'p99':>10s}"]
+        for key, values in summary.items():
+            if "p50" not in values:
+                continue
+            percentiles = [values.get(p, math.nan) for p in ("p50", "p95", "p99")]
+            msg_list.append(
+                f"{key:>16s} | "
+                + " | ".join(fix_float_to_length(v, 10) for v in percentiles)
+            )
+        self.log_block_msg(
+            "\n".join(msg_list),
+            title="step telemetry",
+            verbose_level=4,
+        )
+
+    # profiler
+
+    def _init_profiler(self) -> None:
+        self.profiler = None
+        profiler_config = self.config.setdefault("profiler_config", None)
+        if profiler_config is None or not self.is_rank_0:
+            return None
+        num_wait = profiler_config.setdefault("num_wait", 1)
+        num_warmup = profiler_config.setdefault("num_warmup", 1)
+        num_active = profiler_config.setdefault("num_active", 10)
+        profiler_config.setdefault("stop_after", False)
+        profiler_config.setdefault("sort_by", "self_cpu_time_total")
+        profiler_config.setdefault("row_limit", 50)
+        profiler_kwargs = profiler_config.setdefault("profiler_kwargs", {})
+        activities = [ProfilerActivity.CPU]
+        if self.device.type == "cuda":
+            activities.append(ProfilerActivity.CUDA)
+        self.profiler_folder = os.path.join(self.logging_folder, "profiler")
+        os.makedirs(self.profiler_folder, exist_ok=True)
+        self._num_profile_step = num_wait + num_warmup + num_active
+        self.profiler = profile(
+            activities=activities,
+            schedule=schedule(wait=num_wait, warmup=num_warmup, active=num_active),
+            on_trace_ready=self._on_trace_ready,
+            **profiler_kwargs,
+        )
+        self.profiler.start()
+
+    def _on_trace_ready(self, prof: profile) -> None:
+        trace_path = os.path.join(self.profiler_folder, "trace.json")
+        prof.export_chrome_trace(trace_path)
+        profiler_config = self.config["profiler_config"]
+        table = prof.key_averages().table(
+            sort_by=profiler_config["sort_by"],
+            row_limit=profiler_config["row_limit"],
+        )
+        with open(os.path.join(self.profiler_folder, "operators.txt"), "w") as f:
+            f.write(table)
+        self.log_msg(  # type: ignore
+            f"profiler trace is exported to '{trace_path}'",
+            self.info_prefix,
+            2,
+        )
+
+    def _profiler_step(self) -> bool:
+        if self.profiler is None:
+            return False
+        self.profiler.step()
+        self._num_profile_step -= 1
+        if self._num_profile_step > 0:
+            return False
+        self._finish_profiler()
+        return self.config["profiler_config"]["stop_after"]
+
+    def _finish_profiler(self) -> None:
+        if self.profiler is None:
+            return None
+        self.profiler.stop()
+        self.profiler = None
+
     # core step on each epoch
     def _step(
         self,
         batch_idx: int,
         batch: tensor_dict_type,
         batch_indices: Optional[torch.Tensor],
+        step_outputs: Optional[StepOutputs] = None,
     ) -> StepOutputs:
-        with torch.cuda.amp.autocast(enabled=self.use_amp):
-            step_outputs = self.model.step(
-                self.state,
-                batch_idx,
-                batch,
-                batch_indices,
-                "tr",
-            )
-        with timing_context(self, "loss.backward", enable=self.timing):
-            loss = step_outputs.loss_dict["loss"]
-            self.grad_scaler.scale(loss).backward()
-        if self.clip_norm > 0.0:
-            with timing_context(self, "clip_norm_step", enable=self.timing):
-                self._clip_norm_step()
-        with timing_context(self, "optimizer_step", enable=self.timing):
-            self._optimizer_step()
-        with timing_context(self, "scheduler_step", enable=self.timing):
-            self._scheduler_step()
+        num_accumulate, should_update = self.state.accumulation_info(batch_idx)
+        # forward & backward passes may have been done outside (see `population`)
+        if step_outputs is None:
+            with self._phase("forward"), amp_context(self.device, self.use_amp):
+                step_outputs = self.model.step(
+                    self.state,
+                    batch_idx,
+                    batch,
+                    batch_indices,
+                    "tr",
+                )
+            with self._phase("backward"):
+                with timing_context(self, "loss.backward", enable=self.timing):
+                    loss = step_outputs.loss_dict["loss"]
+                    if num_accumulate > 1:
+                        loss = loss / num_accumulate
+                    self.grad_scaler.scale(loss).backward()
+        # gradients are accumulated until the last micro-batch of the update
+        if not should_update:
+            return step_outputs
+        with self._phase("optimizer"):
+            if self.clip_norm > 0.0:
+                with timing_context(self, "clip_norm_step", enable=self.timing):
+                    self._clip_norm_step()
+            with timing_context(self, "optimizer_step", enable=self.timing):
+                self._optimizer_step()
+            with timing_context(self, "scheduler_step", enable=self.timing):
+                self._scheduler_step()
         self._finalize(step_outputs)
         return step_outputs
 
     # api
 
-    def fit(
+    def _before_fit(
         self,
         tr_loader: DataLoaderProtocol,
         tr_loader_copy: DataLoaderProtocol,
@@ -945,7 +1707,8 @@ class Trainer(MonitoredMixin):
         cv_weights: Optional[np.ndarray],
         *,
         enable_prefetch: bool = True,
-    ) -> None:
+        training_state: Optional[Dict[str, Any]] = None,
+    ) -> bool:
         self.tr_loader = PrefetchLoader(
             tr_loader,
             self.device,
@@ -981,6 +1744,10 @@ class Trainer(MonitoredMixin):
         default_patience = max(4, math.ceil(math.log10(tr_loader.num_samples)))
         monitor_config.setdefault("patience", default_patience)
         self._monitor = TrainMonitor.monitor(self, **monitor_config)
+        self._init_adaptive_monitor()
+        self._init_async_monitor()
+        self._init_telemetry()
+        self._init_profiler()
         # train
         self.model.info()
         show_summary = self.show_summary
@@ -1003,7 +1770,6 @@ class Trainer(MonitoredMixin):
             with open(os.path.join(logging_folder, "__summary__.txt"), "w") as f:
                 f.write(summary_msg)
         self._prepare_log()
-        step_tqdm = None
         self._epoch_tqdm: Optional[tqdm] = None
         if self.tqdm_settings.use_tqdm:
             self._epoch_tqdm = tqdm(
@@ -1012,27 +1778,143 @@ class Trainer(MonitoredMixin):
                 desc=self.tqdm_settings.desc,
                 leave=False,
             )
-        has_ckpt = terminate = False
-        while self.state.should_train:
+        resume_in_epoch = False
+        if training_state is not None:
+            resume_in_epoch = self._restore_training_state(training_state)
+            if self._epoch_tqdm is not None:
+                self._epoch_tqdm.update(self.state.epoch - int(resume_in_epoch))
+        return resume_in_epoch
+
+    def _train_step(
+        self,
+        batch_idx: int,
+        batch: tensor_dict_type,
+        batch_indices: Optional[torch.Tensor],
+        step_outputs: Optional[StepOutputs] = None,
+    ) -> bool:
+        """performs one training step, returns whether training should terminate"""
+        if self.telemetry is not None:
+            self.telemetry.batch_fetched(self._get_num_samples(batch))
+        if batch_idx % self.state.num_accumulate == 0:
+            self.state.step += 1
+        step_outputs = self._step(batch_idx, batch, batch_indices, step_outputs)
+        if not self.state.accumulation_info(batch_idx)[1]:
+            if self.telemetry is not None:
+                self.telemetry.end_batch()
+            return False
+        self._tr_batch_offset = batch_idx + 1
+        self.callback.after_step(step_outputs)
+        with self._phase("monitor"):
+            monitor_results = self._monitor_step()
+        self.callback.after_monitor(monitor_results)
+        terminate = monitor_results.terminate
+        if not terminate and self.resumable and self.is_rank_0:
+            if self.state.should_monitor:
+                with self._phase("checkpoint"):
+                    self.save_training_state()
+        if self.telemetry is not None:
+            self.telemetry.end_step(self.state.step, self.state.epoch)
+        if self._profiler_step():
+            terminate = True
+        return terminate
+
+    def _end_epoch(self) -> None:
+        if self.use_tqdm:
+            assert self._epoch_tqdm is not None
+            self._epoch_tqdm.total = self.state.num_epoch
+            self._epoch_tqdm.update()
+
+    def _after_fit(self, step_tqdm: Optional[tqdm] = None) -> None:
+        if self.use_tqdm:
+            if step_tqdm is not None:
+                step_tqdm.close()
+            assert self._epoch_tqdm is not None
+            self._epoch_tqdm.close()
+        # pending validation should be applied before restoring
+        self._finish_async_monitor()
+        self._finish_telemetry()
+        self._finish_profiler()
+        # restore
+        has_ckpt = False
+        if os.path.isdir(self.checkpoint_folder):
+            if not self.ddp:
+                self.log_msg(  # type: ignore
+                    "rolling back to the best checkpoint",
+                    self.info_prefix,
+                    3,
+                )
+            has_ckpt = self.restore_checkpoint()
+        # finalize
+        self.state.set_terminate()
+        if self.fuse_binary_threshold:
+            pack = self.get_metrics(update_binary_threshold=True)
+        else:
+            outputs = self._generate_binary_threshold()
+            pack = self.get_metrics(binary_outputs=outputs)
+        self.final_results = pack[1]
+        self._log_metrics_msg(self.final_results)
+        if not has_ckpt:
+            self.save_checkpoint(self.final_results.final_score)
+        self._close_mlflow_logger()
+
+    def fit(
+        self,
+        tr_loader: DataLoaderProtocol,
+        tr_loader_copy: DataLoaderProtocol,
+        cv_loader: Optional[DataLoaderProtocol],
+        tr_weights: Optional[np.ndarray],
+        cv_weights: Optional[np.ndarray],
+        *,
+        enable_prefetch: bool = True,
+        training_state: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        resume_in_epoch = self._before_fit(
+            tr_loader,
+            tr_loader_copy,
+            cv_loader,
+            tr_weights,
+            cv_weights,
+            enable_prefetch=enable_prefetch,
+            training_state=training_state,
+        )
+        try:
+            step_tqdm = self._loop(resume_in_epoch)
+            self._after_fit(step_tqdm)
+        finally:
+            self._shutdown_async_monitor()
+            self._close_mlflow_logger()
+
+    def _loop(self, resume_in_epoch: bool) -> Optional[tqdm]:
+        step_tqdm = None
+        terminate = False
+        while self.state.should_train or resume_in_epoch:
             try:
-                self.state.epoch += 1
+                start_idx = 0
+                if not resume_in_epoch:
+                    self.state.epoch += 1
+                elif self._resume_batch_offset is not None:
+                    start_idx = self._resume_batch_offset
+                    resume_in_epoch = False
+                    self._resume_batch_offset = None
+                else:
+                    num_step_per_epoch = self.state.num_step_per_epoch
+                    num_finished = (self.state.epoch - 1) * num_step_per_epoch
+                    start_idx = self.state.step - num_finished
+                    start_idx *= self.state.num_accumulate
+                    resume_in_epoch = False
                 step_iterator = self.tr_loader
                 if self.tqdm_settings.use_step_tqdm:
                     step_tqdm = step_iterator = tqdm(
                         step_iterator,
                         total=len(self.tr_loader),
+                        initial=start_idx,
                         position=self.tqdm_settings.position + 1,
                         leave=False,
                     )
                 if self.ddp:
                     dist.barrier()
-                for i, (batch, batch_indices) in enumerate(step_iterator):
-                    self.state.step += 1
-                    step_outputs = self._step(i, batch, batch_indices)
-                    self.callback.after_step(step_outputs)
-                    monitor_results = self._monitor_step()
-                    self.callback.after_monitor(monitor_results)
-                    terminate = monitor_results.terminate
+                for i, (batch, batch_indices) in enumerate(step_iterator, start_idx):
+                    terminate = self._train_step(i, batch, batch_indices)
                     if terminate:
                         break
             except KeyboardInterrupt:
@@ -1044,64 +1926,38 @@ class Trainer(MonitoredMixin):
                 terminate = True
             if terminate:
                 break
-            if self.use_tqdm:
-                assert self._epoch_tqdm is not None
-                self._epoch_tqdm.total = self.state.num_epoch
-                self._epoch_tqdm.update()
-        if self.use_tqdm:
-            if step_tqdm is not None:
-                step_tqdm.close()
-            assert self._epoch_tqdm is not None
-            self._epoch_tqdm.close()
-        # restore
-        if os.path.isdir(self.checkpoint_folder):
-            if not self.ddp:
-                self.log_msg(  # type: ignore
-                    "rolling back to the best checkpoint",
-                    self.info_prefix,
-                    3,
-                )
-            has_ckpt = self.restore_checkpoint()
-        # finalize
-        self.state.set_terminate()
-        outputs = self._generate_binary_threshold()
-        _, self.final_results = self.get_metrics(binary_outputs=outputs)
-        self._log_metrics_msg(self.final_results)
-        if not has_ckpt:
-            self.save_checkpoint(self.final_results.final_score)
+            self._end_epoch()
+        return step_tqdm
 
-    def get_metrics(
+    def _get_metrics(
         self,
-        *,
-        binary_outputs: Optional[InferenceOutputs] = None,
-        loader: Optional[PrefetchLoader] = None,
-        loader_name: Optional[str] = None,
-        metrics_kwargs: Optional[Dict[str, Dict[str, Any]]] = None,
-    ) -> Tuple[InferenceOutputs, IntermediateResults]:
-        is_custom_loader = loader is not None
+        binary_outputs: Optional[InferenceOutputs],
+        loader: Optional[PrefetchLoader],
+        loader_name: Optional[str],
+        metrics_kwargs: Optional[Dict[str, Dict[str, Any]]],
+        inference: InferenceProtocol,
+        state: TrainerState,
+    ) -> Tuple[InferenceOutputs, Dict[str, float]]:
         if binary_outputs is not None:
             outputs = binary_outputs
             probabilities = outputs.probabilities
-            if not self.model.output_probabilities:
+            if not inference.output_probabilities:
                 logits = None
             else:
                 logits = probabilities
             assert probabilities is not None
-            outputs.results["predictions"] = self.inference.predict_with(probabilities)
+            outputs.results["predictions"] = inference.predict_with(probabilities)
         else:
-            if not is_custom_loader:
-                loader = self.validation_loader
-                loader_name = self.validation_loader_name
             assert loader is not None
-            outputs = self.inference.get_outputs(
+            outputs = inference.get_outputs(
                 loader,
                 loader_name,
                 use_tqdm=self.use_tqdm_in_cv,
                 return_loss=self._metrics_need_loss,
                 getting_metrics=True,
-                state=self.state,
+                state=state,
             )
-            results = self.inference.predict_from_outputs(
+            results = inference.predict_from_outputs(
                 outputs,
                 return_all=True,
                 requires_recover=False,
@@ -1112,59 +1968,199 @@ class Trainer(MonitoredMixin):
             logits = outputs.results.get("logits")
         labels = outputs.labels
         results = outputs.results
-        use_decayed = False
-        signs: Dict[str, int] = {}
         metrics: Dict[str, float] = {}
-        decayed_metrics: Dict[str, float] = {}
         for metric_type, metric_ins in self.metrics.items():
             if metric_ins is None:
                 assert outputs.loss_items is not None
-                signs[metric_type] = -1
-                sub_metric = metrics[metric_type] = outputs.loss_items[metric_type]
+                metrics[metric_type] = outputs.loss_items[metric_type]
+                continue
+            if self.tr_loader.data.is_reg:
+                if metric_type == "quantile":
+                    metric_key = "quantiles"
+                else:
+                    metric_key = "predictions"
+                metric_predictions = results[metric_key]
             else:
-                signs[metric_type] = metric_ins.sign
-                if self.tr_loader.data.is_reg:
-                    if metric_type == "quantile":
-                        metric_key = "quantiles"
-                    else:
-                        metric_key = "predictions"
-                    metric_predictions = results[metric_key]
+                if not metric_ins.requires_prob:
+                    metric_predictions = results["predictions"]
                 else:
-                    if not metric_ins.requires_prob:
-                        metric_predictions = results["predictions"]
+                    if logits is None and probabilities is None:
+                        msg = "`logits` should be returned in `inference.predict`"
+                        raise ValueError(msg)
+                    if inference.output_probabilities:
+                        metric_predictions = logits
                     else:
-                        if logits is None and probabilities is None:
-                            msg = "`logits` should be returned in `inference.predict`"
-                            raise ValueError(msg)
-                        if self.model.output_probabilities:
-                            metric_predictions = logits
+                        if logits is None:
+                            metric_predictions = probabilities
                         else:
-                            if logits is None:
-                                metric_predictions = probabilities
-                            else:
-                                metric_predictions = to_prob(logits)
-                metric_kwargs = (metrics_kwargs or {}).get(metric_type)
-                sub_metric = metric_ins.metric(
-                    labels,
-                    metric_predictions,
-                    **shallow_copy_dict(metric_kwargs or {}),
-                )
-                metrics[metric_type] = float(sub_metric)
-            if self.metrics_decay is not None and self.state.should_start_snapshot:
+                            metric_predictions = to_prob(logits)
+            metric_kwargs = (metrics_kwargs or {}).get(metric_type)
+            sub_metric = metric_ins.metric(
+                labels,
+                metric_predictions,
+                **shallow_copy_dict(metric_kwargs or {}),
+            )
+            metrics[metric_type] = float(sub_metric)
+        return outputs, metrics
+
+    def _update_streaming_metrics(
+        self,
+        inference: InferenceProtocol,
+        results: tensor_dict_type,
+        labels: Optional[torch.Tensor],
+    ) -> None:
+        assert labels is not None
+        assert self.streaming_metrics is not None
+        is_reg = self.tr_loader.data.is_reg
+        probabilities = predictions = None
+        histogram = self._binary_histogram
+        if not is_reg:
+            logits = results["predictions"]
+            if inference.output_probabilities:
+                probabilities = logits
+            else:
+                probabilities = F.softmax(logits, dim=1)
+            threshold = inference.binary_threshold
+            if not inference.is_binary or threshold is None:
+                predictions = logits.argmax(1, keepdim=True)
+            else:
+                predictions = (probabilities[..., 1:] >= threshold).to(torch.long)
+            if histogram is not None:
+                histogram.update(labels, probabilities)
+        for metric_type, streaming_metric in self.streaming_metrics.items():
+            if is_reg:
+                if metric_type == "quantile":
+                    metric_predictions = results["quantiles"]
+                else:
+                    metric_predictions = results["predictions"]
+            elif streaming_metric.requires_prob:
+                metric_predictions = probabilities
+            else:
+                metric_predictions = predictions
+            streaming_metric.update(labels, metric_predictions)
+
+    def _get_streaming_metrics(
+        self,
+        loader: PrefetchLoader,
+        loader_name: Optional[str],
+        update_binary_threshold: bool,
+        inference: InferenceProtocol,
+        state: TrainerState,
+    ) -> Tuple[InferenceOutputs, Dict[str, float]]:
+        assert self.streaming_metrics is not None
+        for streaming_metric in self.streaming_metrics.values():
+            streaming_metric.reset()
+        if update_binary_threshold:
+            self._binary_histogram = ProbabilityHistogram(self.binary_threshold_bins)
+        try:
+            outputs = inference.get_outputs(
+                loader,
+                loader_name,
+                use_tqdm=self.use_tqdm_in_cv,
+                return_loss=self._metrics_need_loss,
+                return_outputs=False,
+                getting_metrics=True,
+                state=state,
+                batch_callback=partial(self._update_streaming_metrics, inference),
+            )
+            histogram = self._binary_histogram
+        finally:
+            self._binary_histogram = None
+        metrics: Dict[str, float] = {}
+        for metric_type, metric_ins in self.metrics.items():
+            if metric_ins is None:
+                assert outputs.loss_items is not None
+                metrics[metric_type] = outputs.loss_items[metric_type]
+            else:
+                streaming_metric = self.streaming_metrics[metric_type]
+                metrics[metric_type] = streaming_metric.finalize()
+        if histogram is not None:
+            binary_metric = inference.binary_metric
+            assert binary_metric is not None
+            try:
+                inference.binary_threshold = histogram.binary_threshold(binary_metric)
+            except ValueError:
+                # only this update is skipped, the previous threshold is kept
+                pass
+            threshold = inference.binary_threshold
+            # metrics which rely on predictions should use the current threshold,
+            # and `argmax` is equivalent to a threshold of 0.5 in binary cases
+            if threshold is None:
+                threshold = 0.5
+            for metric_type, streaming_metric in self.streaming_metrics.items():
+                if not streaming_metric.requires_prob:
+                    try:
+                        metric = histogram.binary_metric(metric_type, threshold)
+                    except ValueError:
+                        continue
+                    metrics[metric_type] = metric
+        return outputs, metrics
+
+    def _compute_metrics(
+        self,
+        binary_outputs: Optional[InferenceOutputs],
+        loader: Optional[PrefetchLoader],
+        loader_name: Optional[str],
+        metrics_kwargs: Optional[Dict[str, Dict[str, Any]]],
+        update_binary_threshold: bool,
+        inference: InferenceProtocol,
+        state: TrainerState,
+    ) -> Tuple[InferenceOutputs, Dict[str, float]]:
+        if loader is None:
+            loader = self.validation_loader
+            loader_name = self.validation_loader_name
+        use_streaming = self.streaming_metrics is not None
+        if binary_outputs is not None or metrics_kwargs is not None:
+            use_streaming = False
+        if update_binary_threshold and not use_streaming:
+            msg = "`update_binary_threshold` is only available with streaming metrics"
+            raise ValueError(msg)
+        if use_streaming:
+            return self._get_streaming_metrics(
+                loader,
+                loader_name,
+                update_binary_threshold,
+                inference,
+                state,
+            )
+        return self._get_metrics(
+            binary_outputs,
+            loader,
+            loader_name,
+            metrics_kwargs,
+            inference,
+            state,
+        )
+
+    def _get_intermediate(
+        self,
+        metrics: Dict[str, float],
+        is_custom_loader: bool,
+        state: Optional[TrainerState] = None,
+    ) -> IntermediateResults:
+        if state is None:
+            state = self.state
+        use_decayed = False
+        signs: Dict[str, int] = {}
+        decayed_metrics: Dict[str, float] = {}
+        for metric_type, metric_ins in self.metrics.items():
+            signs[metric_type] = -1 if metric_ins is None else metric_ins.sign
+            if self.metrics_decay is not None and state.should_start_snapshot:
                 use_decayed = True
+                sub_metric = metrics[metric_type]
                 decayed = self.metrics_decay[metric_type].update("metric", sub_metric)
                 decayed_metrics[metric_type] = decayed
         metrics_for_scoring = decayed_metrics if use_decayed else metrics
         if not is_custom_loader:
             if self._epoch_tqdm is not None:
                 self._epoch_tqdm.set_postfix(metrics_for_scoring)
-            self._log_scalars(metrics_for_scoring)
+            self._log_scalars(metrics_for_scoring, state.step)
         weighted_metrics = {
             k: float(v * self.metrics_weights[k])
             for k, v in metrics_for_scoring.items()
         }
         weighted_scores = {k: v * signs[k] for k, v in weighted_metrics.items()}
-        return outputs, IntermediateResults(
+        return IntermediateResults(
             metrics,
             weighted_metrics,
             weighted_scores,
@@ -1172,9 +2168,40 @@ class Trainer(MonitoredMixin):
             decayed_metrics,
         )
 
-    def save_checkpoint(self, score: float, folder: Optional[str] = None) -> None:
+    def get_metrics(
+        self,
+        *,
+        binary_outputs: Optional[InferenceOutputs] = None,
+        loader: Optional[PrefetchLoader] = None,
+        loader_name: Optional[str] = None,
+        metrics_kwargs: Optional[Dict[str, Dict[str, Any]]] = None,
+        update_binary_threshold: bool = False,
+    ) -> Tuple[InferenceOutputs, IntermediateResults]:
+        outputs, metrics = self._compute_metrics(
+            binary_outputs,
+            loader,
+            loader_name,
+            metrics_kwargs,
+            update_binary_threshold,
+            self.inference,
+            self.state,
+        )
+        return outputs, self._get_intermediate(metrics, loader is not None)
+
+    def save_checkpoint(
+        self,
+        score: float,
+        folder: Optional[str] = None,
+        *,
+        model: Optional[ModelProtocol] = None,
+        state: Optional[TrainerState] = None,
+    ) -> None:
         if folder is None:
             folder = self.checkpoint_folder
+        if model is None:
+            model = self.model
+        if state is None:
+            state = self.state
         # leave top_k snapshots only
         if self.state.max_snapshot_file > 0:
             checkpoints = self.model.sorted_checkpoints(folder)
@@ -1183,8 +2210,8 @@ class Trainer(MonitoredMixin):
                     self.checkpoint_scores.pop(file)
                     os.remove(os.path.join(folder, file))
         # pt
-        file = f"{self.model.pt_prefix}{self.state.epoch}.pt"
-        torch.save(self.model.state_dict(), os.path.join(folder, file))
+        file = f"{self.model.pt_prefix}{state.epoch}.pt"
+        torch.save(model.state_dict(), os.path.join(folder, file))
         # scores
         self.checkpoint_scores[file] = score
         with open(os.path.join(folder, self.model.scores_file), "w") as f:
@@ -1205,7 +2232,10 @@ __all__ = [
     "IntermediateResults",
     "MonitoredMixin",
     "TrainMonitor",
+    "AdaptiveMonitor",
     "MonitorResults",
+    "AsyncMonitorJob",
+    "MlflowBatchLogger",
     "TrainerCallback",
     "Trainer",
 ]
@@ -0,0 +1,53 @@
+import time
+import torch
+import cflearn
+
+import numpy as np
+
+from typing import Any
+from typing import Dict
+from typing import Tuple
+
+
+# compares training & inference speed of fp32 and bf16 autocast (`use_amp`) on cpu.
+# bf16 will only be faster on cores with native bf16 support (e.g. avx512_bf16 / amx)
+
+
+num_samples = 20000
+num_features = 600  # fcnn will use [1024, 1024] hidden units
+num_repeat = 3
+
+x = np.random.random([num_samples, num_features]).astype(np.float32)
+y = (x.sum(1, keepdims=True) > 0.5 * num_features).astype(np.int64)
+
+
+def benchmark(use_amp: bool) -> Tuple[float, float]:
+    kwargs: Dict[str, Any] = dict(
+        task_type="clf",
+        fixed_epoch=2,
+        batch_size=512,
+        use_amp=use_amp,
+        use_tqdm=False,
+        logging_folder=f"__cpu_amp_{use_amp}__",
+    )
+    fit_times, predict_times = [], []
+    for _ in range(num_repeat):
+        m = cflearn.make(**kwargs)
+        t = time.time()
+        m.fit(x, y)
+        fit_times.append(time.time() - t)
+        t = time.time()
+        m.predict_prob(x)
+        predict_times.append(time.time() - t)
+        cflearn._rmtree(kwargs["logging_folder"])
+    return min(fit_times), min(predict_times)
+
+
+if __name__ == "__main__":
+    print(f"torch {torch.__version__}, {torch.get_num_threads()} threads")
+    fp32_fit, fp32_predict = benchmark(False)
+    bf16_fit, bf16_predict = benchmark(True)
+    print(f"fit     : fp32 {fp32_fit:.3f}s | bf16 {bf16_fit:.3f}s")
+    print(f"predict : fp32 {fp32_predict:.3f}s | bf16 {bf16_predict:.3f}s")
+    print(f"speedup : fit x{fp32_fit / bf16_fit:.2f}")
+    print(f"speedup : predict x{fp32_predict / bf16_predict:.2f}")
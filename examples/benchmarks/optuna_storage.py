@@ -0,0 +1,66 @@
+import os
+import sys
+import time
+import shutil
+import optuna
+import multiprocessing
+
+from typing import Any
+from typing import List
+from cflearn.dist.storage import make_storage
+from cflearn.dist.storage import journal_prefix
+
+
+# compares the shared optuna storages used by `optuna_tune` when `num_jobs` > 1.
+# objectives are trivial, so the wall time is dominated by storage accesses
+
+
+num_workers = 8
+num_trials = 40
+folder = "__optuna_storage__"
+
+
+def _work(uri: str, barrier: Any, elapsed: Any) -> None:
+    optuna.logging.set_verbosity(optuna.logging.ERROR)
+    storage = make_storage(uri)
+    assert storage is not None
+    study = optuna.load_study(study_name="benchmark", storage=storage)
+    # process booting & importing are excluded
+    barrier.wait()
+    t = time.time()
+    study.optimize(lambda t_: t_.suggest_float("x", 0.0, 1.0), n_trials=num_trials)
+    elapsed.put(time.time() - t)
+
+
+def benchmark(uri: str) -> float:
+    optuna.logging.set_verbosity(optuna.logging.ERROR)
+    storage = make_storage(uri)
+    optuna.create_study(study_name="benchmark", storage=storage)
+    ctx = multiprocessing.get_context("spawn")
+    barrier = ctx.Barrier(num_workers)
+    elapsed = ctx.Queue()
+    processes: List[Any] = []
+    for _ in range(num_workers):
+        process = ctx.Process(target=_work, args=(uri, barrier, elapsed))
+        process.start()
+        processes.append(process)
+    results = [elapsed.get() for _ in range(num_workers)]
+    for process in processes:
+        process.join()
+    return max(results)
+
+
+if __name__ == "__main__":
+    print(f"optuna {optuna.__version__}, {os.cpu_count()} cpus, {sys.platform}")
+    print(f"{num_workers} workers x {num_trials} trials")
+    results = {}
+    for name, uri in [
+        ("sqlite", f"sqlite:///{folder}/shared.db"),
+        ("journal", f"{journal_prefix}{os.path.abspath(folder)}/shared.journal"),
+    ]:
+        shutil.rmtree(folder, ignore_errors=True)
+        os.makedirs(folder)
+        results[name] = benchmark(uri)
+        print(f"{name:8}: {results[name]:.3f}s")
+    shutil.rmtree(folder, ignore_errors=True)
+    print(f"speedup : x{results['sqlite'] / results['journal']:.2f}")
@@ -0,0 +1,58 @@
+import time
+import torch
+import cflearn
+
+import numpy as np
+
+from typing import Any
+from typing import Dict
+from typing import List
+
+
+# compares training `num_replica` replicas one by one, as a population stepped in
+# lockstep, and as a vectorized population (stacked parameters, see `population`)
+
+
+num_samples = 20000
+num_features = 32
+num_replica = 4
+
+x = np.random.random([num_samples, num_features]).astype(np.float32)
+y = (x.sum(1, keepdims=True) > 0.5 * num_features).astype(np.int64)
+
+
+def make(model: str) -> List[cflearn.Pipeline]:
+    kwargs: Dict[str, Any] = dict(
+        task_type="clf",
+        fixed_epoch=2,
+        batch_size=128,
+        use_tqdm=False,
+        verbose_level=0,
+    )
+    return [
+        cflearn.make(model, logging_folder=f"__population_{i}__", **kwargs)
+        for i in range(num_replica)
+    ]
+
+
+def benchmark(model: str, mode: str) -> float:
+    pipelines = make(model)
+    seeds = list(range(num_replica))
+    t = time.time()
+    if mode == "one by one":
+        for m in pipelines:
+            m.fit(x, y)
+    else:
+        vectorize = mode == "vectorized"
+        cflearn.fit_population(pipelines, x, y, seeds=seeds, vectorize=vectorize)
+    elapsed = time.time() - t
+    for i in range(num_replica):
+        cflearn._rmtree(f"__population_{i}__")
+    return elapsed
+
+
+if __name__ == "__main__":
+    print(f"torch {torch.__version__}, {torch.get_num_threads()} threads")
+    for model in ["linear", "fcnn"]:
+        for mode in ["one by one", "lockstep", "vectorized"]:
+            print(f"{model:<6} | {mode:<10} : {benchmark(model, mode):.3f}s")
@@ -1,12 +1,28 @@
 import os
+import sys
+import json
+import optuna
 import cflearn
 import platform
 import unittest
 
 import numpy as np
 
+from typing import Any
+from typing import Dict
 from cftool.misc import shallow_copy_dict
 from cfdata.tabular import TabularDataset
+from cflearn.dist import task_log_file
+from cflearn.dist import close_worker_pools
+from cflearn.dist import get_task_status
+from cflearn.dist import JournalFileStorage
+from cflearn.dist.storage import make_storage
+from cflearn.dist.storage import journal_prefix
+from cflearn.dist.storage import is_journal_available
+from cflearn.dist.storage import _optuna_major_version
+from cflearn.dist.task import set_task_status
+from cflearn.dist.scheduler import task_history_file
+from cflearn.dist.scheduler import TaskHistory
 
 num_jobs = 0 if platform.system() == "Linux" else 2
 logging_folder = "__test_dist__"
@@ -42,6 +58,318 @@ class TestDist(unittest.TestCase):
         )
         cflearn._rmtree(logging_folder)
 
+    @unittest.skipUnless(hasattr(os, "sched_getaffinity"), "affinity is not supported")
+    def test_thread_config(self) -> None:
+        # records the thread limits & affinity seen by each task process
+        script = (
+            "import os, sys, json; "
+            "folder = sys.argv[-1]; "
+            "info = [os.environ.get('OMP_NUM_THREADS'), "
+            "sorted(os.sched_getaffinity(0))]; "
+            "json.dump(info, open(os.path.join(folder, 'info.json'), 'w'))"
+        )
+        run_command = f'{sys.executable} -c "{script}"'
+        thread_config = {"num_threads": 1, "pin_cores": True}
+        experiment = cflearn.Experiment(num_jobs=2, thread_config=thread_config)
+        for _ in range(4):
+            experiment.add_task(root_workplace=logging_folder, run_command=run_command)
+        results = experiment.run_tasks(use_tqdm=False)
+        for workplace in results.workplaces:
+            with open(os.path.join(workplace, "info.json"), "r") as f:
+                num_threads, cores = json.load(f)
+            self.assertEqual(num_threads, "1")
+            self.assertEqual(len(cores), 1)
+        cflearn._rmtree(logging_folder)
+
+    def test_worker_pool(self) -> None:
+        x, y = TabularDataset.iris().xy
+        experiment = cflearn.Experiment(num_jobs=2, executor="pool")
+        data_folder = experiment.dump_data_bundle(x, y, workplace=logging_folder)
+        common_kwargs = {
+            "root_workplace": logging_folder,
+            "data_folder": data_folder,
+            "config": kwargs,
+        }
+        experiment.add_task(model="fcnn", **shallow_copy_dict(common_kwargs))
+        # kills the worker which is running this task
+        experiment.add_task(
+            model="crash",
+            root_workplace=logging_folder,
+            run_command="kill -9 $PPID",
+        )
+        experiment.add_task(model="fcnn", **shallow_copy_dict(common_kwargs))
+        results = experiment.run_tasks(use_tqdm=False)
+        pool = experiment.pool
+        assert pool is not None
+        self.assertEqual(list(pool.failures), [1])
+        self.assertTrue(pool.is_alive)
+        for i in [0, 2]:
+            workplace = results.workplaces[i]
+            self.assertTrue(os.path.isfile(os.path.join(workplace, task_log_file)))
+            cflearn.task_loader(workplace).predict(x)
+        # workers are reused by later experiments
+        pids = pool.pids
+        experiment = cflearn.Experiment(num_jobs=2, executor="pool")
+        experiment.add_task(model="fcnn", **shallow_copy_dict(common_kwargs))
+        experiment.run_tasks(use_tqdm=False)
+        self.assertIs(experiment.pool, pool)
+        self.assertEqual(pool.pids, pids)
+        # `Parallel` is not used by the pool
+        with self.assertRaises(ValueError):
+            experiment.run_tasks(use_tqdm=False, sleep=1.0)
+        close_worker_pools()
+        cflearn._rmtree(logging_folder)
+
+    def test_result_cache(self) -> None:
+        x, y = TabularDataset.iris().xy
+        cache_folder = os.path.join(logging_folder, "__cache__")
+        common_kwargs: Dict[str, Any] = {
+            "num_repeat": 2,
+            "cache_folder": cache_folder,
+            "use_tqdm": False,
+            "fixed_epoch": 2,
+        }
+        folder0 = os.path.join(logging_folder, "0")
+        folder1 = os.path.join(logging_folder, "1")
+        r0 = cflearn.repeat_with(x, y, temp_folder=folder0, **common_kwargs)
+        # identical cells are restored from cache, even in the distributed path
+        r1 = cflearn.repeat_with(
+            x,
+            y,
+            models=["fcnn", "linear"],
+            num_jobs=2,
+            temp_folder=folder1,
+            **common_kwargs,
+        )
+        experiment = r1.experiment
+        assert experiment is not None
+        self.assertEqual(experiment.cached, [("fcnn", "0"), ("fcnn", "1")])
+        assert r0.pipelines is not None and r1.pipelines is not None
+        for m0, m1 in zip(r0.pipelines["fcnn"], r1.pipelines["fcnn"]):
+            p0, p1 = m0.predict_prob(x), m1.predict_prob(x)
+            self.assertTrue(np.allclose(p0, p1))  # type: ignore
+        # newly trained cells are stored as well
+        r2 = cflearn.repeat_with(
+            x,
+            y,
+            models="linear",
+            temp_folder=folder0,
+            **common_kwargs,
+        )
+        assert r2.pipelines is not None
+        for m1, m2 in zip(r1.pipelines["linear"], r2.pipelines["linear"]):
+            p1, p2 = m1.predict_prob(x), m2.predict_prob(x)
+            self.assertTrue(np.allclose(p1, p2))  # type: ignore
+        cflearn._rmtree(logging_folder)
+
+    def test_result_cache_sample_weights(self) -> None:
+        x, y = TabularDataset.iris().xy
+        cache_folder = os.path.join(logging_folder, "__cache__")
+        weights = np.ones(len(x), np.float32)
+        modified = weights.copy()
+        modified[0] = 2.0
+
+        def _run(sample_weights: np.ndarray) -> Any:
+            experiment = cflearn.Experiment(num_jobs=0, cache_folder=cache_folder)
+            experiment.add_task(
+                x,
+                y,
+                model="linear",
+                config={"fixed_epoch": 1},
+                root_workplace=logging_folder,
+                sample_weights=sample_weights,
+            )
+            experiment.run_tasks(use_tqdm=False)
+            return experiment.cached
+
+        self.assertEqual(_run(weights), [])
+        self.assertEqual(_run(weights), [("linear", "0")])
+        # only the sample weights are changed
+        self.assertEqual(_run(modified), [])
+        cflearn._rmtree(logging_folder)
+
+    def test_scheduler(self) -> None:
+        x, y = TabularDataset.iris().xy
+        experiment = cflearn.Experiment(num_jobs=0, executor="scheduler")
+        data_folder = experiment.dump_data_bundle(x, y, workplace=logging_folder)
+        common_kwargs: Dict[str, Any] = {
+            "root_workplace": logging_folder,
+            "data_folder": data_folder,
+        }
+        experiment.add_task(model="linear", config={"fixed_epoch": 1}, **common_kwargs)
+        experiment.add_task(model="fcnn", config={"fixed_epoch": 2}, **common_kwargs)
+        experiment.add_task(
+            model="linear",
+            config={"fixed_epoch": 2},
+            resources={"cost": 1.0e12},
+            **common_kwargs,
+        )
+        results = experiment.run_tasks(use_tqdm=False)
+        # longest tasks first
+        scheduler = experiment.scheduler
+        assert scheduler is not None
+        self.assertEqual(scheduler.order, [2, 1, 0])
+        for workplace in results.workplaces:
+            cflearn.task_loader(workplace).predict(x)
+        history = TaskHistory(os.path.join(logging_folder, task_history_file))
+        self.assertEqual(len(history.records), 3)
+        # similar tasks are estimated from past runs
+        experiment = cflearn.Experiment(num_jobs=0, executor="scheduler")
+        experiment.add_task(model="fcnn", config={"fixed_epoch": 2}, **common_kwargs)
+        experiment.add_task(model="fcnn", config={"fixed_epoch": 4}, **common_kwargs)
+        seen, unseen = map(experiment.estimate_resources, experiment.tasks)
+        fcnn_record = list(history.records.values())[1]
+        self.assertEqual(seen.cost, fcnn_record["seconds"])
+        self.assertEqual(seen.memory_mb, fcnn_record["peak_rss_mb"])
+        seconds_per_cost = history.seconds_per_cost
+        assert seconds_per_cost is not None
+        expected = 2.0 * fcnn_record["cost"] * seconds_per_cost
+        self.assertAlmostEqual(unseen.cost / expected, 1.0)
+        cflearn._rmtree(logging_folder)
+
+    def test_resume(self) -> None:
+        x, y = TabularDataset.iris().xy
+        data_folder = cflearn.Experiment.dump_data_bundle(
+            x, y, workplace=logging_folder
+        )
+
+        def _experiment(fixed_epoch: int) -> cflearn.Experiment:
+            experiment = cflearn.Experiment()
+            for epoch in [1, fixed_epoch, 1]:
+                experiment.add_task(
+                    model="linear",
+                    root_workplace=logging_folder,
+                    data_folder=data_folder,
+                    config={"fixed_epoch": epoch},
+                )
+            return experiment
+
+        results = _experiment(1).run_tasks(use_tqdm=False)
+        for task_status in results.statuses.values():
+            assert task_status is not None
+            self.assertTrue(task_status.is_done)
+            self.assertEqual(len(task_status.artifacts or []), 1)
+        # simulates a task which was interrupted
+        set_task_status(results.workplaces[1], "running")
+        mtime = os.path.getmtime(results.workplaces[0])
+        experiment = _experiment(1)
+        experiment.run_tasks(use_tqdm=False, resume=True)
+        self.assertEqual(experiment.finished, [("linear", "0"), ("linear", "2")])
+        self.assertEqual(os.path.getmtime(results.workplaces[0]), mtime)
+        task_status = get_task_status(results.workplaces[1])
+        assert task_status is not None
+        self.assertEqual(task_status.status, "done")
+        # modified tasks will be executed again
+        experiment = _experiment(2)
+        experiment.run_tasks(use_tqdm=False, resume=True)
+        self.assertEqual(experiment.finished, [("linear", "0"), ("linear", "2")])
+        loaded = cflearn.Experiment.load_results(logging_folder)
+        self.assertEqual(loaded.workplace_keys, results.workplace_keys)
+        self.assertEqual(loaded.workplaces, results.workplaces)
+        cflearn.load_experiment_results(loaded)["linear"][1].predict(x)
+        cflearn._rmtree(logging_folder)
+
+    def test_resume_with_new_data(self) -> None:
+        x, y = TabularDataset.iris().xy
+        common_kwargs: Dict[str, Any] = {
+            "models": "linear",
+            "num_repeat": 1,
+            "num_jobs": 0,
+            "sequential": False,
+            "resume": True,
+            "temp_folder": logging_folder,
+            "use_tqdm": False,
+            "fixed_epoch": 1,
+        }
+        cflearn.repeat_with(x, y, **common_kwargs)
+        experiment = cflearn.repeat_with(x, y, **common_kwargs).experiment
+        assert experiment is not None
+        self.assertEqual(experiment.finished, [("linear", "0")])
+        # data is re-dumped under the same `temp_folder`, so tasks will be retrained
+        x_new, y_new = x[::-1].copy(), y[::-1].copy()
+        experiment = cflearn.repeat_with(x_new, y_new, **common_kwargs).experiment
+        assert experiment is not None
+        self.assertEqual(experiment.finished, [])
+        cflearn._rmtree(logging_folder)
+
+    def test_task_signature(self) -> None:
+        weights = np.ones(10000, np.float32)
+        modified = weights.copy()
+        modified[5000] = 2.0
+        # reprs of large arrays are truncated, so they should be hashed by contents
+        self.assertEqual(repr(weights), repr(modified))
+        signatures = [
+            cflearn.Task(workplace=logging_folder, sample_weights=w).signature
+            for w in [weights, weights.copy(), modified]
+        ]
+        self.assertEqual(signatures[0], signatures[1])
+        self.assertNotEqual(signatures[0], signatures[2])
+
+    def test_lazy_loading(self) -> None:
+        x, y = TabularDataset.iris().xy
+        result = cflearn.repeat_with(
+            x,
+            y,
+            models=["fcnn", "linear"],
+            num_repeat=2,
+            num_jobs=0,
+            sequential=False,
+            return_patterns=False,
+            temp_folder=logging_folder,
+            use_tqdm=False,
+            fixed_epoch=2,
+        )
+        self.assertIsNone(result.pipelines)
+        assert result.handles is not None and result.final_results is not None
+        handles = [h for v in result.handles.values() for h in v]
+        # scores are read without loading the pipelines
+        self.assertFalse(any(handle.is_loaded for handle in handles))
+        lazy_scores = [r.final_score for v in result.final_results.values() for r in v]
+        experiment = result.experiment
+        assert experiment is not None and experiment.results is not None
+        ms = cflearn.load_experiment_results(experiment.results, num_jobs=2)
+        loaded = [m for v in ms.values() for m in v]
+        for handle, m, score in zip(handles, loaded, lazy_scores):
+            final_results = m.trainer.final_results
+            assert final_results is not None
+            self.assertEqual(score, final_results.final_score)
+            self.assertTrue(np.allclose(handle.predict(x), m.predict(x)))  # type: ignore
+            self.assertTrue(handle.is_loaded)
+        cflearn._rmtree(logging_folder)
+
+    @unittest.skipUnless(is_journal_available(), "journal is not available")
+    def test_make_storage(self) -> None:
+        path = os.path.abspath(os.path.join(logging_folder, "shared.journal"))
+        uri = f"{journal_prefix}{path}"
+        storage = make_storage(uri)
+        assert storage is not None
+        study = optuna.create_study(storage=storage, study_name="test")
+        study.optimize(lambda t: t.suggest_float("x", 0.0, 1.0), 2)
+        loaded = optuna.load_study(study_name="test", storage=storage)
+        self.assertEqual(len(loaded.trials), 2)
+        cflearn._rmtree(logging_folder)
+
+    @unittest.skipUnless(platform.system() != "Windows", "flock is not available")
+    @unittest.skipUnless(_optuna_major_version() < 3, "optuna ships JournalStorage")
+    def test_journal_storage(self) -> None:
+        path = os.path.join(logging_folder, "journal.log")
+        storage = JournalFileStorage(path)
+        study = optuna.create_study(storage=storage, study_name="test")
+        study.optimize(lambda t: t.suggest_float("x", 0.0, 1.0), 5)
+        # another replica (e.g. in another process) sees & extends the same study
+        loaded = optuna.load_study(study_name="test", storage=JournalFileStorage(path))
+        self.assertEqual(len(loaded.trials), 5)
+        loaded.optimize(lambda t: t.suggest_float("x", 0.0, 1.0), 3)
+        self.assertEqual([t.number for t in study.trials], list(range(8)))
+        self.assertEqual(study.best_value, loaded.best_value)
+        # incomplete records left by crashed processes are dropped
+        with open(path, "ab") as f:
+            f.write(b"\x80\x04incomplete")
+        study.optimize(lambda t: t.suggest_float("x", 0.0, 1.0), 1)
+        loaded = optuna.load_study(study_name="test", storage=JournalFileStorage(path))
+        self.assertEqual(len(loaded.trials), 9)
+        cflearn._rmtree(logging_folder)
+
 
 if __name__ == "__main__":
     unittest.main()
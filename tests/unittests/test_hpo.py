@@ -0,0 +1,125 @@
+import os
+import optuna
+import cflearn
+import unittest
+
+import numpy as np
+
+from typing import Any
+from typing import Dict
+from optuna.trial import TrialState
+from cflearn.api.hpo import _scale_epochs
+
+temp_folder = "__test_hpo__"
+
+
+class TestHPO(unittest.TestCase):
+    def test_prune_repeats(self) -> None:
+        x = np.random.random([1000, 5])
+        y = (x.sum(1, keepdims=True) > 2.5).astype(np.int64)
+        kwargs: Dict[str, Any] = {
+            "model": "linear",
+            "task_type": "clf",
+            "num_trial": 2,
+            "num_repeat": 3,
+            "temp_folder": temp_folder,
+            "extra_config": {"fixed_epoch": 4},
+            "prune_repeats": True,
+        }
+        # every reported value is below the threshold, so every trial is pruned
+        pruner = optuna.pruners.ThresholdPruner(lower=1.0e9)
+        study_config: Dict[str, Any] = {"pruner": pruner}
+        result = cflearn.optuna_tune(x, y, study_config=study_config, **kwargs)
+        for trial in result.study.trials:
+            self.assertEqual(trial.state, TrialState.PRUNED)
+            self.assertEqual(len(trial.intermediate_values), 1)
+        cflearn._rmtree(temp_folder)
+        study_config = {"pruner": optuna.pruners.NopPruner()}
+        result = cflearn.optuna_tune(x, y, study_config=study_config, **kwargs)
+        stride = 1000000
+        for trial in result.study.trials:
+            self.assertEqual(trial.state, TrialState.COMPLETE)
+            steps = set(trial.intermediate_values)
+            for i in range(3):
+                self.assertIn((i + 1) * stride - 1, steps)
+            value = trial.value
+            assert value is not None
+            self.assertAlmostEqual(trial.intermediate_values[3 * stride - 1], value)
+        cflearn._rmtree(temp_folder)
+
+    def test_multi_fidelity(self) -> None:
+        fidelities = cflearn.get_fidelities(5, {})
+        self.assertEqual([f.resource for f in fidelities], [1, 3, 9])
+        self.assertEqual([f.num_repeat for f in fidelities], [1, 2, 5])
+        self.assertAlmostEqual(fidelities[0].data_ratio, 1.0 / 9.0)
+        self.assertEqual(fidelities[-1].data_ratio, 1.0)
+        # epochs set through `trainer_config` are scaled as well
+        config: Dict[str, Any] = {"trainer_config": {"num_epoch": 90}}
+        _scale_epochs(config, 1.0 / 9.0)
+        trainer_config = config["trainer_config"]
+        self.assertEqual(trainer_config["num_epoch"], 10)
+        self.assertEqual(trainer_config["max_epoch"], 22)
+        x = np.random.random([1000, 5])
+        y = (x.sum(1, keepdims=True) > 2.5).astype(np.int64)
+        result = cflearn.optuna_tune(
+            x,
+            y,
+            model="linear",
+            task_type="clf",
+            num_trial=4,
+            num_repeat=2,
+            temp_folder=temp_folder,
+            extra_config={"fixed_epoch": 3},
+            fidelity_config={},
+        )
+        tuner = result.tuner
+        self.assertEqual(len(tuner.subset_indices), 2)
+        small, large = sorted(tuner.subset_indices.values(), key=len)
+        self.assertTrue(np.isin(small, large).all())
+        for trial in result.study.trials:
+            steps = sorted(trial.intermediate_values)
+            self.assertEqual(steps, [1, 3, 9][: len(steps)])
+            if trial.state == TrialState.COMPLETE:
+                self.assertEqual(steps, [1, 3, 9])
+        # file datasets cannot be subsampled
+        os.makedirs(temp_folder, exist_ok=True)
+        file = os.path.join(temp_folder, "data.csv")
+        np.savetxt(file, np.hstack([x, y]), delimiter=",")
+        with self.assertRaises(ValueError):
+            cflearn.optuna_tune(
+                file,
+                model="linear",
+                task_type="clf",
+                temp_folder=temp_folder,
+                extra_config={"delim": ","},
+                fidelity_config={"min_data_ratio": 0.5},
+            )
+        cflearn._rmtree(temp_folder)
+
+    def test_reuse_trials(self) -> None:
+        x = np.random.random([1000, 5])
+        y = (x.sum(1, keepdims=True) > 2.5).astype(np.int64)
+        auto = cflearn.Auto("clf", models="linear").fit(
+            x,
+            y,
+            num_trial=3,
+            num_repeat=2,
+            num_final_repeat=3,
+            reuse_top_k=1,
+            temp_folder=temp_folder,
+            extra_config={"fixed_epoch": 2},
+        )
+        best_trial = auto.studies["linear"].best_trial
+        pipelines = auto.pipelines["linear"]  # type: ignore
+        self.assertEqual(len(pipelines), 3)
+        # the first two pipelines are trained by the best trial
+        optuna_folder = os.path.join(temp_folder, "__optuna__")
+        trial_folder = os.path.join(optuna_folder, str(best_trial.number))
+        for m in pipelines[:2]:
+            self.assertTrue(m.logging_folder.startswith(trial_folder))
+        self.assertEqual(auto.predict(x).shape, (1000, 1))
+        cflearn._rmtree(temp_folder)
+
+
+if __name__ == "__main__":
+    unittest.main()
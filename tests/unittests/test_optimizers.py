@@ -0,0 +1,66 @@
+import copy
+import torch
+import unittest
+
+import torch.nn as nn
+
+from typing import Any
+from typing import Dict
+from cflearn.modules import optimizer_dict
+
+
+class TestOptimizers(unittest.TestCase):
+    @staticmethod
+    def _net() -> nn.Sequential:
+        torch.manual_seed(142857)
+        # many small tensors with different shapes & dtypes
+        net = nn.Sequential(
+            nn.Linear(8, 16),
+            nn.ReLU(),
+            nn.Linear(16, 4),
+            nn.ModuleList([nn.Embedding(5, 3) for _ in range(6)]),
+        )
+        net[2].double()
+        return net
+
+    @staticmethod
+    def _loss(
+        net: nn.Sequential,
+        x: torch.Tensor,
+        indices: torch.Tensor,
+    ) -> torch.Tensor:
+        hidden = net[1](net[0](x))
+        out = net[2](hidden.double()).float()
+        embeddings = [emb(indices) for emb in net[3]]
+        return out.square().mean() + torch.cat(embeddings, 1).square().mean()
+
+    def _check(self, name: str, config: Dict[str, Any]) -> None:
+        reference = self._net()
+        net = copy.deepcopy(reference)
+        base = optimizer_dict[name]
+        reference_opt = base(reference.parameters(), **config)
+        opt = base(net.parameters(), foreach=True, **config)
+        for i in range(20):
+            x = torch.randn(32, 8)
+            indices = torch.randint(0, 5, [32])
+            for m, o in [(reference, reference_opt), (net, opt)]:
+                o.zero_grad()
+                self._loss(m, x, indices).backward()
+                o.step()
+        for p0, p1 in zip(reference.parameters(), net.parameters()):
+            self.assertTrue(torch.allclose(p0, p1, atol=1.0e-6))
+
+    def test_nag(self) -> None:
+        self._check("nag", {"lr": 1.0e-2, "momentum": 0.9, "weight_decay": 1.0e-4})
+
+    def test_madgrad(self) -> None:
+        self._check("madgrad", {"lr": 1.0e-2})
+        self._check("madgrad", {"lr": 1.0e-2, "momentum": 0.9, "weight_decay": 1e-4})
+
+    def test_ranger(self) -> None:
+        self._check("ranger", {"lr": 1.0e-2})
+        self._check("ranger", {"lr": 1.0e-2, "k": 3, "weight_decay": 1.0e-4})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,592 @@
+import os
+import json
+import time
+import torch
+import random
+import cflearn
+import unittest
+
+import numpy as np
+
+from typing import Any
+from typing import Dict
+from typing import Set
+from typing import List
+from typing import Optional
+from cftool.ml import Metrics
+from cflearn.trainer import Trainer
+from cflearn.trainer import MlflowBatchLogger
+from cflearn.data import TabularLoader
+from cflearn.population import StackedReplicas
+from cflearn.misc.metrics import ProbabilityHistogram
+
+logging_folder = "__test_trainer__"
+
+
+class Interrupted(Exception):
+    pass
+
+
+def _seed() -> None:
+    random.seed(142857)
+    np.random.seed(142857)
+    torch.manual_seed(142857)
+
+
+class TestTrainer(unittest.TestCase):
+    def test_resume(self) -> None:
+        x = np.random.random([2000, 10])
+        y = (x.sum(1, keepdims=True) > 5.0).astype(np.int64)
+        # interrupt in the middle of an accumulation with `num_accumulate` > 1
+        for num_accumulate in [1, 3]:
+            kwargs = {
+                "task_type": "clf",
+                "fixed_epoch": 4,
+                "use_tqdm": False,
+                "ema_decay": 0.9,
+                "accumulate_grad_batches": num_accumulate,
+                "trainer_config": {"resumable": True},
+            }
+            folder0 = f"{logging_folder}/0"
+            folder1 = f"{logging_folder}/1"
+            folder2 = f"{logging_folder}/2"
+            _seed()
+            m = cflearn.make(logging_folder=folder0, **kwargs).fit(x, y)  # type: ignore
+            predictions = m.predict_prob(x)
+
+            original_step = Trainer._step
+
+            def _interrupted_step(self: Trainer, batch_idx: int, *args: Any) -> Any:
+                last_micro_batch = batch_idx % num_accumulate == num_accumulate - 1
+                if self.state.step == 17 and last_micro_batch:
+                    raise Interrupted
+                return original_step(self, batch_idx, *args)
+
+            Trainer._step = _interrupted_step  # type: ignore
+            _seed()
+            try:
+                with self.assertRaises(Interrupted):
+                    m = cflearn.make(logging_folder=folder1, **kwargs)  # type: ignore
+                    m.fit(x, y)
+            finally:
+                Trainer._step = original_step  # type: ignore
+
+            m = cflearn.make(logging_folder=folder2, **kwargs)  # type: ignore
+            m.fit(x, y, resume_from=folder1)
+            self.assertTrue(np.allclose(m.predict_prob(x), predictions))  # type: ignore
+            cflearn._rmtree(logging_folder)
+
+    def test_mlflow_batch_logger(self) -> None:
+        class FakeClient:
+            def __init__(self, num_failures: int) -> None:
+                self.num_failures = num_failures
+                self.batches: List[Dict[str, Any]] = []
+
+            def log_batch(self, run_id: str, **kwargs: Any) -> None:
+                if self.num_failures > 0:
+                    self.num_failures -= 1
+                    raise RuntimeError("storage is unavailable")
+                self.batches.append(kwargs)
+
+        client = FakeClient(1)
+        logger = MlflowBatchLogger(client, "run", flush_interval=0.01)  # type: ignore
+        logger.log_metric("loss", 1.0, step=1)
+        logger._flush_event.set()
+        time.sleep(0.5)
+        # the worker survives the failed flush
+        self.assertTrue(logger._thread.is_alive())
+        logger.log_param("lr", 0.1)
+        logger.log_metric("loss", 0.5, step=2)
+        logger.close()
+        self.assertFalse(logger._thread.is_alive())
+        params = [p for batch in client.batches for p in batch.get("params", [])]
+        metrics = [m for batch in client.batches for m in batch.get("metrics", [])]
+        self.assertEqual([p.key for p in params], ["lr"])
+        # the failed flush is retried
+        self.assertEqual([m.step for m in metrics], [1, 2])
+        # items are dropped after `max_retries` consecutive failures
+        client = FakeClient(100)
+        logger = MlflowBatchLogger(client, "run", max_retries=2)  # type: ignore
+        logger.log_metric("loss", 1.0, step=1)
+        logger.close()
+        self.assertEqual(client.num_failures, 97)
+        self.assertEqual(logger._metrics, [])
+
+    def test_streaming_metrics(self) -> None:
+        x = np.random.random([1000, 10])
+        y_clf = (x.sum(1, keepdims=True) > 5.0).astype(np.int64)
+        y_reg = x.sum(1, keepdims=True)
+        for task_type, y, metrics in [
+            ("clf", y_clf, ["acc", "auc"]),
+            ("reg", y_reg, ["mae", "mse"]),
+        ]:
+            m = cflearn.make(
+                task_type=task_type,
+                metric_config={"types": metrics, "streaming": True},
+                fixed_epoch=2,
+                use_tqdm=False,
+                logging_folder=logging_folder,
+            ).fit(x, y)
+            trainer = m.trainer
+            self.assertIsNotNone(trainer.streaming_metrics)
+            streaming = trainer.get_metrics()[1].metrics
+            streaming_metrics = trainer.streaming_metrics
+            trainer.streaming_metrics = None
+            try:
+                full = trainer.get_metrics()[1].metrics
+            finally:
+                trainer.streaming_metrics = streaming_metrics
+            for k, v in full.items():
+                # auc is computed from histograms, so it is an approximation
+                places = 3 if k == "auc" else 5
+                self.assertAlmostEqual(streaming[k], v, places=places)
+        m = cflearn.make(fixed_epoch=1, use_tqdm=False, logging_folder=logging_folder)
+        self.assertIsNone(m.fit(x, y_clf).trainer.streaming_metrics)
+        cflearn._rmtree(logging_folder)
+
+    def test_streaming_binary_threshold_failure(self) -> None:
+        x = np.random.random([1000, 10])
+        y = (x.sum(1, keepdims=True) > 5.0).astype(np.int64)
+        m = cflearn.make(
+            metric_config={"types": "acc", "streaming": True},
+            fixed_epoch=1,
+            use_tqdm=False,
+            logging_folder=logging_folder,
+        ).fit(x, y)
+        trainer = m.trainer
+        inference = trainer.inference
+        threshold = inference.binary_threshold
+        self.assertIsNotNone(threshold)
+
+        def _failed(self: ProbabilityHistogram, *args: Any) -> float:
+            raise ValueError("no valid threshold")
+
+        original_binary_threshold = ProbabilityHistogram.binary_threshold
+        ProbabilityHistogram.binary_threshold = _failed  # type: ignore
+        try:
+            trainer._get_streaming_metrics(
+                trainer.validation_loader,
+                trainer.validation_loader_name,
+                True,
+                inference,
+                trainer.state,
+            )
+        finally:
+            ProbabilityHistogram.binary_threshold = original_binary_threshold  # type: ignore
+        # the previous threshold is kept
+        self.assertEqual(inference.binary_threshold, threshold)
+        cflearn._rmtree(logging_folder)
+
+    def test_histogram_binary_threshold(self) -> None:
+        num_samples = 5000
+        y = np.random.randint(0, 2, [num_samples, 1])
+        noise = np.random.randn(num_samples) * 0.25
+        p1 = np.clip(0.35 + 0.3 * y[..., 0] + noise, 0.0, 1.0)
+        probabilities = np.stack([1.0 - p1, p1], axis=1).astype(np.float32)
+        histogram = ProbabilityHistogram(10000)
+        for i in range(0, num_samples, 512):
+            histogram.update(
+                torch.from_numpy(y[i : i + 512]),
+                torch.from_numpy(probabilities[i : i + 512]),
+            )
+
+        def _acc(threshold: float) -> float:
+            predictions = (probabilities[..., 1] >= threshold).astype(np.int64)
+            return (predictions == y[..., 0]).mean().item()
+
+        for metric_type in ["acc", "ber"]:
+            threshold = histogram.binary_threshold(metric_type)
+            gt = Metrics.get_binary_threshold(y, probabilities, metric_type)
+            self.assertAlmostEqual(_acc(threshold), _acc(gt), places=3)
+            acc = histogram.binary_metric("acc", threshold)
+            self.assertAlmostEqual(acc, _acc(threshold), places=3)
+
+    def test_adaptive_monitor(self) -> None:
+        x = np.random.random([5000, 10])
+        y = (x[..., :1] > 0.8).astype(np.int64)
+        config = {"adaptive_monitor_config": {"min_subsample": 10}}
+        m = cflearn.make(
+            task_type="clf",
+            fixed_epoch=3,
+            use_tqdm=False,
+            trainer_config=config,
+            logging_folder=logging_folder,
+        ).fit(x, y)
+        trainer = m.trainer
+        subsample_loader = trainer._subsample_loader
+        adaptive_monitor = trainer._adaptive_monitor
+        assert subsample_loader is not None
+        assert adaptive_monitor is not None
+        validation_data = trainer.validation_loader.data
+        num_subsample = subsample_loader.loader.num_samples
+        expected = len(validation_data) * 0.2
+        self.assertAlmostEqual(num_subsample / expected, 1.0, places=1)
+        indices = adaptive_monitor.subsample_indices(validation_data)
+        y_sub = validation_data.processed.y[indices]
+        self.assertAlmostEqual(y_sub.mean(), validation_data.processed.y.mean(), 2)
+        final_results = trainer.final_results
+        assert final_results is not None
+        self.assertFalse(np.isnan(final_results.final_score))
+        cflearn._rmtree(logging_folder)
+
+    def test_async_monitor(self) -> None:
+        x = np.random.random([5000, 10])
+        y = (x.sum(1, keepdims=True) > 5.0).astype(np.int64)
+        submitted: List[int] = []
+        handled: List[int] = []
+        original_submit = Trainer._submit_async_monitor
+        original_handle = Trainer._handle_intermediate
+
+        def _recorded_submit(self: Trainer) -> None:
+            submitted.append(self.state.step)
+            original_submit(self)
+
+        def _recorded_handle(self: Trainer, state: Any = None) -> bool:
+            handled.append((state or self.state).step)
+            return original_handle(self, state)
+
+        Trainer._submit_async_monitor = _recorded_submit  # type: ignore
+        Trainer._handle_intermediate = _recorded_handle  # type: ignore
+        try:
+            m = cflearn.make(
+                task_type="clf",
+                fixed_epoch=4,
+                use_tqdm=False,
+                ema_decay=0.9,
+                trainer_config={"async_monitor_config": {"max_staleness": 1}},
+                logging_folder=logging_folder,
+            ).fit(x, y)
+        finally:
+            Trainer._submit_async_monitor = original_submit  # type: ignore
+            Trainer._handle_intermediate = original_handle  # type: ignore
+        trainer = m.trainer
+        self.assertIsNone(trainer._async_executor)
+        self.assertIsNone(trainer._async_pending)
+        self.assertTrue(trainer.checkpoint_scores)
+        # results are handled with the states of the evaluated steps
+        self.assertTrue(handled)
+        self.assertEqual(handled, submitted)
+        final_results = trainer.final_results
+        assert final_results is not None
+        self.assertFalse(np.isnan(final_results.final_score))
+        cflearn._rmtree(logging_folder)
+
+    def test_async_monitor_shutdown(self) -> None:
+        x = np.random.random([1000, 10])
+        y = (x.sum(1, keepdims=True) > 5.0).astype(np.int64)
+        m = cflearn.make(
+            task_type="clf",
+            fixed_epoch=2,
+            use_tqdm=False,
+            trainer_config={"async_monitor_config": {"max_staleness": 1}},
+            logging_folder=logging_folder,
+        )
+        original_step = Trainer._step
+
+        def _interrupted_step(self: Trainer, *args: Any) -> Any:
+            if self.state.step == 3:
+                raise Interrupted
+            return original_step(self, *args)
+
+        Trainer._step = _interrupted_step  # type: ignore
+        try:
+            with self.assertRaises(Interrupted):
+                m.fit(x, y)
+        finally:
+            Trainer._step = original_step  # type: ignore
+        self.assertIsNone(m.trainer._async_executor)
+        cflearn._rmtree(logging_folder)
+
+    def test_cpu_amp(self) -> None:
+        x = np.random.random([1000, 10])
+        y = (x.sum(1, keepdims=True) > 5.0).astype(np.int64)
+        m = cflearn.make(
+            task_type="clf",
+            fixed_epoch=2,
+            use_tqdm=False,
+            use_amp=True,
+            logging_folder=logging_folder,
+        ).fit(x, y)
+        trainer = m.trainer
+        self.assertFalse(trainer.grad_scaler.is_enabled())
+        probabilities = m.predict_prob(x)
+        assert isinstance(probabilities, np.ndarray)
+        self.assertEqual(probabilities.dtype, np.float32)
+        self.assertTrue(np.isfinite(probabilities).all())
+        cflearn._rmtree(logging_folder)
+
+    def test_accumulate_grad_batches(self) -> None:
+        x = np.random.random([1000, 10])
+        y = x.sum(1, keepdims=True)
+        predictions = []
+        for batch_size, num_accumulate in [(128, 1), (64, 2)]:
+            _seed()
+            m = cflearn.make(
+                "linear",
+                task_type="reg",
+                batch_size=batch_size,
+                accumulate_grad_batches=num_accumulate,
+                fixed_epoch=3,
+                optimizer="sgd",
+                scheduler=None,
+                clip_norm=1.0,
+                ema_decay=0.9,
+                use_tqdm=False,
+                logging_folder=logging_folder,
+            ).fit(x, y)
+            self.assertEqual(m.trainer.state.batch_size, 128)
+            predictions.append(m.predict(x))
+        p0, p1 = predictions
+        self.assertTrue(np.allclose(p0, p1, atol=1.0e-5))  # type: ignore
+        cflearn._rmtree(logging_folder)
+
+    def test_telemetry(self) -> None:
+        x = np.random.random([1000, 10])
+        y = (x.sum(1, keepdims=True) > 5.0).astype(np.int64)
+        m = cflearn.make(
+            task_type="clf",
+            fixed_epoch=2,
+            use_tqdm=False,
+            trainer_config={"telemetry_config": {"flush_interval": 4}},
+            logging_folder=logging_folder,
+        ).fit(x, y)
+        trainer = m.trainer
+        telemetry = trainer.telemetry
+        assert telemetry is not None
+        with open(telemetry.jsonl_path, "r") as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(len(records), 2 * trainer.state.num_step_per_epoch)
+        self.assertEqual([r["step"] for r in records], list(range(1, len(records) + 1)))
+        for record in records:
+            phases = sum(record[k] for k in telemetry.phases) + record["other"]
+            self.assertAlmostEqual(phases, record["wall"], places=4)
+            self.assertGreater(record["samples_per_sec"], 0.0)
+        with open(telemetry.summary_path, "r") as f:
+            summary = json.load(f)
+        self.assertLessEqual(summary["wall"]["p50"], summary["wall"]["p99"])
+        self.assertTrue(os.path.isfile(telemetry.summary_path))
+        cflearn._rmtree(logging_folder)
+
+    def test_profile_fit(self) -> None:
+        x = np.random.random([1000, 10])
+        y = (x.sum(1, keepdims=True) > 5.0).astype(np.int64)
+        m = cflearn.make(
+            task_type="clf",
+            use_tqdm=False,
+            logging_folder=logging_folder,
+        )
+        m.profile_fit(x, y, num_steps=3, num_warmup=1)
+        self.assertEqual(m.trainer.state.epoch, -1)
+        profiler_folder = m.trainer.profiler_folder
+        with open(os.path.join(profiler_folder, "trace.json"), "r") as f:
+            trace = json.load(f)
+        names = {event.get("name") for event in trace["traceEvents"]}
+        for phase in ["forward", "backward", "optimizer", "monitor"]:
+            self.assertIn(f"cflearn::{phase}", names)
+        self.assertIn("PrefetchLoader.wait", names)
+        self.assertTrue(os.path.isfile(os.path.join(profiler_folder, "operators.txt")))
+        cflearn._rmtree(logging_folder)
+
+    def test_memory_summary(self) -> None:
+        x = np.random.random([1000, 10])
+        y = (x.sum(1, keepdims=True) > 5.0).astype(np.int64)
+        m = cflearn.make(
+            task_type="clf",
+            fixed_epoch=1,
+            use_tqdm=False,
+            ema_decay=0.9,
+            logging_folder=logging_folder,
+        ).fit(x, y)
+        stages = ["start", "read data", "split data", "init data", "prepare modules"]
+        self.assertEqual(list(m.memory_stages), stages + ["fit"])
+        # memory summary is only computed on demand
+        self.assertFalse(os.path.isfile(f"{logging_folder}/__memory__.txt"))
+        predictions = m.predict_prob(x)
+        msg = m.memory_summary(return_only=True)
+        # and it does not touch the model (e.g. running stats of batch norm)
+        self.assertTrue(np.allclose(m.predict_prob(x), predictions))  # type: ignore
+        lines = {line.split()[0]: line.split()[1:] for line in msg.split("\n") if line}
+        # ema keeps two copies of each trainable parameter as buffers
+        params = float(lines["Total"][-5])
+        self.assertAlmostEqual(float(lines["ema"][-2]), 2 * params, places=3)
+        self.assertGreater(float(lines["Total"][-1]), 0.0)
+        cflearn._rmtree(logging_folder)
+
+    def test_population(self) -> None:
+        x = np.random.random([1000, 10])
+        y = (x.sum(1, keepdims=True) > 5.0).astype(np.int64)
+        pipelines = [
+            cflearn.make(
+                task_type="clf",
+                fixed_epoch=fixed_epoch,
+                use_tqdm=False,
+                logging_folder=f"{logging_folder}/{i}",
+            )
+            for i, fixed_epoch in enumerate([1, 3, 3])
+        ]
+        counts: Dict[int, int] = {}
+        original_train_step = Trainer._train_step
+
+        def _counted_train_step(self: Trainer, *args: Any) -> Any:
+            counts[id(self)] = counts.get(id(self), 0) + 1
+            return original_train_step(self, *args)
+
+        Trainer._train_step = _counted_train_step  # type: ignore
+        try:
+            cflearn.fit_population(pipelines, x, y, seeds=[0, 1, 2])
+        finally:
+            Trainer._train_step = original_train_step  # type: ignore
+        # the replica which finishes early leaves the population
+        steps = [counts[id(m.trainer)] for m in pipelines]
+        self.assertEqual(3 * steps[0], steps[1])
+        self.assertEqual(steps[1], steps[2])
+        # data are processed only once
+        for m in pipelines[1:]:
+            self.assertIs(m.tr_data, pipelines[0].tr_data)
+            self.assertIn("share data", m.memory_stages)
+        predictions = [m.predict_prob(x) for m in pipelines]
+        self.assertFalse(np.allclose(predictions[1], predictions[2]))  # type: ignore
+        saving_folder = f"{logging_folder}/saved"
+        cflearn.save(pipelines[2], saving_folder=saving_folder)
+        loaded = cflearn.load(saving_folder=saving_folder)["fcnn"][0]
+        loaded_predictions = loaded.predict_prob(x)
+        self.assertTrue(np.allclose(loaded_predictions, predictions[2]))  # type: ignore
+        cflearn._rmtree(logging_folder)
+
+    def test_vectorized_population(self) -> None:
+        x = np.random.random([1000, 10])
+        y = (x.sum(1, keepdims=True) > 5.0).astype(np.int64)
+
+        def _fit(model: str, vectorize: bool) -> List[cflearn.Pipeline]:
+            pipelines = [
+                cflearn.make(
+                    model,
+                    task_type="clf",
+                    fixed_epoch=fixed_epoch,
+                    use_tqdm=False,
+                    logging_folder=f"{logging_folder}/{i}",
+                )
+                for i, fixed_epoch in enumerate([1, 3, 3])
+            ]
+            _seed()
+            cflearn.fit_population(
+                pipelines,
+                x,
+                y,
+                seeds=[0, 1, 2],
+                vectorize=vectorize,
+            )
+            return pipelines
+
+        num_stacked: List[int] = []
+        original_step = StackedReplicas.step
+
+        def _counted_step(self: StackedReplicas, *args: Any) -> Any:
+            outputs = original_step(self, *args)
+            if outputs is not None:
+                num_stacked.append(len(outputs))
+            return outputs
+
+        StackedReplicas.step = _counted_step  # type: ignore
+        try:
+            # vectorized passes should match one by one passes
+            vectorized = _fit("linear", True)
+            self.assertTrue(num_stacked)
+            # the replica which finishes early leaves the stack
+            self.assertEqual(set(num_stacked), {2, 3})
+            separated = _fit("linear", False)
+            for m1, m2 in zip(vectorized, separated):
+                p1, p2 = m1.predict_prob(x), m2.predict_prob(x)
+                self.assertTrue(np.allclose(p1, p2, atol=1.0e-4))  # type: ignore
+            # batch norm & dropout can be vectorized as well
+            num_stacked.clear()
+            pipelines = _fit("fcnn", True)
+            self.assertTrue(num_stacked)
+        finally:
+            StackedReplicas.step = original_step  # type: ignore
+        # replicas are split back into independent models
+        for m in pipelines:
+            assert m.model is not None
+            for param in m.model.parameters():
+                num_bytes = param.numel() * param.element_size()
+                self.assertEqual(param.untyped_storage().nbytes(), num_bytes)
+        predictions = [m.predict_prob(x) for m in pipelines]
+        self.assertFalse(np.allclose(predictions[1], predictions[2]))  # type: ignore
+        cflearn._rmtree(logging_folder)
+
+    def test_repeat_population(self) -> None:
+        x = np.random.random([1000, 10])
+        y = (x.sum(1, keepdims=True) > 5.0).astype(np.int64)
+        indices: List[int] = []
+
+        def _callback(model: str, i: int, m: cflearn.Pipeline) -> None:
+            indices.append(i)
+
+        results = cflearn.repeat_with(
+            x,
+            y,
+            num_repeat=3,
+            temp_folder=logging_folder,
+            use_tqdm=False,
+            repeat_callback=_callback,
+            population=True,
+            task_type="clf",
+            fixed_epoch=2,
+        )
+        self.assertEqual(indices, [0, 1, 2])
+        pipelines: Optional[List[cflearn.Pipeline]] = None
+        if results.pipelines is not None:
+            pipelines = results.pipelines["fcnn"]
+        assert pipelines is not None
+        self.assertEqual(len(pipelines), 3)
+        for m in pipelines[1:]:
+            self.assertIs(m.tr_data, pipelines[0].tr_data)
+        cflearn._rmtree(logging_folder)
+
+    def test_bootstrap_bagging(self) -> None:
+        x = np.random.random([1000, 10])
+        y = (x.sum(1, keepdims=True) > 5.0).astype(np.int64)
+        seen: Dict[int, Set[int]] = {}
+        original_train_step = Trainer._train_step
+
+        def _recorded_train_step(self: Trainer, *args: Any) -> Any:
+            indices = seen.setdefault(id(self), set())
+            indices.update(np.asarray(args[2]).ravel().tolist())
+            return original_train_step(self, *args)
+
+        ensemble = cflearn.Ensemble({"task_type": "clf", "fixed_epoch": 2})
+        # bootstrap models are always trained in current process
+        with self.assertRaises(ValueError):
+            ensemble.bagging(x, y, k=3, num_jobs=2, bootstrap=True)
+        Trainer._train_step = _recorded_train_step  # type: ignore
+        try:
+            results = ensemble.bagging(
+                x,
+                y,
+                k=3,
+                temp_folder=logging_folder,
+                use_tqdm=False,
+                bootstrap=True,
+                seeds=[0, 1, 2],
+            )
+        finally:
+            Trainer._train_step = original_train_step  # type: ignore
+        pipelines = results.pipelines
+        bags = []
+        for m in pipelines:
+            # bootstrap samples are views over the shared training set
+            tr_loader = m.tr_loader
+            assert isinstance(tr_loader, TabularLoader)
+            assert tr_loader._fixed_indices is not None
+            self.assertIs(tr_loader.data, pipelines[0].tr_data)
+            bag = set(tr_loader._fixed_indices.tolist())
+            self.assertEqual(seen[id(m.trainer)], bag)
+            self.assertLess(len(bag), tr_loader.num_samples)
+            bags.append(bag)
+        self.assertNotEqual(bags[0], bags[1])
+        self.assertEqual(results.pattern.predict(x).shape, y.shape)
+        cflearn._rmtree(logging_folder)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -45,7 +45,7 @@ def test() -> None:
         y = f(x)
         local_export_folder = os.path.join(base_export_folder, task_name)
         local_config = shallow_copy_dict(config)
-        task_meta_kwargs = {}
+        task_meta_kwargs: Dict[str, Any] = {}
         if CI:
             task_meta_kwargs["sample_weights"] = np.random.random(len(x))
         if local_export_folder is not None: